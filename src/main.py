@@ -1,6 +1,21 @@
-import requests
+import asyncio
+import inspect
+import json
+from itertools import groupby
 
 from src.service.util_service import *
+from src.service.job_runner_service import JobRunner, JobResult
+from src.service.browser_farm_service import BrowserFarm
+from src.service.shard_service import ShardedRunner
+from src.repository.job_queue_repository import SqliteJobQueue
+from src.service.daemon_service import ScrapingDaemon
+from src.repository.jsonl_batch_repository import JsonlBatch
+from src.repository.action_checkpoint_repository import ActionCheckpoint
+from src.repository.selector_latency_repository import SelectorLatencies
+from src.service.download_service import DownloadManager, copy_download
+from src.repository.blob_store_repository import BlobStore
+import socket
+from urllib.parse import urlparse
 import datetime as dt
 
 from selenium.webdriver.common.by import By
@@ -17,14 +32,29 @@ class DynamicWebScraping:
     """
     Sample Web Scraping class
     """
-    def __init__(self, config, driver_):
+    def __init__(self, config, driver_, pacer=None, latencies=None, downloads=None):
+        """
+        :param config: the scraping config, dict
+        :param driver_: the driver to run the actions with, CustomDriver
+        :param pacer: pacing engine for the delays between actions, Pacer (defaults to the humanized sleep)
+        :param latencies: learned selector latencies to derive the element timeouts from, SelectorLatencies
+        :param downloads: download manager shared with other scrapers, DownloadManager (defaults to the config's)
+        """
         self.__config = config
+        self.__pacer = pacer
+        self.__latencies = latencies
+        self.__downloads = downloads if downloads is not None else get_download_manager(config)
+        self.__site = urlparse(config.get('url', '')).hostname or ''
+
         self._logger = logger
         self.__debug_mode = config.get("debug", False)
         self.__driver: CustomDriver = driver_
         self.__actions = ActionChains(self.__driver)
         self.path_separator = self.__config.get('separator', '\\')
         self.download_directory = config.get('download_directory', f'.{self.path_separator}')
+        self.results = []
+        # save the progress after every action when a "checkpoint" file is configured
+        self.__checkpoint = ActionCheckpoint(config['checkpoint']) if config.get('checkpoint') else None
 
     async def get_driver(self, url):
         try:
@@ -34,41 +64,146 @@ class DynamicWebScraping:
             logger.error(f"Chrome Driver Initialization Error: {e}")
             raise
 
-    async def run_actions(self, actions, timeout=30):
+    async def run_actions(self, actions, timeout=30, start=0):
         """
         Run the actions that you want to be completed on some web page
         :param actions: the actions to be performed, dict
         :param timeout: default wait time to wait for elements to be found
+        :param start: index of the first action to run, e.g. to resume from a checkpoint, int
+        :return self.results: values collected by the actions (e.g. downloaded files), list
         """
-        index = 0
-        for action in actions:
-            if "wait" in action.keys(): # Sleep
-                self._logger.debug(f'Sleeping for {action["wait"]} seconds')
-                await sleep(action.get('wait', 5))
+        try:
+            for index, action in enumerate(actions):
+                if index < start:
+                    continue
+                completed = await self._run_action(action, timeout, index)
+                if self.__checkpoint is None:
+                    continue
+                if not completed:
+                    # later actions usually depend on this one, stop so the next run resumes from it
+                    raise Exception(f"Action {index} ({action['type']}) failed, progress saved to {self.__checkpoint.path}")
+                await self.__save_checkpoint(index)
+        finally:
+            if self.__latencies is not None:
+                await asyncio.to_thread(self.__latencies.flush)
+
+        if self.__checkpoint is not None:
+            self.__checkpoint.clear()
 
-            self._logger.debug(f'Running {action["type"]} action')
-            match action["type"]:
-                case "click": # click an element
-                    await self._run_click_visible_button(action, timeout, index)
+        if self.__debug_mode:
+            input('Press Enter to close the browser...')
+            await self.__pause(2)
+            await self.close()
+
+        return self.results
 
-                case "download": # download some doc
-                    await self._run_download_document(action, timeout, index)
+    async def _run_action(self, action, timeout=30, index=0):
+        """
+        Run a single action
+        :return completed: False when the action failed, boolean
+        """
+        if self.__pacer is not None:
+            with self.__pacer.action(action["type"]):
+                return await self.__run_paced_action(action, timeout, index)
+        return await self.__run_paced_action(action, timeout, index)
+
+    async def __run_paced_action(self, action, timeout, index):
+        if "wait" in action.keys(): # Sleep
+            self._logger.debug(f'Sleeping for {action["wait"]} seconds')
+            await self.__pause(action.get('wait', 5))
+
+        self._logger.debug(f'Running {action["type"]} action')
+        match action["type"]:
+            case "click": # click an element
+                return await self._run_click_visible_button(action, timeout, index)
+
+            case "download": # download some doc
+                return await self._run_download_document(action, timeout, index)
+
+            case "external_click": # for pop up window
+                return await self._run_popup_window(action)
+
+            case "input": # type input fields
+                return await self._run_type_input(action, timeout, index)
+
+            case "select": # dropdown selection
+                return await self._run_dropdown_selection(action, timeout, index)
+
+            case "fill_form": # set many form fields at once
+                return await self._run_fill_form(action, timeout, index)
+            # add more custom cases....
+        return True
+
+    async def __pause(self, timeout):
+        """sleep with the pacer when there is one"""
+        if self.__pacer is not None:
+            await self.__pacer(timeout)
+        else:
+            await sleep(timeout)
+
+    async def restore_checkpoint(self):
+        """
+        Restore the cookies and page of the last completed action saved by a previous run
+        :return start: index of the first action that has not completed yet, int
+        """
+        state = self.__checkpoint.load() if self.__checkpoint is not None else None
+        if not state:
+            return 0
 
-                case "external_click": # for pop up window
-                    await self._run_popup_window(action)
+        await self.__driver.set_cookies(state['cookies'])
+        await self.__driver.get(state['url'])
+        self._logger.info(f"Resuming after action {state['index']} on {state['url']}")
+        return state['index'] + 1
 
-                case "input": # type input fields
-                    await self._run_type_input(action, timeout, index)
+    async def __save_checkpoint(self, index):
+        try:
+            url = await self.__driver.current_url()
+            cookies = await self.__driver.get_cookies()
+            self.__checkpoint.save(index, url, cookies)
+        except Exception as e:
+            self._logger.error(f"Error saving the checkpoint after action {index}: {e}")
 
-                case "select": # dropdown selection
-                    await self._run_dropdown_selection(action, timeout, index)
-                # add more custom cases....
-            index += 1
+    async def close(self):
+        """Close the driver, the nodriver close is async while the selenium one is not"""
+        closed = self.__driver.close()
+        if inspect.isawaitable(closed):
+            await closed
 
-        if self.__debug_mode:
-            input('Press Enter to close the browser...')
-            await sleep(2)
-            self.__driver.close()
+    async def _find_element(self, action):
+        """
+        Find the element of an action. With adaptive timeouts the wait comes from how long the selector
+        took to appear before, and how long it takes this time is recorded
+        """
+        xpath = action["xpath"]
+        if self.__latencies is None:
+            return await self.__driver.find_element(by=By.XPATH, value=xpath, action=action)
+
+        timeout = self.__latencies.timeout_for(self.__site, xpath, ceiling=action.get('wait'),
+                                               required=action.get('required', False))
+        element = None
+        try:
+            element = await self.__driver.find_element(by=By.XPATH, value=xpath, action=action, wait_timeout=timeout)
+            return element
+        finally:
+            # elements reused from the driver's handle cache say nothing about how long the page takes
+            if self.__driver.lookup_time is not None:
+                # a miss cut off by a learned timeout shorter than the wait is censored, not a real miss
+                cut_off = timeout is not None and timeout < action.get('wait', float('inf'))
+                self.__latencies.record(self.__site, xpath, self.__driver.lookup_time, found=element is not None,
+                                        timeout=timeout if cut_off else None)
+
+    @staticmethod
+    async def _is_displayed(element):
+        """
+        Whether a found element is visible, nodriver elements answer from the lookup that found them
+        and selenium elements from their (synchronous) is_displayed
+        """
+        if not element:
+            return False
+        displayed = element.is_displayed()
+        if inspect.isawaitable(displayed):
+            displayed = await displayed
+        return displayed
 
     async def _run_popup_window(self, action, timeout= 1, *args, **kwargs):
         """
@@ -76,39 +211,66 @@ class DynamicWebScraping:
         not fully tested
         """
         curr_page = await self.__driver.open_new_window()
-        sub_actions = action.get('sub_actions', [])
-        await self.run_actions(sub_actions)
+        completed = True
+        for index, sub_action in enumerate(action.get('sub_actions', [])):
+            completed = await self._run_action(sub_action, index=index) and completed
         # resume = input('Click enter to return to original window')
         # while self.__driver.get_original_page() != curr_page:
         #     await sleep(timeout)
 
-        await sleep(timeout)
-        return self.__driver.return_to_original_window()
+        await self.__pause(timeout)
+        await self.__driver.return_to_original_window()
+        return completed
 
     async def _run_download_document(self, action, timeout, *args, **kwargs):
         """
-        Download a document with an http get request
+        Download a document with an http get request, or with "browser": true click the element and
+        capture the download the browser starts (for links without a plain href, e.g. generated reports)
         """
         download_directory = f'{self.download_directory}{self.path_separator}{action.get("value")}'
 
         xpath = action["xpath"]
-        element = await self.__driver.find_element(by=By.XPATH, value=xpath, action=action)
-        # await self.__driver.click_element(element=element)
+        element = await self._find_element(action)
+        if action.get('browser'):
+            return await self.__capture_browser_download(action, element, download_directory)
+
         file_url = element.get_attribute('href')
-        filename = f"{download_directory}{self.path_separator}{os.path.basename(file_url)}_{dt.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}"
+        # downloaded under a name that is the same in every run so an interrupted download is resumed from
+        # its partial file, the finished file is linked under a name with the time of the run (a joined
+        # download is shared with other jobs, it is not moved)
+        download_path = f"{download_directory}{self.path_separator}{os.path.basename(file_url)}"
+        filename = f"{download_path}_{dt.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}"
         try:
-            session = requests.Session()
-            with session.get(file_url, timeout=timeout, stream=True) as r:
-                r.raise_for_status()
-                self.__driver.get_cookies()
+            # the browser's cookies keep the request in the scraped session
+            cookies = await self.__driver.get_cookies()
+            download_path = await self.__downloads.download(file_url, download_path, cookies=cookies, timeout=timeout)
+            await asyncio.to_thread(copy_download, download_path, filename)
+            self._logger.info(f'Download Complete')
+            self.results.append(filename)
+            return True
 
-                with open(filename, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                self._logger.info(f'Download Complete')
+        except Exception as e:
+            self._logger.error(f"Error downloading file: {e}")
+            return False
+
+    async def __capture_browser_download(self, action, element, download_directory):
+        """
+        Click the element and wait for the download it starts to complete in the job's download directory
+        """
+        try:
+            await self.__driver.set_download_directory(download_directory)
+            await self.__driver.click_element(element=element)
+            filename = await self.__driver.wait_for_download(timeout=action.get('download_timeout', 60))
+            if self.__downloads.store is not None:
+                # keep one copy of the content, the file becomes a link to it
+                await asyncio.to_thread(self.__downloads.store.add_file, filename)
+            self._logger.info(f'Download Complete: {filename}')
+            self.results.append(filename)
+            return True
 
         except Exception as e:
             self._logger.error(f"Error downloading file: {e}")
+            return False
 
     async def _run_click_visible_button(self, action, *args, **kwargs):
         """
@@ -116,19 +278,24 @@ class DynamicWebScraping:
         """
         try:
             xpath = action["xpath"]
-            btn = await self.__driver.find_element(by=By.XPATH, value=xpath, action=action)
+            btn = await self._find_element(action)
 
             required = action.get('required', False)
-            if required and not (btn and await btn.is_displayed()):
+            if required and not await self._is_displayed(btn):
                 raise Exception(f"The button was not found in the given wait time")
 
             self.__logged_in = False
-            await self.__driver.click_element(element=btn, required=False)
+            if await self.__driver.click_element(element=btn, required=False) is False:
+                # skipped, e.g. the button left the page, the run must not continue past it
+                self._logger.error("Error: Button click error. The button could not be clicked")
+                return False
             self._logger.info("Button was clicked successfully.")
+            return True
 
         except Exception as e:
             # Handle the timeout error if the element is not found
             self._logger.error(f"Error: Button click error. {e}")
+            return False
 
     async def _run_type_input(self, action, *args, **kwargs):
         """
@@ -136,16 +303,18 @@ class DynamicWebScraping:
         """
         try:
             xpath = action["xpath"]
-            typeable_input = await self.__driver.find_element(by=By.XPATH, value=xpath, action=action)
+            typeable_input = await self._find_element(action)
 
             required = action.get('required', False)
-            if required and not (typeable_input and await typeable_input.is_displayed()):
+            if required and not await self._is_displayed(typeable_input):
                 raise Exception(f"The input element was not found in the given wait time")
             await self.__driver.type_input(action=action, element=typeable_input)
+            return True
 
         except Exception as e:
             # Handle the timeout error if the element is not found
             self._logger.error(f"Error: Text input error. {e}")
+            return False
 
     async def _run_dropdown_selection(self, action, *args, **kwargs):
         """
@@ -154,24 +323,410 @@ class DynamicWebScraping:
         try:
             xpath = action["xpath"]
             wait = action.get('wait', 1)
-            dropdown_el = await self.__driver.find_element(by=By.XPATH, value=xpath, action=action) # self.__get_element(xpath, action, index, timeout)
-            await sleep(wait)
+            dropdown_el = await self._find_element(action) # self.__get_element(xpath, action, index, timeout)
+            await self.__pause(wait)
             required = action.get('required', False)
-            if required and not (dropdown_el and await dropdown_el.is_displayed()):
+            if required and not await self._is_displayed(dropdown_el):
                 raise Exception(f"The dropdown was not found in the given wait time")
             await self.__driver.dropdown_select(action=action, element=dropdown_el)
+            return True
 
         except Exception as e:
             self._logger.error(f"Dropdown selection error. {e}")
+            return False
+
+    async def _run_fill_form(self, action, *args, **kwargs):
+        """
+        Set the fields of a form in the order given, each run of consecutive fields is set in one in-page
+        operation, fields flagged as monitored (e.g. with keystroke tracking) are typed one character at a
+        time like an input action instead
+        """
+        try:
+            required = action.get('required', False)
+            completed, filled, typed = True, 0, 0
+            for monitored, run in groupby(action.get('fields', []), key=lambda field: bool(field.get('monitored'))):
+                run = list(run)
+                if monitored:
+                    for field in run:
+                        done = await self._run_type_input({'type': 'input', 'required': required, **field})
+                        completed = done and completed
+                        typed += 1
+                    continue
+
+                done = await self.__driver.fill_form(fields=run)
+                missing = [field['xpath'] for field, set_ in zip(run, done) if not set_]
+                if missing and required:
+                    raise Exception(f"Form fields were not found or could not be set: {missing}")
+                filled += len(run) - len(missing)
+
+            self._logger.info(f"Filled {filled} form fields, typed {typed}.")
+            return completed
+
+        except Exception as e:
+            self._logger.error(f"Form fill error. {e}")
+            return False
 
         ######################### Add more custom actions below #########################
 
+# one latency store per file so the jobs of a process share what they learned
+latency_stores = {}
+
+def get_selector_latencies(job_config):
+    """
+    Get the selector latency store of the "adaptive_timeouts" config section
+    :param job_config: job config, dict
+    :return latencies: the shared store or None when adaptive timeouts are off, SelectorLatencies
+    """
+    settings = job_config.get('adaptive_timeouts')
+    if not settings:
+        return None
+    settings = {} if settings is True else dict(settings)
+    path = settings.pop('path', 'selector_latencies.db')
+    if path not in latency_stores:
+        latency_stores[path] = SelectorLatencies(path, **settings)
+    return latency_stores[path]
+
+# one download manager per "downloads" config so the jobs of a process share its connection pool
+download_managers = {}
+
+def get_download_manager(job_config):
+    """
+    Get the download manager of the "downloads" config section, e.g. {"per_host": 4, "store": "downloads/.store"}
+    :param job_config: job config, dict
+    :return downloads: the shared manager, DownloadManager
+    """
+    settings = job_config.get('downloads') or {}
+    key = json.dumps(settings, sort_keys=True)
+    if key not in download_managers:
+        settings = dict(settings)
+        store = settings.pop('store', None)
+        download_managers[key] = DownloadManager(store=BlobStore(store) if store else None, **settings)
+    return download_managers[key]
+
+async def run_job(job, pool=None, open_driver=None):
+    """
+    Run a single {"url": ..., "actions": [...]} job with its own driver
+    :param job: job config, overrides the top level config, dict
+    :param pool: browser pool to lease the browser from, BrowserPool
+    :param open_driver: func that creates the job's driver from the job's pacer instead of a new
+        CustomDriver (e.g. a tab scoped driver), func
+    :return results: values collected by the job's actions, list
+    """
+    # debug mode waits on input() which would block every other job on the loop, and a top level
+    # checkpoint would be shared by every job, only the job's own "checkpoint" is used
+    job_config = {**config, 'debug': False, 'checkpoint': None, **job}
+    pacer = Pacer.from_config(job_config)
+    driver = open_driver(pacer) if open_driver is not None else CustomDriver(timeout=10, pool=pool, pacer=pacer)
+    web_scraper = DynamicWebScraping(job_config, driver, pacer=pacer, latencies=get_selector_latencies(job_config))
+    try:
+        await web_scraper.get_driver(job_config['url'])
+        start = await web_scraper.restore_checkpoint()
+        return await web_scraper.run_actions(job_config.get('actions', []), start=start)
+    finally:
+        await web_scraper.close()
+
+def log_job_results(results):
+    """Log how many jobs completed and why the others failed"""
+    failed = [r for r in results if not r.ok]
+    for result in failed:
+        logger.error(f"Job {result.job.get('url')} failed: {result.error}")
+    logger.info(f"Completed {len(results) - len(failed)}/{len(results)} jobs")
+
+async def run_jobs(jobs, workers=4, pool=None):
+    """
+    Run many jobs concurrently with a bounded number of scrapers
+    :param jobs: list of {"url": ..., "actions": [...]} jobs, list
+    :param workers: max number of jobs running at the same time, int
+    :param pool: browser pool shared by the jobs, BrowserPool
+    :return results: a JobResult per job in the same order as the jobs, list
+    """
+    runner = JobRunner(lambda job: run_job(job, pool=pool), workers=workers)
+    results = await runner.run(jobs)
+    log_job_results(results)
+    return results
+
+async def run_jobs_in_tabs(jobs, tabs=8, isolated=False):
+    """
+    Run many jobs concurrently in separate tabs of a single browser (nodriver only).
+    One browser with several tabs uses a fraction of the memory of one browser per job
+    :param jobs: list of {"url": ..., "actions": [...]} jobs, list
+    :param tabs: max number of tabs running jobs at the same time, int
+    :param isolated: give every job its own browser context so cookies/ storage are not shared, boolean
+    :return results: a JobResult per job in the same order as the jobs, list
+    """
+    # tabs and contexts are a nodriver capability, not part of the driver interface
+    capability = 'open_context' if isolated else 'open_tab'
+    if not hasattr(CustomDriver, capability):
+        raise Exception(f"Jobs in {'isolated contexts' if isolated else 'tabs'} are only supported by the nodriver driver")
+
+    browser_driver = CustomDriver(timeout=10)
+    await browser_driver.get('about:blank')
+
+    def job_driver(pacer):
+        # the job's pacer paces the tab, the browser driver's sleep is only the fallback
+        return browser_driver.open_context(sleep=pacer) if isolated else browser_driver.open_tab(sleep=pacer)
+
+    try:
+        runner = JobRunner(lambda job: run_job(job, open_driver=job_driver), workers=tabs)
+        results = await runner.run(jobs)
+    finally:
+        await browser_driver.close()
+    log_job_results(results)
+    return results
+
+async def run_jobs_on_farm(jobs, endpoints, workers=4, isolated=False):
+    """
+    Run many jobs on a farm of already running browsers (nodriver only).
+    Every job runs in its own tab of the least busy browser
+    :param jobs: list of {"url": ..., "actions": [...]} jobs, list
+    :param endpoints: remote debugging addresses of the browsers, e.g. ["localhost:9222"], list
+    :param workers: max number of jobs running at the same time, int
+    :param isolated: give every job its own browser context so cookies/ storage are not shared, boolean
+    :return results: a JobResult per job in the same order as the jobs, list
+    """
+    if not hasattr(CustomDriver, 'connect_browser'):
+        raise Exception("Browser endpoints are only supported by the nodriver driver")
+    farm = BrowserFarm(NoDriverService.connect_browser, disconnect=NoDriverService.disconnect_browser,
+                       endpoints=endpoints, capacity=config.get('endpoint_capacity'),
+                       alive=NoDriverService.browser_alive)
+
+    async def run_farm_job(job):
+        endpoint, browser = await farm.lease()
+        try:
+            return await run_job(job, open_driver=lambda pacer: CustomDriver(timeout=10, browser=browser,
+                                                                              isolated=isolated, pacer=pacer))
+        finally:
+            await farm.release(endpoint)
+
+    try:
+        results = await JobRunner(run_farm_job, workers=workers).run(jobs)
+    finally:
+        await farm.close()
+    log_job_results(results)
+    return results
+
+async def run_pooled_jobs(jobs, workers=4):
+    """
+    Run many jobs concurrently, concurrent jobs need their own browsers so they are always pooled
+    :param jobs: list of {"url": ..., "actions": [...]} jobs, list
+    :param workers: max number of jobs running at the same time, int
+    :return results: a JobResult per job in the same order as the jobs, list
+    """
+    pool_config = config.get('browser_pool', {'min_size': 0, 'max_size': workers, 'spares': 0})
+    pool = await create_browser_pool(pool_config)
+    try:
+        return await run_jobs(jobs, workers=workers, pool=pool)
+    finally:
+        await pool.close()
+
+def run_shard(jobs):
+    """
+    Entry point of a sharded worker process, runs its jobs on its own event loop and browser pool
+    :param jobs: this process's share of the jobs, list
+    :return results: a JobResult per job, the errors as their repr since selenium/ cdp exceptions may not unpickle, list
+    """
+    results = asyncio.run(run_pooled_jobs(jobs, workers=config.get('workers', 4)))
+    return [JobResult(r.job, result=r.result, error=repr(r.error) if r.error is not None else None) for r in results]
+
+async def run_sharded_jobs(jobs, processes=None):
+    """
+    Run many jobs across several processes, jobs for the same domain always run in the same process
+    :param jobs: list of {"url": ..., "actions": [...]} jobs, list
+    :param processes: number of worker processes, int (defaults to the number of cores)
+    :return results: a JobResult per job in the same order as the jobs, list
+    """
+    results = await ShardedRunner(run_shard, processes=processes).run(jobs)
+    log_job_results(results)
+    return results
+
+async def consume_queue(queue, workers=4, pool=None, stop_when_empty=True, poll_interval=1):
+    """
+    Pull jobs from a durable job queue and run them, several runners (on several nodes) can consume
+    the same queue. Leases are kept alive with heartbeats while a job runs
+    :param queue: the job queue, SqliteJobQueue
+    :param workers: max number of jobs running at the same time, int
+    :param pool: browser pool shared by the jobs, BrowserPool
+    :param stop_when_empty: return once the queue is drained instead of polling forever, boolean
+    :param poll_interval: seconds to wait before polling an empty queue again, float
+    """
+    owner_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+    async def heartbeat(leased_job):
+        while True:
+            await asyncio.sleep(queue.visibility_timeout / 3)
+            if not await asyncio.to_thread(queue.heartbeat, leased_job):
+                logger.error(f"Lost the lease on job {leased_job.id}")
+                return
+
+    async def work(index):
+        owner = f"{owner_prefix}-{index}"
+        while True:
+            leased_job = await asyncio.to_thread(queue.lease, owner)
+            if leased_job is None:
+                # retries waiting on their backoff and jobs leased by other runners still count as work left
+                if stop_when_empty and not await asyncio.to_thread(queue.pending):
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+
+            heartbeat_task = asyncio.create_task(heartbeat(leased_job))
+            try:
+                result = await run_job(leased_job.job, pool=pool)
+                await asyncio.to_thread(queue.complete, leased_job, result)
+            except Exception as e:
+                logger.error(f"Job {leased_job.id} failed on attempt {leased_job.attempts}: {e}")
+                await asyncio.to_thread(queue.fail, leased_job, e)
+            finally:
+                heartbeat_task.cancel()
+
+    await asyncio.gather(*(work(index) for index in range(workers)))
+    logger.info(f"Job queue counts: {await asyncio.to_thread(queue.counts)}")
+
+async def run_queue(queue_config, jobs=(), workers=4):
+    """
+    Queue the jobs (if any) and consume the queue with a pooled set of workers
+    :param queue_config: "queue" section of the config, dict
+    :param jobs: list of {"url": ..., "actions": [...]} jobs to add to the queue, list
+    :param workers: max number of jobs running at the same time, int
+    """
+    queue = SqliteJobQueue(queue_config['path'], visibility_timeout=queue_config.get('visibility_timeout', 300),
+                           max_attempts=queue_config.get('max_attempts', 3))
+    if jobs:
+        queue.enqueue_many(jobs)
+    pool_config = config.get('browser_pool', {'min_size': 0, 'max_size': workers, 'spares': 0})
+    pool = await create_browser_pool(pool_config)
+    try:
+        await consume_queue(queue, workers=workers, pool=pool, stop_when_empty=queue_config.get('stop_when_empty', True))
+    finally:
+        await pool.close()
+
+async def consume_batch(batch, workers=4, pool=None, max_in_flight=None):
+    """
+    Stream the jobs of a jsonl batch into the job runner, only max_in_flight jobs are read ahead at a time
+    so the file is never loaded into memory. The batch checkpoint moves as the jobs finish
+    :param batch: the batch to run, JsonlBatch
+    :param workers: max number of jobs running at the same time, int
+    :param pool: browser pool shared by the jobs, BrowserPool
+    :param max_in_flight: max jobs read from the file and not finished yet, int (defaults to 2 * workers)
+    :return completed, failed: number of jobs that completed and failed, tuple
+    """
+    in_flight = asyncio.Semaphore(max_in_flight or 2 * workers)
+    pending = set()
+    counts = {'completed': 0, 'failed': 0}
+    runner = JobRunner(lambda job: run_job(job, pool=pool), workers=workers).start()
+
+    def job_finished(offset, future):
+        result = future.result()
+        if result.ok:
+            counts['completed'] += 1
+        else:
+            counts['failed'] += 1
+            logger.error(f"Job {result.job.get('url')} on the line at byte {offset} failed: {result.error}")
+        # failed jobs count as finished too, otherwise one bad line would hold the checkpoint forever
+        batch.finish(offset)
+        pending.discard(future)
+        in_flight.release()
+
+    # the file is read in a worker thread, a slow disk never blocks the running jobs
+    jobs = iter(batch)
+    try:
+        while True:
+            await in_flight.acquire()
+            item = await asyncio.to_thread(next, jobs, None)
+            if item is None:
+                in_flight.release()
+                break
+            offset, job = item
+            future = runner.submit(job)
+            pending.add(future)
+            future.add_done_callback(lambda f, offset=offset: job_finished(offset, f))
+        if pending:
+            await asyncio.wait(set(pending))
+    finally:
+        await runner.stop()
+        await asyncio.to_thread(batch.save_checkpoint)
+    logger.info(f"Batch {batch.path}: completed {counts['completed']}, failed {counts['failed']} jobs")
+    return counts['completed'], counts['failed']
+
+async def run_batch(batch_config, workers=4):
+    """
+    Run the jobs of a jsonl batch file with a pooled set of workers, resuming at the checkpoint
+    :param batch_config: "batch" section of the config, dict
+    :param workers: max number of jobs running at the same time, int
+    """
+    batch = JsonlBatch(batch_config['path'], checkpoint_path=batch_config.get('checkpoint'),
+                       checkpoint_interval=batch_config.get('checkpoint_interval', 1.0))
+    if batch.offset:
+        logger.info(f"Resuming batch {batch.path} at byte {batch.offset}")
+    pool_config = config.get('browser_pool', {'min_size': 0, 'max_size': workers, 'spares': 0})
+    pool = await create_browser_pool(pool_config)
+    try:
+        return await consume_batch(batch, workers=workers, pool=pool, max_in_flight=batch_config.get('max_in_flight'))
+    finally:
+        await pool.close()
+
+async def run_daemon(daemon_config, workers=4):
+    """
+    Run as a resident daemon that takes jobs over a local http api, the browsers stay warm between jobs
+    so a submitted job starts on an already running browser
+    :param daemon_config: "daemon" section of the config, dict
+    :param workers: max number of jobs running at the same time, int
+    """
+    pool_config = config.get('browser_pool', {'min_size': 1, 'max_size': workers, 'spares': 1})
+    pool = await create_browser_pool(pool_config)
+    daemon = ScrapingDaemon(lambda job: run_job(job, pool=pool), workers=workers,
+                            host=daemon_config.get('host', '127.0.0.1'), port=daemon_config.get('port', 8765),
+                            unix_socket=daemon_config.get('unix_socket'), on_shutdown=pool.close)
+    await daemon.serve_forever()
+
 async def main():
-    driver = CustomDriver(timeout=10)
-    web_scraper = DynamicWebScraping(config, driver)  # config is read in the settings.py file at the top level of the project
-    # get driver
-    await web_scraper.get_driver(config["url"])
-    await web_scraper.run_actions(config['actions'])
+    if config.get('checkpoint') and any(config.get(mode) for mode in ('batch', 'daemon', 'queue', 'jobs')):
+        raise Exception('A top level "checkpoint" only works for a single run, set a "checkpoint" per job instead')
+
+    if config.get('batch'):
+        await run_batch(config['batch'], workers=config.get('workers', 4))
+        return
+
+    if config.get('daemon'):
+        await run_daemon(config['daemon'], workers=config.get('workers', 4))
+        return
+
+    if config.get('queue'):
+        await run_queue(config['queue'], jobs=config.get('jobs', []), workers=config.get('workers', 4))
+        return
+
+    if config.get('jobs') and config.get('browser_endpoints'):
+        await run_jobs_on_farm(config['jobs'], config['browser_endpoints'], workers=config.get('workers', 4),
+                               isolated=config.get('isolated', False))
+        return
+
+    if config.get('jobs') and config.get('tabs'):
+        await run_jobs_in_tabs(config['jobs'], tabs=config['tabs'], isolated=config.get('isolated', False))
+        return
+
+    if config.get('jobs') and config.get('processes'):
+        await run_sharded_jobs(config['jobs'], processes=config['processes'])
+        return
+
+    if config.get('jobs'):
+        await run_pooled_jobs(config['jobs'], workers=config.get('workers', 4))
+        return
+
+    # reuse warm browsers across jobs when a "browser_pool" section is configured
+    pool = await create_browser_pool(config['browser_pool']) if config.get('browser_pool') else None
+    pacer = Pacer.from_config(config)
+    driver = CustomDriver(timeout=10, pool=pool, pacer=pacer)
+    web_scraper = DynamicWebScraping(config, driver, pacer=pacer, latencies=get_selector_latencies(config))  # config is read in the settings.py file at the top level of the project
+    try:
+        # get driver
+        await web_scraper.get_driver(config["url"])
+        start = await web_scraper.restore_checkpoint()
+        await web_scraper.run_actions(config['actions'], start=start)
+    finally:
+        if pool is not None:
+            # hand the leased browser back first so closing the pool stops it
+            await web_scraper.close()
+            await pool.close()
 
 if __name__ == "__main__":
     from settings import config
@@ -0,0 +1,52 @@
+import json
+import os
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+class ActionCheckpoint:
+    """
+    Progress of an action sequence saved to a json file after every completed action: the index of the
+    last completed action and the url/ cookies of the page at that point, so a failed run can restore
+    the page and continue from the action that failed instead of starting over
+    """
+    def __init__(self, path):
+        """
+        :param path: path to the checkpoint file, str
+        """
+        self.path = str(path)
+
+    def load(self):
+        """
+        :return state: {"index": ..., "url": ..., "cookies": [...]} or None when there is no checkpoint, dict
+        """
+        try:
+            with open(self.path, 'r') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.error(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+
+    def save(self, index, url, cookies):
+        """
+        Save the progress, the file is replaced atomically so a crash never leaves a partial checkpoint
+        :param index: index of the last completed action, int
+        :param url: url of the page after the action, str
+        :param cookies: cookies of the browser after the action, list of dicts
+        """
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'index': index, 'url': url, 'cookies': cookies}, f, default=str)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """Remove the checkpoint once every action completed"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,218 @@
+import hashlib
+import mmap
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """
+    Content addressed store for downloaded files: every distinct content is stored once as a read-only
+    blob named by its hash (objects/ab/cdef...), and a sqlite index maps the urls to the hash and metadata
+    (size, etag, last modified) of their latest download. The files in the download directories are
+    hardlinks to the blobs, so a file downloaded every day takes the disk space of one copy, and the
+    index lets downstream jobs skip files whose hash did not change
+    """
+    def __init__(self, root, algorithm='sha256', mmap_threshold=16 * 1024 * 1024, chunk_size=1024 * 1024):
+        """
+        Initializing the store, the directories and the index are created if the store is new
+        :param root: directory of the store, blobs and the index (index.db) live in it, str
+        :param algorithm: hashlib algorithm naming the blobs, str
+        :param mmap_threshold: files from this size on are verified through mmap instead of reads, int
+        :param chunk_size: bytes read at a time when hashing a file, int
+        """
+        self.root = str(root)
+        self.algorithm = algorithm
+        self.mmap_threshold = mmap_threshold
+        self.chunk_size = chunk_size
+        self.path = os.path.join(self.root, 'index.db')
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        with self.__connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    url TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_type TEXT,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def __connect(self):
+        """short lived connection per operation, the downloads store their files from worker threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def hasher(self):
+        """a new hash object of the store's algorithm, to hash a file while it is written"""
+        return hashlib.new(self.algorithm)
+
+    def blob_path(self, digest):
+        """:return path: where the blob of a hash is stored, str"""
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def hash_file(self, path, hasher=None):
+        """
+        Hash a file in chunks
+        :param path: the file, str
+        :param hasher: hash object to continue, e.g. with the part of a download written before a resume
+        :return hasher: the hash object, hashlib hash
+        """
+        hasher = hasher or self.hasher()
+        with open(path, 'rb') as f:
+            while chunk := f.read(self.chunk_size):
+                hasher.update(chunk)
+        return hasher
+
+    def add(self, source, digest, size):
+        """
+        Store a file under its hash, the file is moved into the store or dropped when the content is stored
+        already. The blob is created with os.link, which fails when it exists, so concurrent adds of the same
+        content never overwrite each other, and a stored blob is verified before the file is dropped for it
+        :param source: the file, its hash was computed while it was written, str
+        :param digest: the hex digest of the file, str
+        :param size: bytes of the file, int
+        :return path: the path of the blob, str
+        """
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        # moved next to the blob first, a copy when the file is on another file system
+        staged = f"{blob}.{uuid.uuid4().hex}.tmp"
+        shutil.move(source, staged)
+        # the download directories link to the blob, read-only keeps an edit there from changing the blob
+        os.chmod(staged, 0o444)
+        try:
+            os.link(staged, blob)
+        except FileExistsError:
+            if self.verify(digest):
+                logger.info(f"Deduplicated {source} as blob {digest[:12]}")
+            else:
+                logger.error(f"Blob {digest[:12]} is damaged, replacing it with {source}")
+                os.replace(staged, blob)
+        except OSError:
+            # a file system without hardlinks, a rename is atomic too (a concurrent add of the content replaces it)
+            os.replace(staged, blob)
+        # only dropped once the blob exists, the download is kept when storing it failed
+        if os.path.exists(staged):
+            os.remove(staged)
+        with self.__connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (hash, size, stored_at) VALUES (?, ?, ?)",
+                         (digest, size, time.time()))
+        return blob
+
+    def add_file(self, path, url=None, **metadata):
+        """
+        Store a file that was written without hashing (e.g. a browser download) and replace it with a link to its blob
+        :param path: the file, str
+        :param url: the url the file was downloaded from, str
+        :param metadata: etag, last_modified and content_type of the download, str
+        :return digest: the hex digest of the file, str
+        """
+        size = os.path.getsize(path)
+        digest = self.hash_file(path).hexdigest()
+        self.add(path, digest, size)
+        self.link(digest, path)
+        if url:
+            self.record(url, digest, size, **metadata)
+        return digest
+
+    def link(self, digest, path):
+        """
+        Make path a hardlink to a blob, a copy when the store is on another file system
+        :param digest: the hex digest of the blob, str
+        :param path: where the file should be, an existing file is replaced, str
+        :return path: the path, str
+        """
+        blob = self.blob_path(digest)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            if os.path.samefile(blob, path):
+                return path
+            os.remove(path)
+        try:
+            os.link(blob, path)
+        except OSError:
+            shutil.copyfile(blob, path)
+        return path
+
+    def record(self, url, digest, size, etag=None, last_modified=None, content_type=None):
+        """
+        Index the latest download of a url
+        :param url: the url, str
+        :param digest: the hex digest of the downloaded file, str
+        :param size: bytes of the file, int
+        :param etag: ETag header of the response, str
+        :param last_modified: Last-Modified header of the response, str
+        :param content_type: Content-Type header of the response, str
+        """
+        with self.__connect() as conn:
+            conn.execute("""
+                INSERT INTO sources (url, hash, size, etag, last_modified, content_type, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET hash = excluded.hash, size = excluded.size, etag = excluded.etag,
+                    last_modified = excluded.last_modified, content_type = excluded.content_type,
+                    fetched_at = excluded.fetched_at
+            """, (url, digest, size, etag, last_modified, content_type, time.time()))
+
+    def get(self, url):
+        """
+        The latest download of a url, downstream jobs compare its hash to skip unchanged files
+        :param url: the url, str
+        :return source: {"url", "hash", "size", "etag", "last_modified", "content_type", "fetched_at"}
+            or None when the url was never downloaded or its blob is gone, dict
+        """
+        with self.__connect() as conn:
+            row = conn.execute("SELECT * FROM sources WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self.blob_path(row['hash'])):
+            return None
+        return dict(row)
+
+    def forget(self, url):
+        """
+        Drop the latest download of a url from the index, e.g. when its blob is damaged
+        :param url: the url, str
+        """
+        with self.__connect() as conn:
+            conn.execute("DELETE FROM sources WHERE url = ?", (url,))
+
+    def verify(self, digest):
+        """
+        Check that a blob still has the content its name says, large blobs are hashed through mmap
+        without copying them into memory
+        :param digest: the hex digest of the blob, str
+        :return valid: boolean
+        """
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            return False
+        if os.path.getsize(blob) < self.mmap_threshold:
+            return self.hash_file(blob).hexdigest() == digest
+        hasher = self.hasher()
+        with open(blob, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            hasher.update(view)
+        return hasher.hexdigest() == digest
@@ -0,0 +1,220 @@
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+DEAD = 'dead'
+
+
+class LeasedJob:
+    """A job handed out by the queue, owned by one runner until the lease expires"""
+    def __init__(self, id, job, attempts, owner):
+        self.id = id
+        self.job = job
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return f"LeasedJob({self.id}, attempts={self.attempts}, owner={self.owner})"
+
+
+class SqliteJobQueue:
+    """
+    Durable job queue stored in a sqlite file that several runner processes (and nodes, with the file
+    on shared storage) pull jobs from.
+    A leased job is invisible to other runners until its lease expires, so a job whose runner crashed
+    is picked up again by another runner. Jobs that fail max_attempts times are dead lettered.
+    The default rollback journal is used since WAL mode does not work on network file systems.
+    """
+    def __init__(self, path, visibility_timeout=300, max_attempts=3, retry_delay=5):
+        """
+        Initializing the job queue, the tables are created if the file is new
+        :param path: path to the sqlite file, str
+        :param visibility_timeout: seconds a lease lasts without a heartbeat, float
+        :param max_attempts: attempts before a job is dead lettered, int
+        :param retry_delay: base seconds before a failed job is retried, doubled every attempt, float
+        """
+        self.path = str(path)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        with self.__connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    available_at REAL NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+
+    @contextmanager
+    def __connect(self, write=True):
+        """
+        short lived connection per operation, so the queue can be used from any thread or process.
+        BEGIN IMMEDIATE takes the write lock up front so two runners can not lease the same job
+        """
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            # a BEGIN that timed out on the lock never started a transaction, a rollback would hide its error
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def enqueue(self, job, delay=0):
+        """
+        Add a job to the queue
+        :param job: the job, e.g. {"url": "...", "actions": [...]}, dict
+        :param delay: seconds before the job becomes available, float
+        :return id: id of the queued job, int
+        """
+        return self.enqueue_many([job], delay)[0]
+
+    def enqueue_many(self, jobs, delay=0):
+        """
+        Add several jobs to the queue in one transaction
+        :return ids: ids of the queued jobs, list
+        """
+        now = time.time()
+        with self.__connect() as conn:
+            return [conn.execute(
+                "INSERT INTO jobs (payload, status, available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(job), QUEUED, now + delay, now, now)
+            ).lastrowid for job in jobs]
+
+    def lease(self, owner):
+        """
+        Lease the oldest available job. Jobs whose lease expired count as a failed attempt
+        :param owner: unique id of the runner taking the job, str
+        :return job: the leased job or None when nothing is available, LeasedJob
+        """
+        now = time.time()
+        with self.__connect() as conn:
+            while True:
+                row = conn.execute("""
+                    SELECT id, payload, status, attempts FROM jobs
+                    WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ?)
+                    ORDER BY id LIMIT 1
+                """, (QUEUED, now, LEASED, now)).fetchone()
+                if row is None:
+                    return None
+
+                if row['status'] == LEASED and row['attempts'] >= self.max_attempts:
+                    logger.error(f"Job {row['id']} lease expired on its last attempt, dead lettering it")
+                    conn.execute("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ? "
+                                 "WHERE id = ?", (DEAD, 'Lease expired', now, row['id']))
+                    continue
+
+                conn.execute("""
+                    UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?,
+                    updated_at = ? WHERE id = ?
+                """, (LEASED, owner, now + self.visibility_timeout, now, row['id']))
+                return LeasedJob(row['id'], json.loads(row['payload']), row['attempts'] + 1, owner)
+
+    def heartbeat(self, leased_job):
+        """
+        Extend the lease of a job that is still running
+        :param leased_job: the job returned by lease(), LeasedJob
+        :return extended: False when the lease was lost to another runner, boolean
+        """
+        now = time.time()
+        with self.__connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (now + self.visibility_timeout, now, leased_job.id, LEASED, leased_job.owner)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, leased_job, result=None):
+        """
+        Mark a leased job as done
+        :param leased_job: the job returned by lease(), LeasedJob
+        :param result: json serializable result of the job
+        :return completed: False when the lease was lost to another runner, boolean
+        """
+        now = time.time()
+        with self.__connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (DONE, json.dumps(result, default=str), now, leased_job.id, LEASED, leased_job.owner)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, leased_job, error):
+        """
+        Put a failed job back in the queue with a backoff, or dead letter it after max_attempts
+        :param leased_job: the job returned by lease(), LeasedJob
+        :param error: the error that failed the job
+        :return status: the new status of the job, str
+        """
+        now = time.time()
+        dead = leased_job.attempts >= self.max_attempts
+        status = DEAD if dead else QUEUED
+        available_at = now + self.retry_delay * 2 ** (leased_job.attempts - 1)
+        with self.__connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, available_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (status, str(error), available_at, now, leased_job.id, LEASED, leased_job.owner)
+            )
+        if dead:
+            logger.error(f"Job {leased_job.id} failed {leased_job.attempts} times, dead lettering it: {error}")
+        return status
+
+    def dead_letters(self):
+        """
+        :return jobs: every dead lettered job with its last error, list of dicts
+        """
+        with self.__connect(write=False) as conn:
+            rows = conn.execute("SELECT id, payload, attempts, error FROM jobs WHERE status = ? ORDER BY id",
+                                (DEAD,)).fetchall()
+        return [{'id': row['id'], 'job': json.loads(row['payload']), 'attempts': row['attempts'],
+                 'error': row['error']} for row in rows]
+
+    def requeue(self, job_id):
+        """Give a dead lettered job a fresh set of attempts"""
+        now = time.time()
+        with self.__connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, attempts = 0, available_at = ?, updated_at = ? "
+                         "WHERE id = ? AND status = ?", (QUEUED, now, now, job_id, DEAD))
+
+    def pending(self):
+        """
+        :return pending: number of jobs that are queued (including retries waiting on their backoff) or leased, int
+        """
+        counts = self.counts()
+        return counts[QUEUED] + counts[LEASED]
+
+    def counts(self):
+        """
+        :return counts: number of jobs per status, dict
+        """
+        with self.__connect(write=False) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, DEAD: 0}
+        counts.update({row['status']: row['total'] for row in rows})
+        return counts
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+class JsonlBatch:
+    """
+    A batch of jobs in a jsonl file (one {"url": ..., "actions": [...]} object per line) that is read
+    lazily, so multi GB files never have to fit in memory.
+    The checkpoint file holds the byte offset of the first line that has not finished yet. Jobs finish
+    out of order, so the checkpoint only moves past a line once every line before it finished as well,
+    and a restarted batch resumes at the checkpoint (lines after it that already ran are run again).
+    The checkpoint is written at most once every checkpoint_interval seconds, call save_checkpoint() once
+    the batch is done to write the final offset.
+    The jobs may be read in a worker thread while finish() is called on the loop.
+    """
+    def __init__(self, path, checkpoint_path=None, checkpoint_interval=1.0):
+        """
+        Initializing the batch
+        :param path: path to the jsonl file, str
+        :param checkpoint_path: path to the checkpoint file, str (defaults to <path>.checkpoint)
+        :param checkpoint_interval: min seconds between two checkpoint writes, float (0 writes on every move)
+        """
+        self.path = str(path)
+        self.checkpoint_path = str(checkpoint_path or f"{self.path}.checkpoint")
+        self.checkpoint_interval = checkpoint_interval
+        self.offset = self.__load_checkpoint()
+        self.__saved_offset = self.offset
+        self.__saved_at = 0.0
+        self.__in_flight = deque()
+        self.__lines = {}
+        self.__lock = threading.Lock()
+
+    def __load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def save_checkpoint(self):
+        """Write the checkpoint if it moved since the last write"""
+        with self.__lock:
+            self.__save_checkpoint()
+
+    def __save_checkpoint(self):
+        """write to a temp file and rename it over the checkpoint so a crash never leaves a partial file"""
+        if self.offset == self.__saved_offset:
+            return
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(str(self.offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+        self.__saved_offset = self.offset
+        self.__saved_at = time.monotonic()
+
+    def __iter__(self):
+        """
+        Read the jobs from the checkpoint onwards, each job is tracked as in flight until finish() is called
+        :return jobs: (offset of the line, job) tuples, generator
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            start = self.offset
+            for line in f:
+                end = start + len(line)
+                if line.strip():
+                    try:
+                        job = json.loads(line)
+                    except ValueError as e:
+                        logger.error(f"Skipping invalid json on the line at byte {start} of {self.path}: {e}")
+                        job = None
+                    with self.__lock:
+                        self.__start(start, end)
+                    if job is None:
+                        self.finish(start)
+                    else:
+                        yield start, job
+                start = end
+
+        # trailing blank lines never finish a job, move the checkpoint past them once nothing is in flight
+        with self.__lock:
+            if not self.__in_flight:
+                self.offset = max(self.offset, start)
+                self.__save_checkpoint()
+
+    def __start(self, start, end):
+        self.__lines[start] = [end, False]
+        self.__in_flight.append(start)
+
+    def finish(self, offset):
+        """
+        Mark the job on the line at the offset as finished (successfully or not) and move the checkpoint
+        past every finished line at the head of the batch
+        :param offset: offset of the line returned with the job, int
+        """
+        with self.__lock:
+            self.__lines[offset][1] = True
+            while self.__in_flight and self.__lines[self.__in_flight[0]][1]:
+                self.offset = self.__lines.pop(self.__in_flight.popleft())[0]
+            if time.monotonic() - self.__saved_at >= self.checkpoint_interval:
+                self.__save_checkpoint()
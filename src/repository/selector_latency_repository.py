@@ -0,0 +1,152 @@
+import bisect
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in seconds, 50ms growing by 40% per bucket up to ~3 minutes
+BUCKETS = [round(.05 * 1.4 ** i, 3) for i in range(25)]
+
+
+class SelectorLatencies:
+    """
+    Histograms of how long each (site, selector) took to appear, stored in a sqlite file so they are
+    learned across runs and shared by every runner process on the machine.
+    Lookups are recorded in memory and written with flush(), a timeout is derived from a high
+    percentile of the histogram so selectors that usually show up fast stop waiting for the full
+    configured wait when they are not coming.
+    A lookup cut off at a learned timeout is censored, the element may still have shown up later, so it
+    counts as a lookup that took the whole timeout and the timeout grows back when a site gets slower.
+    flush() may run in a worker thread while record()/ timeout_for() run on the loop
+    """
+    def __init__(self, path, percentile=.99, margin=1.5, min_samples=20, min_timeout=.5):
+        """
+        Initializing the latency store, the histograms recorded so far are loaded
+        :param path: path to the sqlite file, str
+        :param percentile: percentile of the lookup times the timeout is based on, float
+        :param margin: factor the percentile is multiplied with, float
+        :param min_samples: lookups of a selector needed before its timeout is adapted, int
+        :param min_timeout: lowest timeout handed out, float
+        """
+        self.path = str(path)
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.min_timeout = min_timeout
+        self.__histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.__misses = defaultdict(int)
+        self.__pending = defaultdict(int)
+        self.__lock = threading.Lock()
+        with self.__connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS selector_latencies (
+                    site TEXT NOT NULL,
+                    selector TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (site, selector, bucket)
+                )
+            """)
+            self.__load(conn)
+
+    @contextmanager
+    def __connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def __load(self, conn):
+        """
+        read the stored histograms, the miss counter is stored as bucket -1.
+        The dicts are built aside and swapped in with the lookups recorded meanwhile
+        """
+        histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        misses = defaultdict(int)
+        for row in conn.execute("SELECT site, selector, bucket, count FROM selector_latencies"):
+            key = (row['site'], row['selector'])
+            if row['bucket'] < 0:
+                misses[key] = row['count']
+            else:
+                histograms[key][row['bucket']] = row['count']
+
+        with self.__lock:
+            # recorded after the pending lookups were taken, they are not in the file yet
+            for (site, selector, bucket), count in self.__pending.items():
+                if bucket < 0:
+                    misses[(site, selector)] += count
+                else:
+                    histograms[(site, selector)][bucket] += count
+            self.__histograms, self.__misses = histograms, misses
+
+    def record(self, site, selector, seconds, found=True, timeout=None):
+        """
+        Record a lookup
+        :param site: hostname of the page, str
+        :param selector: xpath/ css selector that was looked up, str
+        :param seconds: time the lookup took, float
+        :param found: False when the element never showed up, boolean
+        :param timeout: the learned timeout the lookup was cut off at, float (None when it waited the full wait)
+        """
+        key = (site, selector)
+        with self.__lock:
+            if not found and timeout is not None and key in self.__histograms:
+                # censored, the selector does show up but took longer than the learned timeout
+                bucket = bisect.bisect_right(BUCKETS, max(seconds, timeout))
+                self.__histograms[key][bucket] += 1
+            elif found:
+                bucket = bisect.bisect_left(BUCKETS, seconds)
+                self.__histograms[key][bucket] += 1
+            else:
+                bucket = -1
+                self.__misses[key] += 1
+            self.__pending[(site, selector, bucket)] += 1
+
+    def timeout_for(self, site, selector, ceiling=None, required=False):
+        """
+        Derive the timeout of a selector from its histogram
+        :param site: hostname of the page, str
+        :param selector: xpath/ css selector to look up, str
+        :param ceiling: the configured wait, the learned timeout never exceeds it, float
+        :param required: the action fails without the element, it gets the full wait until it was seen, boolean
+        :return timeout: the timeout in seconds or None while there are too few samples, float
+        """
+        key = (site, selector)
+        counts = self.__histograms.get(key)
+        found = sum(counts) if counts else 0
+        if found < self.min_samples:
+            if not found and not required and self.__misses.get(key, 0) >= self.min_samples:
+                # an optional element that has never shown up, do not wait for it
+                return self.min_timeout
+            return None
+
+        target = self.percentile * found
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                break
+        upper = BUCKETS[bucket] if bucket < len(BUCKETS) else BUCKETS[-1] * 1.4
+        timeout = max(upper * self.margin, self.min_timeout)
+        return min(timeout, ceiling) if ceiling is not None else timeout
+
+    def flush(self):
+        """Write the lookups recorded since the last flush and reload what other runners recorded"""
+        with self.__lock:
+            if not self.__pending:
+                return
+            pending, self.__pending = self.__pending, defaultdict(int)
+        with self.__connect() as conn:
+            conn.executemany("""
+                INSERT INTO selector_latencies (site, selector, bucket, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT (site, selector, bucket) DO UPDATE SET count = count + excluded.count
+            """, [(site, selector, bucket, count) for (site, selector, bucket), count in pending.items()])
+            self.__load(conn)
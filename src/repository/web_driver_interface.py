@@ -15,6 +15,14 @@ class WebDriverInterface(ABC):
     def find_element(self, by: str, value: str, action: dict):
         pass
 
+    @abstractmethod
+    def iter_elements(self, value: str, by: str, chunk_size: int):
+        pass
+
+    @abstractmethod
+    def evaluate_batch(self, expressions: list):
+        pass
+
     @abstractmethod
     def click_element(self, element: any):
         pass
@@ -27,10 +35,22 @@ class WebDriverInterface(ABC):
     def dropdown_select(self, action: dict, element: any):
         pass
 
+    @abstractmethod
+    def fill_form(self, fields: list):
+        pass
+
     @abstractmethod
     def file_upload(self, value: str, element: any):
         pass
 
+    @abstractmethod
+    def set_download_directory(self, directory: str):
+        pass
+
+    @abstractmethod
+    def wait_for_download(self, timeout: float):
+        pass
+
     @abstractmethod
     def open_new_window(self):
         pass
@@ -39,6 +59,18 @@ class WebDriverInterface(ABC):
     def return_to_original_window(self):
         pass
 
+    @abstractmethod
+    def get_cookies(self):
+        pass
+
+    @abstractmethod
+    def set_cookies(self, cookies: list):
+        pass
+
+    @abstractmethod
+    def current_url(self):
+        pass
+
     @abstractmethod
     def close(self):
         pass
\ No newline at end of file
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+from src.service.browser_pool_service import resolve
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+class BrowserEndpoint:
+    """A remote debugging endpoint (host:port) of an already running browser"""
+    def __init__(self, address, capacity=None):
+        """
+        :param address: remote debugging address of the browser, e.g. localhost:9222, str
+        :param capacity: max jobs to run on this browser at the same time, int (None is unlimited)
+        """
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"Invalid browser endpoint '{address}', expected host:port")
+
+        self.host = host
+        self.port = int(port)
+        self.capacity = capacity
+        self.active = 0
+        self.failed_until = 0
+        self.browser = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.failed_until
+
+    @property
+    def full(self):
+        return self.capacity is not None and self.active >= self.capacity
+
+    def __repr__(self):
+        return f"BrowserEndpoint({self.address}, active={self.active})"
+
+
+class BrowserFarm:
+    """
+    Registry of already running browsers that the drivers attach to instead of launching a local browser.
+    Jobs are balanced across the endpoints by sending each job to the endpoint with the fewest active jobs.
+    One connection is kept per endpoint and every job works in its own tab of that browser.
+    """
+    def __init__(self, connect, disconnect=None, endpoints=(), capacity=None, cooldown=30, alive=None):
+        """
+        Initializing the browser farm
+        :param connect: func that attaches to a browser given (host, port) and returns it (sync or async), func
+        :param disconnect: func that drops a browser connection without stopping the browser (sync or async), func
+        :param endpoints: remote debugging addresses, e.g. ["localhost:9222"], list
+        :param capacity: max jobs per endpoint at the same time, int (None is unlimited)
+        :param cooldown: seconds an endpoint is skipped after it fails to connect, float
+        :param alive: func that tells whether a cached browser connection still works, a dead one is
+            reconnected (sync or async), func
+        """
+        self.__connect = connect
+        self.__disconnect = disconnect
+        self.__capacity = capacity
+        self.__cooldown = cooldown
+        self.__alive = alive
+        self.__released = asyncio.Condition()
+        self.__endpoints = {}
+        for address in endpoints:
+            self.register(address)
+
+    @property
+    def endpoints(self):
+        return list(self.__endpoints.values())
+
+    def register(self, address, capacity=None):
+        """
+        Add a running browser to the farm
+        :param address: remote debugging address, host:port, str
+        :param capacity: max jobs on this browser at the same time, overrides the farm default, int
+        :return endpoint: the registered endpoint, BrowserEndpoint
+        """
+        endpoint = BrowserEndpoint(address, capacity if capacity is not None else self.__capacity)
+        self.__endpoints[endpoint.address] = endpoint
+        logger.info(f"Registered browser endpoint {endpoint.address}")
+        return endpoint
+
+    def unregister(self, address):
+        """Remove a browser from the farm, jobs already running on it are not interrupted"""
+        return self.__endpoints.pop(address, None)
+
+    async def lease(self, timeout=None):
+        """
+        Pick the least loaded healthy endpoint and attach to its browser, when every healthy endpoint
+        is at capacity wait until a job is released
+        :param timeout: seconds to wait for a free endpoint, float (None waits as long as it takes)
+        :return endpoint, browser: the endpoint the job runs on and its browser connection, tuple
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            leased = await self.__try_lease()
+            if leased is not None:
+                return leased
+
+            busy = any(e.healthy and e.full for e in self.__endpoints.values())
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if not busy or (remaining is not None and remaining <= 0):
+                raise Exception("No browser endpoint is available")
+            async with self.__released:
+                try:
+                    await asyncio.wait_for(self.__released.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def __try_lease(self):
+        candidates = sorted((e for e in self.__endpoints.values() if e.healthy and not e.full),
+                            key=lambda e: e.active)
+        for endpoint in candidates:
+            # reserve the slot before connecting so concurrent leases spread across endpoints
+            endpoint.active += 1
+            try:
+                async with endpoint.lock:
+                    if endpoint.browser is not None and self.__alive is not None \
+                            and not await resolve(self.__alive(endpoint.browser)):
+                        logger.warning(f"Lost the connection to the browser at {endpoint.address}, reconnecting")
+                        endpoint.browser = None
+                    if endpoint.browser is None:
+                        endpoint.browser = await resolve(self.__connect(endpoint.host, endpoint.port))
+                        logger.info(f"Connected to browser at {endpoint.address}")
+                return endpoint, endpoint.browser
+            except Exception as e:
+                endpoint.active -= 1
+                endpoint.failed_until = time.monotonic() + self.__cooldown
+                logger.error(f"Could not connect to browser at {endpoint.address}, "
+                             f"skipping it for {self.__cooldown}s: {e}")
+        return None
+
+    async def release(self, endpoint):
+        """Mark a job on the endpoint as finished and wake up a lease waiting for a free endpoint"""
+        endpoint.active = max(endpoint.active - 1, 0)
+        async with self.__released:
+            self.__released.notify()
+
+    async def close(self):
+        """Drop every browser connection, the remote browsers themselves keep running"""
+        for endpoint in self.__endpoints.values():
+            if endpoint.browser is not None:
+                try:
+                    if self.__disconnect:
+                        await resolve(self.__disconnect(endpoint.browser))
+                except Exception as e:
+                    logger.error(f"Error disconnecting from {endpoint.address}: {e}")
+                endpoint.browser = None
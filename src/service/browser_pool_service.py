@@ -0,0 +1,192 @@
+import asyncio
+import inspect
+from collections import deque
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+async def resolve(value):
+    """await the value if the callable we ran was async, so sync and async hooks can be mixed"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class BrowserPool:
+    """
+    Keeps launched browsers alive between jobs so a job leases a warm browser
+    instead of paying the browser startup cost every time.
+    Browsers are reset to a blank page when they are returned to the pool.
+    """
+    def __init__(self, launch, reset=None, shutdown=None, min_size=1, max_size=4, spares=1):
+        """
+        Initializing the browser pool
+        :param launch: func that launches and returns a new browser (sync or async), func
+        :param reset: func that returns a used browser to a blank state (sync or async), func
+        :param shutdown: func that stops a browser for good (sync or async), func
+        :param min_size: number of browsers launched on start, int
+        :param max_size: max number of browsers alive at the same time, int
+        :param spares: number of idle browsers to keep launched ahead of demand, int
+        """
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid browser pool size. min: {min_size}, max: {max_size}")
+
+        self.__launch = launch
+        self.__reset = reset
+        self.__shutdown = shutdown
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.__spares = spares
+        self.__idle = deque()
+        self.__leased = []
+        self.__launching = 0
+        self.__recycling = 0
+        self.__tasks = set()
+        self.__closed = False
+        self.__condition = asyncio.Condition()
+
+    @property
+    def size(self):
+        """number of browsers that are alive or being launched"""
+        return len(self.__idle) + len(self.__leased) + self.__launching + self.__recycling
+
+    @property
+    def idle_count(self):
+        """number of warm browsers waiting to be leased"""
+        return len(self.__idle)
+
+    @property
+    def leased_count(self):
+        """number of browsers currently leased out"""
+        return len(self.__leased)
+
+    async def start(self):
+        """
+        Launch the minimum number of browsers so the first jobs get warm browsers
+        :return self: the warmed up pool
+        """
+        missing = max(self.__min_size - self.size, 0)
+        await asyncio.gather(*(self.__spawn() for _ in range(missing)))
+        logger.info(f"Browser pool started with {self.idle_count} warm browsers")
+        return self
+
+    async def lease(self, timeout=None):
+        """
+        Lease a browser from the pool. Launches a new browser if none are idle and
+        the pool is not full, otherwise waits for a browser to be returned.
+        :param timeout: max seconds to wait for a browser, float
+        :return browser: the leased browser
+        """
+        if self.__closed:
+            raise Exception("Browser pool is closed")
+
+        browser = None
+        async with self.__condition:
+            await asyncio.wait_for(self.__condition.wait_for(self.__can_lease), timeout)
+            if self.__idle:
+                browser = self.__idle.popleft()
+            else:
+                self.__launching += 1
+
+        if browser is None:
+            try:
+                browser = await resolve(self.__launch())
+            except Exception as e:
+                logger.error(f"Error launching a browser for the pool: {e}")
+                async with self.__condition:
+                    self.__launching -= 1
+                    self.__condition.notify_all()
+                raise
+            self.__launching -= 1
+
+        self.__leased.append(browser)
+        self.__top_up()
+        return browser
+
+    def release(self, browser):
+        """
+        Return a leased browser to the pool. The browser is reset in the background
+        and becomes available to the next lease once it is blank.
+        :param browser: the leased browser
+        :return task: the background reset task, asyncio.Task
+        """
+        if not any(b is browser for b in self.__leased):
+            logger.warning(f"Released a browser that was not leased from this pool")
+            return None
+
+        self.__leased = [b for b in self.__leased if b is not browser]
+        self.__recycling += 1
+        return self.__schedule(self.__recycle(browser))
+
+    async def close(self):
+        """Stop every idle browser. Browsers still leased are stopped when released."""
+        self.__closed = True
+        if self.__tasks:
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
+        while self.__idle:
+            await self.__stop(self.__idle.popleft())
+        logger.info(f"Browser pool closed")
+
+    def __can_lease(self):
+        return bool(self.__idle) or self.size < self.__max_size
+
+    def __schedule(self, coro):
+        """keep a reference to background tasks so they are not garbage collected"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return task
+
+    def __top_up(self):
+        """launch warm spares in the background so the next lease does not wait on startup"""
+        missing = self.__spares - (len(self.__idle) + self.__launching)
+        for _ in range(max(min(missing, self.__max_size - self.size), 0)):
+            self.__launching += 1
+            self.__schedule(self.__spawn(reserved=True))
+
+    async def __spawn(self, reserved=False):
+        """launch a browser straight into the idle queue"""
+        if not reserved:
+            self.__launching += 1
+        browser = None
+        try:
+            browser = await resolve(self.__launch())
+        except Exception as e:
+            logger.error(f"Error launching a spare browser: {e}")
+
+        async with self.__condition:
+            self.__launching -= 1
+            if browser is not None:
+                if self.__closed:
+                    await self.__stop(browser)
+                else:
+                    self.__idle.append(browser)
+            self.__condition.notify_all()
+
+    async def __recycle(self, browser):
+        """reset a returned browser and put it back in the idle queue"""
+        healthy = True
+        try:
+            if self.__reset:
+                await resolve(self.__reset(browser))
+        except Exception as e:
+            logger.error(f"Error resetting browser, discarding it: {e}")
+            healthy = False
+
+        async with self.__condition:
+            self.__recycling -= 1
+            if healthy and not self.__closed:
+                self.__idle.append(browser)
+            else:
+                await self.__stop(browser)
+            self.__condition.notify_all()
+
+    async def __stop(self, browser):
+        try:
+            if self.__shutdown:
+                await resolve(self.__shutdown(browser))
+        except Exception as e:
+            logger.error(f"Error stopping browser: {e}")
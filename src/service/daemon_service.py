@@ -0,0 +1,236 @@
+import asyncio
+import json
+import signal
+import uuid
+from collections import OrderedDict
+
+from src.service.browser_pool_service import resolve
+from src.service.job_runner_service import JobRunner
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           503: 'Service Unavailable'}
+
+
+class JobRecord:
+    """Status of a job submitted to the daemon"""
+    def __init__(self, job):
+        self.id = uuid.uuid4().hex
+        self.job = job
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self):
+        return {'id': self.id, 'url': self.job.get('url'), 'status': self.status,
+                'result': self.result, 'error': self.error}
+
+    async def update(self, status, result=None, error=None):
+        """change the status and wake up every client streaming this job"""
+        self.status = status
+        self.result = result
+        self.error = error
+        async with self.changed:
+            self.changed.notify_all()
+
+
+class ScrapingDaemon:
+    """
+    Resident process that keeps the drivers warm and runs jobs submitted through a small local HTTP API.
+    Jobs use the same schema as the config files ({"url": ..., "actions": [...]}).
+
+    POST /jobs              submit a job, returns its id
+    GET  /jobs              status of every tracked job
+    GET  /jobs/<id>         status/ result of one job
+    GET  /jobs/<id>/stream  newline delimited json status updates until the job finishes
+    GET  /health            daemon status
+    """
+    def __init__(self, run_job, workers=4, host='127.0.0.1', port=8765, unix_socket=None, on_shutdown=None,
+                 max_history=1000):
+        """
+        Initializing the daemon
+        :param run_job: async func that runs one job and returns its result, func
+        :param workers: max number of jobs running at the same time, int
+        :param host: interface to listen on, only bind to localhost unless the network is trusted, str
+        :param port: port to listen on, int
+        :param unix_socket: path of a unix socket to listen on instead of host/ port, str
+        :param on_shutdown: func called after the jobs drained, e.g. to close the browser pool (sync or async), func
+        :param max_history: finished jobs to keep for status queries, int
+        """
+        self.__run_job = run_job
+        self.__runner = JobRunner(self.__run_record, workers=workers)
+        self.__host = host
+        self.__port = port
+        self.__unix_socket = unix_socket
+        self.__on_shutdown = on_shutdown
+        self.__max_history = max_history
+        self.__jobs = OrderedDict()
+        self.__server = None
+        self.__stopped = asyncio.Event()
+        self.__draining = False
+
+    @property
+    def address(self):
+        """address the server listens on, the real port when the daemon was started with port 0"""
+        if self.__unix_socket:
+            return self.__unix_socket
+        host, port = self.__server.sockets[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    async def start(self):
+        """Start the job workers and the http server"""
+        self.__runner.start()
+        if self.__unix_socket:
+            self.__server = await asyncio.start_unix_server(self.__handle, path=self.__unix_socket)
+        else:
+            self.__server = await asyncio.start_server(self.__handle, self.__host, self.__port)
+        logger.info(f"Daemon listening on {self.address}")
+        return self
+
+    async def serve_forever(self):
+        """Run until SIGINT/ SIGTERM, then drain the running jobs and shut down"""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.__stopped.set)
+            except (NotImplementedError, RuntimeError):
+                # signal handlers are not available on windows event loops
+                pass
+        await self.__stopped.wait()
+        await self.shutdown()
+
+    async def shutdown(self):
+        """Stop accepting jobs, let the submitted jobs finish, then run the shutdown hook"""
+        if self.__draining:
+            return
+        self.__draining = True
+        logger.info(f"Daemon draining {self.__runner.pending} queued jobs")
+        self.__server.close()
+        await self.__server.wait_closed()
+        await self.__runner.stop()
+        if self.__on_shutdown:
+            await resolve(self.__on_shutdown())
+        self.__stopped.set()
+        logger.info(f"Daemon stopped")
+
+    def submit(self, job):
+        """
+        Queue a job
+        :param job: the job config, dict
+        :return record: status record of the job, JobRecord
+        """
+        record = JobRecord(job)
+        self.__jobs[record.id] = record
+        self.__forget_old_jobs()
+        self.__runner.submit(record)
+        return record
+
+    async def __run_record(self, record):
+        await record.update(RUNNING)
+        try:
+            result = await self.__run_job(record.job)
+        except Exception as e:
+            await record.update(FAILED, error=str(e))
+            raise
+        await record.update(DONE, result=result)
+        return result
+
+    def __forget_old_jobs(self):
+        finished = [job_id for job_id, record in self.__jobs.items() if record.finished]
+        for job_id in finished[:max(len(self.__jobs) - self.__max_history, 0)]:
+            del self.__jobs[job_id]
+
+    async def __handle(self, reader, writer):
+        """parse one http request and route it, every connection serves a single request"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            await self.__route(method.upper(), path.split('?')[0].rstrip('/'), body, writer)
+        except Exception as e:
+            logger.error(f"Error handling daemon request: {e}")
+            self.__respond(writer, 400, {'error': str(e)})
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def __route(self, method, path, body, writer):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['health'] and method == 'GET':
+            return self.__respond(writer, 200, {'status': 'draining' if self.__draining else 'ok',
+                                                'pending': self.__runner.pending})
+
+        if parts == ['jobs'] and method == 'POST':
+            if self.__draining:
+                return self.__respond(writer, 503, {'error': 'The daemon is shutting down'})
+            job = json.loads(body or b'{}')
+            if not isinstance(job, dict) or not job.get('url'):
+                return self.__respond(writer, 400, {'error': 'A job needs a "url"'})
+            return self.__respond(writer, 202, self.submit(job).to_dict())
+
+        if parts == ['jobs'] and method == 'GET':
+            return self.__respond(writer, 200, [record.to_dict() for record in self.__jobs.values()])
+
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            record = self.__jobs.get(parts[1])
+            if record is None:
+                return self.__respond(writer, 404, {'error': f"Job {parts[1]} not found"})
+            if method != 'GET':
+                return self.__respond(writer, 405, {'error': f"{method} is not allowed"})
+            if len(parts) == 2:
+                return self.__respond(writer, 200, record.to_dict())
+            if parts[2] == 'stream':
+                return await self.__stream(record, writer)
+
+        return self.__respond(writer, 404, {'error': f"{method} {path} not found"})
+
+    async def __stream(self, record, writer):
+        """send a json line on every status change until the job finishes, using chunked encoding"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        while True:
+            sent = record.to_dict()
+            # written without holding the condition, a client that stops reading must not block update()
+            line = json.dumps(sent, default=str).encode('utf-8') + b'\n'
+            writer.write(f"{len(line):x}\r\n".encode('latin-1') + line + b"\r\n")
+            await writer.drain()
+            if record.finished:
+                break
+            async with record.changed:
+                # a change made while the line was written is sent without waiting for the next one
+                await record.changed.wait_for(lambda: record.to_dict() != sent)
+        writer.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def __respond(writer, status, payload):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
@@ -0,0 +1,336 @@
+import asyncio
+import os
+import shutil
+import time
+from urllib.parse import urlparse
+
+import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+# files a browser (or the download manager) is still writing
+PARTIAL_SUFFIXES = ('.crdownload', '.part', '.tmp', '.download')
+
+
+def cookie_jar(cookies):
+    """
+    Turn browser cookies into a cookie jar for requests
+    :param cookies: cookies from the driver's get_cookies (cdp json or selenium dicts), list of dicts
+    :return jar: the cookie jar, requests.cookies.RequestsCookieJar
+    """
+    jar = RequestsCookieJar()
+    for cookie in cookies or []:
+        jar.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+    return jar
+
+
+def content_range(header):
+    """
+    Parse a Content-Range header, "bytes 100-199/1000" or "bytes */1000"
+    :param header: the header value, str
+    :return start, total: the first byte sent (None for "*") and the size of the file (None when unknown), tuple
+    """
+    try:
+        sent, total = header.split(' ', 1)[1].split('/')
+        start = None if sent == '*' else int(sent.split('-')[0])
+        return start, None if total == '*' else int(total)
+    except (AttributeError, IndexError, ValueError):
+        return None, None
+
+
+def validator(response):
+    """
+    The If-Range validator of a response, a strong ETag or else its Last-Modified date
+    :param response: the response, requests.Response
+    :return validator: the validator or None when the response has neither, str
+    """
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def unique_path(directory, filename):
+    """
+    A path for filename in directory that no file has yet, like the browser names downloads: "report (1).pdf"
+    :param directory: the directory, str
+    :param filename: the wanted file name, str
+    :return path: the path, str
+    """
+    name, extension = os.path.splitext(os.path.basename(filename) or 'download')
+    path = os.path.join(directory, f"{name}{extension}")
+    copy = 0
+    while os.path.exists(path):
+        copy += 1
+        path = os.path.join(directory, f"{name} ({copy}){extension}")
+    return path
+
+
+def move_download(source, directory, filename):
+    """
+    Move a finished browser download to directory under filename without overwriting another file
+    :param source: where the browser wrote the file, str
+    :param directory: the directory of the job's downloads, str
+    :param filename: the file name the site suggested, str
+    :return path: the final path, str
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = unique_path(directory, filename)
+    # a rename unless the browser wrote the file to another file system
+    shutil.move(source, path)
+    return path
+
+
+def copy_download(source, path):
+    """
+    Give a finished download another name without moving it, other callers may still use the source
+    :param source: the downloaded file, str
+    :param path: the new name, an existing file is replaced, str
+    :return path: the path, str
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(source, path)
+    except OSError:
+        shutil.copyfile(source, path)
+    return path
+
+
+class DownloadWatcher:
+    """
+    Watches a directory only one browser downloads to for finished downloads. Every poll is one
+    os.scandir pass that skips the files it already reported and the files still being written
+    (see PARTIAL_SUFFIXES), only new finished files are stat'ed
+    """
+    def __init__(self, directory, poll_frequency=.1):
+        """
+        :param directory: the watched directory, created when missing, str
+        :param poll_frequency: seconds between two polls, float
+        """
+        self.directory = directory
+        self.poll_frequency = poll_frequency
+        os.makedirs(directory, exist_ok=True)
+        self.__seen = {entry.name for entry in os.scandir(directory)}
+
+    def poll(self):
+        """
+        :return paths: the downloads finished since the last poll, oldest first, list of str
+        """
+        finished, present = [], set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                present.add(entry.name)
+                if entry.name in self.__seen or entry.name.endswith(PARTIAL_SUFFIXES) or not entry.is_file():
+                    continue
+                finished.append((entry.stat().st_mtime, entry.path))
+        # files moved away are forgotten, a later download may reuse their name
+        self.__seen = (self.__seen & present) | {os.path.basename(path) for _, path in finished}
+        return [path for _, path in sorted(finished)]
+
+    async def wait(self, timeout=60):
+        """
+        Wait for the next finished download
+        :param timeout: seconds to wait, float
+        :return path: the path of the download, str
+        """
+        pending = []
+        deadline = time.monotonic() + timeout
+        while not pending:
+            pending = self.poll()
+            if pending:
+                break
+            if time.monotonic() >= deadline:
+                raise Exception(f"No download finished in {self.directory} within {timeout}s")
+            await asyncio.sleep(self.poll_frequency)
+        # more than one finished between two polls, report the others on the next waits
+        for path in pending[1:]:
+            self.__seen.discard(os.path.basename(path))
+        return pending[0]
+
+
+class DownloadManager:
+    """
+    Downloads files over one shared connection pool. The blocking requests run in worker threads,
+    at most per_host downloads per host run at the same time, concurrent downloads of the same url
+    to the same path with the same cookies share one request (downloads to a path another download
+    is writing wait for it), and an interrupted download is resumed
+    with a Range request from its partial file (<path>.part) on the next attempt, If-Range makes the
+    server send the whole file again when it changed since. Every request only sends the cookies
+    passed with it, the cookies set by the responses are not kept in the shared session
+    """
+    def __init__(self, per_host=4, pool_size=32, chunk_size=1024 * 1024, retries=2, session=None, store=None):
+        """
+        :param per_host: max downloads running at the same time per host, int
+        :param pool_size: max pooled connections per host, int
+        :param chunk_size: bytes read and written at a time, int
+        :param retries: extra attempts after a failure, every attempt resumes from the partial file, int
+        :param session: the session to share instead of creating one, requests.Session
+        :param store: content addressed store the files are kept in, the saved files link to its blobs, BlobStore
+        """
+        self.per_host = per_host
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.store = store
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        # the session is shared by every job, a cookie set for one of them must not be sent for another
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.__session = session
+        self.__hosts = {}
+        self.__in_flight = {}
+
+    def __host_limit(self, url):
+        host = urlparse(url).netloc
+        if host not in self.__hosts:
+            self.__hosts[host] = asyncio.Semaphore(self.per_host)
+        return self.__hosts[host]
+
+    async def download(self, url, path, cookies=None, timeout=30, headers=None):
+        """
+        Download a file, a running download of the same url to the same path with the same cookies is joined
+        instead, a running download of another url or with other cookies to the same path is waited for first
+        :param url: the file url, str
+        :param path: where to save the file, its directory is created when missing, str
+        :param cookies: browser cookies sent with the request, list of dicts
+        :param timeout: seconds to wait for the server between bytes, float
+        :param headers: extra request headers, e.g. the browser's user agent, dict
+        :return path: the path the file was saved to, str
+        """
+        key = (url, tuple(sorted((cookie['name'], cookie['value'], cookie.get('domain', ''), cookie.get('path', '/'))
+                                 for cookie in cookies or [])))
+        # one download at a time writes <path>.part
+        while (running := self.__in_flight.get(path)) is not None:
+            task, running_key = running
+            if running_key == key:
+                logger.info(f"Joining the running download of {url}")
+                return await asyncio.shield(task)
+            await asyncio.wait({task})
+
+        task = asyncio.ensure_future(self.__download(url, path, cookies, timeout, headers))
+        self.__in_flight[path] = (task, key)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self.__in_flight.pop(path, None)
+            else:
+                task.add_done_callback(lambda _: self.__in_flight.pop(path, None))
+
+    async def __download(self, url, path, cookies, timeout, headers):
+        async with self.__host_limit(url):
+            for attempt in range(self.retries + 1):
+                try:
+                    return await asyncio.to_thread(self.fetch, url, path, cookie_jar(cookies), timeout, headers)
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.error(f"Download of {url} failed, resuming ({attempt + 1}/{self.retries}): {e}")
+
+    def fetch(self, url, path, cookies=None, timeout=30, headers=None):
+        """
+        Download a file in the calling thread, resuming from <path>.part when it exists. The validator of
+        the response the partial file was written from is kept next to it (<path>.part.validator) and sent
+        as If-Range, a changed file is sent whole and written from the start.
+        With a store the file is hashed while it is written and saved as a link to its blob, a url the
+        store knows is requested conditionally and an unchanged file is linked without downloading it
+        :return path: the path the file was saved to, str
+        """
+        partial = f"{path}.part"
+        validator_path = f"{partial}.validator"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        request_headers = dict(headers or {})
+        known = None
+        if offset:
+            request_headers['Range'] = f"bytes={offset}-"
+            if os.path.exists(validator_path):
+                with open(validator_path) as f:
+                    request_headers['If-Range'] = f.read()
+        elif self.store is not None:
+            known = self.store.get(url)
+            if known and known['etag']:
+                request_headers['If-None-Match'] = known['etag']
+            if known and known['last_modified']:
+                request_headers['If-Modified-Since'] = known['last_modified']
+        # the part written before a resume is hashed first
+        hasher = None
+        if self.store is not None:
+            hasher = self.store.hash_file(partial) if offset else self.store.hasher()
+
+        metadata = {}
+        with self.__session.get(url, timeout=timeout, stream=True, cookies=cookies, headers=request_headers) as r:
+            if known and r.status_code == 304:
+                if self.store.verify(known['hash']):
+                    logger.info(f"{url} is unchanged, linking blob {known['hash'][:12]}")
+                    return self.store.link(known['hash'], path)
+                # the stored copy is damaged, the url is requested again without the conditional headers
+                logger.error(f"Blob {known['hash'][:12]} of {url} is damaged, downloading it again")
+                r.close()
+                self.store.forget(url)
+                return self.fetch(url, path, cookies, timeout, headers)
+            if offset and r.status_code == 416:
+                r.close()
+                # the range starts at the end of the file, the partial file is complete if it has the file's size
+                if content_range(r.headers.get('Content-Range'))[1] != offset:
+                    logger.error(f"The partial download of {url} does not match the file, downloading it again")
+                    self.__discard(partial)
+                    return self.fetch(url, path, cookies, timeout, headers)
+            else:
+                r.raise_for_status()
+                if offset and r.status_code == 206 and content_range(r.headers.get('Content-Range'))[0] != offset:
+                    self.__discard(partial)
+                    raise Exception(f"{url} answered the resume with another range")
+                if offset and r.status_code != 206:
+                    # the server ignored the range or the file changed since, start over
+                    offset = 0
+                    hasher = self.store.hasher() if self.store is not None else None
+                if not offset:
+                    self.__save_validator(validator_path, validator(r))
+                with open(partial, 'ab' if offset else 'wb', buffering=self.chunk_size) as f:
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                metadata = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'),
+                            'content_type': r.headers.get('Content-Type')}
+
+        if self.store is None:
+            os.replace(partial, path)
+            self.__save_validator(validator_path, None)
+            return path
+
+        digest, size = hasher.hexdigest(), os.path.getsize(partial)
+        self.store.add(partial, digest, size)
+        self.__save_validator(validator_path, None)
+        self.store.record(url, digest, size, **metadata)
+        return self.store.link(digest, path)
+
+    @staticmethod
+    def __save_validator(validator_path, value):
+        """keep the validator of a partial file, or remove it when there is none"""
+        if value:
+            with open(validator_path, 'w') as f:
+                f.write(value)
+        elif os.path.exists(validator_path):
+            os.remove(validator_path)
+
+    def __discard(self, partial):
+        """remove a partial file and its validator"""
+        for stale in (partial, f"{partial}.validator"):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    def close(self):
+        self.__session.close()
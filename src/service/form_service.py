@@ -0,0 +1,23 @@
+# js defining notify(el, ...types) and setField(el, value), shared by the form filling scripts of both drivers.
+# setField sets a text input/ textarea, a select (by option text or value) or a checkbox/ radio, dispatches
+# input/ change and returns whether the field was set
+SET_FIELD_SCRIPT = """
+const notify = (el, ...types) => types.forEach((type) => el.dispatchEvent(new Event(type, {bubbles: true})));
+const setField = (el, value) => {
+    const tag = el.tagName.toLowerCase(), type = (el.type || '').toLowerCase();
+    if (type === 'checkbox' || type === 'radio') {
+        el.checked = typeof value === 'string' ? !['', 'false', '0', 'off'].includes(value.toLowerCase()) : !!value;
+    } else if (tag === 'select') {
+        const option = Array.from(el.options).find((o) => o.text.trim() === String(value) || o.value === String(value));
+        if (!option) return false;
+        option.selected = true;
+    } else {
+        // the native setter, frameworks that track the value property (react) see the change
+        const proto = tag === 'textarea' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+        const descriptor = Object.getOwnPropertyDescriptor(proto, 'value');
+        descriptor && el instanceof proto.constructor ? descriptor.set.call(el, value) : el.value = value;
+    }
+    notify(el, 'input', 'change');
+    return true;
+};
+"""
@@ -0,0 +1,133 @@
+import asyncio
+from collections import deque
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+class JobResult:
+    """The outcome of a single job, either the value returned by the job or the exception it raised"""
+    def __init__(self, job, result=None, error=None):
+        self.job = job
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'error={self.error!r}'
+        return f"JobResult({self.job.get('url', '') if isinstance(self.job, dict) else self.job}, {status})"
+
+
+class JobRunner:
+    """
+    Run many scraping jobs concurrently on the asyncio loop with a bounded number of workers.
+    Every worker has its own queue of jobs, and a worker whose queue is empty steals
+    from the back of the busiest queue so slow jobs do not leave other workers idle.
+    """
+    def __init__(self, run_job, workers=4):
+        """
+        Initializing the job runner
+        :param run_job: async func that runs one job and returns its result, func
+        :param workers: max number of jobs running at the same time, int
+        """
+        if workers < 1:
+            raise ValueError(f"The job runner needs at least 1 worker, got {workers}")
+
+        self.__run_job = run_job
+        self.__queues = [deque() for _ in range(workers)]
+        self.__next_queue = 0
+        self.__workers = []
+        self.__wakeup = asyncio.Event()
+        self.__stopping = False
+
+    @property
+    def pending(self):
+        """number of jobs waiting for a worker"""
+        return sum(len(queue) for queue in self.__queues)
+
+    def start(self):
+        """Start the worker tasks"""
+        if not self.__workers:
+            self.__stopping = False
+            self.__workers = [asyncio.get_running_loop().create_task(self.__work(index))
+                              for index in range(len(self.__queues))]
+        return self
+
+    def submit(self, job):
+        """
+        Queue a job for the workers
+        :param job: the job to run, e.g. {"url": "...", "actions": [...]}, dict
+        :return future: resolves to the JobResult once the job is finished, asyncio.Future
+        """
+        if self.__stopping:
+            raise Exception("The job runner is stopping and does not accept new jobs")
+
+        future = asyncio.get_running_loop().create_future()
+        self.__queues[self.__next_queue].append((job, future))
+        self.__next_queue = (self.__next_queue + 1) % len(self.__queues)
+        self.__wakeup.set()
+        return future
+
+    async def stop(self):
+        """Let the workers finish every queued job and wait for them to exit"""
+        self.__stopping = True
+        self.__wakeup.set()
+        # a worker whose job was cancelled already exited with the cancellation
+        await asyncio.gather(*self.__workers, return_exceptions=True)
+        self.__workers = []
+
+    async def run(self, jobs):
+        """
+        Run a list of jobs and collect their results
+        :param jobs: the jobs to run, list
+        :return results: a JobResult per job in the same order as the jobs, list
+        """
+        self.start()
+        futures = [self.submit(job) for job in jobs]
+        results = await asyncio.gather(*futures)
+        await self.stop()
+        return results
+
+    def __take(self, index):
+        """take the next job from this worker's queue, or steal the newest job of the busiest worker"""
+        own = self.__queues[index]
+        if own:
+            return own.popleft()
+
+        victim = max(self.__queues, key=len)
+        if victim:
+            return victim.pop()
+        return None
+
+    async def __work(self, index):
+        while True:
+            item = self.__take(index)
+            if item is None:
+                if self.__stopping:
+                    return
+                # nothing to run or steal, sleep until the next submit or stop
+                self.__wakeup.clear()
+                await self.__wakeup.wait()
+                continue
+
+            job, future = item
+            try:
+                result = await self.__run_job(job)
+                self.__resolve(future, JobResult(job, result=result))
+            except Exception as e:
+                logger.error(f"Job failed on worker {index}: {e}")
+                self.__resolve(future, JobResult(job, error=e))
+            except BaseException as e:
+                # cancelled or interrupted, resolve the job so run() does not wait on it forever
+                self.__resolve(future, JobResult(job, error=e))
+                raise
+
+    @staticmethod
+    def __resolve(future, result):
+        if not future.done():
+            future.set_result(result)
@@ -0,0 +1,120 @@
+import functools
+import math
+import random
+from collections import namedtuple
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+# the points of a move (the last one is the target) and the seconds between two points
+Path = namedtuple('Path', ['points', 'interval'])
+
+
+@functools.lru_cache(maxsize=128)
+def minimum_jerk_basis(steps):
+    """
+    The shape of a move with steps segments, shared by every move with as many steps: the progress
+    (0 to 1) of a minimum jerk move at evenly spaced times, slow at both ends and fast in the middle,
+    and the weight of the sideways bow/ jitter, 0 at both ends
+    :param steps: segments of the move, int
+    :return progress, weights: tuple of floats, tuple of floats
+    """
+    times = [index / steps for index in range(steps + 1)]
+    progress = tuple(10 * t ** 3 - 15 * t ** 4 + 6 * t ** 5 for t in times)
+    weights = tuple(math.sin(math.pi * t) for t in times)
+    return progress, weights
+
+
+class MouseModel:
+    """
+    Human-like mouse moves: a minimum jerk profile along a slightly bowed line with jitter, lasting
+    as long as Fitts' law says aiming at a target of that size takes. The model remembers where
+    the cursor is so every move starts where the last one ended
+    """
+    def __init__(self, bow=.12, jitter=1.2, step_px=15, min_steps=8, max_steps=50, fitts_a=.08, fitts_b=.11,
+                 position=(0, 0), rng=None):
+        """
+        :param bow: max sideways bow as a share of the distance, float
+        :param jitter: standard deviation of the jitter in pixels, float
+        :param step_px: pixels per segment of the path, int
+        :param min_steps: fewest segments of a path, int
+        :param max_steps: most segments of a path, int
+        :param fitts_a: seconds every move takes, float
+        :param fitts_b: seconds per bit of difficulty (log2(distance/ width + 1)), float
+        :param position: the cursor position, (x, y) tuple
+        :param rng: random generator, random.Random
+        """
+        self.bow = bow
+        self.jitter = jitter
+        self.step_px = step_px
+        self.min_steps = min_steps
+        self.max_steps = max_steps
+        self.fitts_a = fitts_a
+        self.fitts_b = fitts_b
+        self.position = position
+        self.__rng = rng or random.Random()
+
+    def duration(self, distance, width=20):
+        """seconds a move over distance to a target of width pixels takes, float"""
+        return self.fitts_a + self.fitts_b * math.log2(distance / max(width, 1) + 1)
+
+    def target(self, rect):
+        """
+        A point to click inside a box, around its center like people aim
+        :param rect: {"x", "y", "width", "height"}, dict
+        :return point: (x, y) tuple
+        """
+        x = rect['x'] + rect['width'] / 2 + max(min(self.__rng.gauss(0, rect['width'] / 8), rect['width'] * .35),
+                                                -rect['width'] * .35)
+        y = rect['y'] + rect['height'] / 2 + max(min(self.__rng.gauss(0, rect['height'] / 8), rect['height'] * .35),
+                                                 -rect['height'] * .35)
+        return x, y
+
+    def path(self, start, end, width=20):
+        """
+        The path of one move
+        :param start: (x, y) tuple
+        :param end: (x, y) tuple
+        :param width: size of the target in pixels, float
+        :return path: the points and the seconds between them, Path
+        """
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        distance = math.hypot(dx, dy)
+        if distance < 1:
+            return Path([end], 0)
+
+        steps = min(max(int(distance / self.step_px), self.min_steps), self.max_steps)
+        progress, weights = minimum_jerk_basis(steps)
+        # sideways unit vector times the bow of this move, one random bow per move
+        bow = distance * self.bow * self.__rng.uniform(-1, 1)
+        nx, ny = -dy / distance * bow, dx / distance * bow
+        gauss = self.__rng.gauss
+        points = [
+            (start[0] + dx * p + nx * w + gauss(0, self.jitter) * w, start[1] + dy * p + ny * w + gauss(0, self.jitter) * w)
+            for p, w in zip(progress[1:-1], weights[1:-1])
+        ]
+        points.append(end)
+        return Path(points, self.duration(distance, width) / steps)
+
+    def paths(self, targets, width=20):
+        """
+        The paths of many moves at once, one after another from the cursor position
+        :param targets: (x, y) tuples, list
+        :param width: size of the targets in pixels, float
+        :return paths: list of Path
+        """
+        paths = []
+        for target in targets:
+            paths.append(self.path(self.position, target, width))
+            self.position = target
+        return paths
+
+    def move_to(self, target, width=20):
+        """the path from the cursor position to the target, the cursor is at the target afterwards, Path"""
+        return self.paths([target], width)[0]
+
+    def hold(self):
+        """seconds the button stays pressed during a click, float"""
+        return self.__rng.uniform(.05, .12)
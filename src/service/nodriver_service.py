@@ -2,18 +2,251 @@
 from selenium.common import NoSuchAttributeException
 
 from src.repository.web_driver_interface import WebDriverInterface
+from src.service.typing_service import KeystrokeModel, BACKSPACE
+from src.service.mouse_service import MouseModel
+from src.service.user_agent_service import user_agents
+from src.service.form_service import SET_FIELD_SCRIPT
+from src.service.download_service import move_download
 
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
                     datefmt='%m/%d/%Y %H:%M:%S %Z')
 logger = logging.getLogger(__name__)
 
+import asyncio
+import json
+import os
 import tempfile
-from fake_useragent import UserAgent
+import time
 from selenium.webdriver.common.by import By
 import nodriver as uc
 from nodriver.core.element import Element as NodriverElement
 from nodriver.core.tab import Tab as NodriverPage
+from nodriver.core.connection import ProtocolException
+
+# seconds of mouse movement dispatched together, only the time between the batches is slept
+MOUSE_BATCH_SECONDS = .05
+
+# max seconds a click waits for its element to stop moving, the element was already found so this stays short
+CLICK_READY_TIMEOUT = 1
+
+# name of the binding the page calls with the cache keys of elements that were removed or changed
+HANDLE_BINDING = '__scraperHandleInvalidated'
+
+# name of the (non enumerable) window property the kernel is installed under
+KERNEL = '__scraper'
+
+# name of the isolated world the kernel runs in, the page's own scripts never see the kernel, its binding or observer
+KERNEL_WORLD = '__scraper_world'
+
+# helper library installed once per document in its own isolated world (see PageKernel), the driver calls its
+# functions with json arguments
+# (see kernel_call) instead of shipping a script per operation. Every function takes a target,
+# {"locator": xpath/ selector, "xpath": boolean, "key": handle cache key}.
+# Found elements are kept by cache key, a MutationObserver drops the keys whose element left the
+# document or had its attributes changed and reports them through the binding.
+# lookup resolves as soon as the element is in the document, visible and has kept the same position/ size
+# for stableFrames animation frames. The MutationObserver re-checks on every DOM change and animation frames
+# (timers in background tabs, where frames do not fire) re-check while the element is still moving.
+# The result describes the matches (node, visibility, enabled state, bounding box) so a lookup is one round trip
+KERNEL_SCRIPT = """
+(() => {
+    if (window.%(kernel)s) return;
+    const binding = %(binding)s;
+    const handles = new Map();
+    // the matches of the running iter_elements searches by search id
+    const searches = new Map();
+    new MutationObserver((mutations) => {
+        if (!handles.size) return;
+        const changed = new Set(mutations.filter((m) => m.type === 'attributes').map((m) => m.target));
+        for (const [key, el] of handles) {
+            if (el.isConnected && !changed.has(el)) continue;
+            handles.delete(key);
+            if (window[binding]) window[binding](key);
+        }
+    }).observe(document, {childList: true, subtree: true, attributes: true});
+
+    const cached = (key) => {
+        const el = key && handles.get(key);
+        if (el && el.isConnected) return el;
+        if (el) handles.delete(key);  // removed since, the observer has not run yet
+        return null;
+    };
+    const resolve = (target) => cached(target.key) || (target.xpath
+        ? document.evaluate(target.locator, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(target.locator));
+    const resolveAll = (target) => {
+        if (!target.xpath) return Array.from(document.querySelectorAll(target.locator));
+        const snapshot = document.evaluate(target.locator, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        return Array.from({length: snapshot.snapshotLength}, (_, i) => snapshot.snapshotItem(i));
+    };
+    const isVisible = (el) => {
+        const style = window.getComputedStyle(el);
+        return style.display !== 'none' && style.visibility !== 'hidden' && el.offsetWidth > 0 && el.offsetHeight > 0;
+    };
+    const describe = (el) => {
+        const rect = el.getBoundingClientRect();
+        return {element: el, visible: isVisible(el), enabled: !el.disabled,
+                rect: {x: rect.x, y: rect.y, width: rect.width, height: rect.height}};
+    };
+    %(set_field)s
+    const lookup = (target, options) => new Promise((done) => {
+        let finished = false, pending = false, scrolled = false, lastRect = null, stable = 0;
+        const observer = new MutationObserver(() => schedule());
+        const finish = (state) => {
+            if (finished) return;
+            finished = true;
+            observer.disconnect();
+            clearTimeout(timer);
+            const elements = (options.multiple ? resolveAll(target) : [resolve(target)])
+                .filter((el) => el && el.nodeType === 1);
+            if (target.key && !options.multiple && elements.length) handles.set(target.key, elements[0]);
+            done({state: state, elements: elements.map(describe)});
+        };
+        const check = () => {
+            pending = false;
+            if (finished) return;
+            const el = resolve(target);
+            if (!el) {
+                lastRect = null;
+                stable = 0;
+                return;  // the next mutation checks again
+            }
+            if (!scrolled) {
+                el.scrollIntoView({block: 'center', inline: 'nearest'});
+                scrolled = true;
+            }
+            const rect = el.getBoundingClientRect();
+            const key = [rect.x, rect.y, rect.width, rect.height].join();
+            stable = isVisible(el) && key === lastRect ? stable + 1 : 0;
+            lastRect = key;
+            if (stable >= options.stableFrames) return finish('ready');
+            schedule();
+        };
+        const schedule = () => {
+            if (pending || finished) return;
+            pending = true;
+            document.visibilityState === 'visible' ? requestAnimationFrame(check) : setTimeout(check, 50);
+        };
+        const timer = setTimeout(() => finish(resolve(target) ? 'present' : 'missing'), options.timeoutMs);
+        observer.observe(document.documentElement || document, {childList: true, subtree: true, attributes: true});
+        check();
+    });
+
+    const kernel = {
+        lookup: lookup,
+        connected: (key) => !!cached(key),
+        search: (id, target) => {
+            // an xpath can match text/ attribute nodes, only elements are handed out
+            searches.set(id, resolveAll(target).filter((el) => el.nodeType === 1));
+            return searches.get(id).length;
+        },
+        searchResults: (id, start, end) => (searches.get(id) || []).slice(start, end),
+        discardSearch: (id) => searches.delete(id),
+        visible: (target) => {
+            const el = resolve(target);
+            return !!el && isVisible(el);
+        },
+        measure: (target) => {
+            // the box right before a click, an element outside of the viewport is scrolled to its center first
+            const el = resolve(target);
+            if (!el) return null;
+            let rect = el.getBoundingClientRect();
+            if (rect.top < 0 || rect.left < 0 || rect.bottom > window.innerHeight || rect.right > window.innerWidth) {
+                el.scrollIntoView({block: 'center', inline: 'nearest'});
+                rect = el.getBoundingClientRect();
+            }
+            return {x: rect.x, y: rect.y, width: rect.width, height: rect.height};
+        },
+        extract: (target, property) => {
+            const el = resolve(target);
+            return el ? el[property] : null;
+        },
+        fill: (fields) => fields.map((field) => {
+            const el = resolve(field.target);
+            return !!el && setField(el, field.value);
+        }),
+        select: (target, text) => {
+            const el = resolve(target);
+            const option = el && Array.from(el.options || []).find((option) => option.text.trim() === text);
+            if (!option) return false;
+            option.selected = true;
+            el.value = option.value;
+            notify(el, 'input', 'change');
+            // the final trigger that often works when nothing else does
+            option.click();
+            return true;
+        },
+    };
+    Object.defineProperty(window, %(kernel_name)s, {value: kernel, enumerable: false});
+})();
+""" % {'kernel': KERNEL, 'kernel_name': json.dumps(KERNEL), 'binding': json.dumps(HANDLE_BINDING),
+       'set_field': SET_FIELD_SCRIPT}
+
+def kernel_call(function, *args):
+    """
+    js expression calling a function of the kernel, the arguments are passed as json
+    :param function: name of the kernel function, str
+    :param args: json serializable arguments
+    :return script: the expression, str
+    """
+    return f"window.{KERNEL}.{function}({', '.join(json.dumps(arg) for arg in args)})"
+
+def locator_target(value, by=By.XPATH, key=None):
+    """the target argument of the kernel functions for a locator, dict"""
+    return {'locator': value, 'xpath': by == By.XPATH, 'key': key}
+
+def remove_handler(connection, event_type, handler):
+    """
+    Remove one handler of a cdp event, nodriver's remove_handler drops every handler of the event
+    :param connection: the page or browser connection the handler was added to, nodriver.Connection
+    :param event_type: the cdp event class, type
+    :param handler: the handler to remove, func
+    """
+    handlers = connection.handlers.get(event_type)
+    if handlers and handler in handlers:
+        handlers.remove(handler)
+
+def handle_key(value, by=By.XPATH):
+    """cache key of a locator in the handle cache, str"""
+    return f"{by}:{value}"
+
+def deserialize(serialized):
+    """
+    Convert a cdp deep serialized value to python values, dom nodes are kept as their serialized dict
+    :param serialized: the deep serialized value, DeepSerializedValue | dict
+    :return value: the python value
+    """
+    if isinstance(serialized, dict):
+        type_, value = serialized.get('type'), serialized.get('value')
+    else:
+        type_, value = serialized.type_, serialized.value
+    if type_ == 'object':
+        return {key if isinstance(key, str) else deserialize(key): deserialize(item) for key, item in value or []}
+    if type_ == 'array':
+        return [deserialize(item) for item in value or []]
+    if type_ in ('undefined', 'null'):
+        return None
+    return value
+
+def node_element(node, page):
+    """
+    Build a nodriver element from a deep serialized dom node, the element is resolved through its backend node id
+    :param node: the serialized node, dict
+    :param page: the tab the node belongs to, nodriver.Tab
+    :return element: the element, nodriver.core.element.Element
+    """
+    attributes = [item for name, value in (node.get('attributes') or {}).items() for item in (name, value)]
+    local_name = node.get('localName') or ''
+    return NodriverElement(uc.cdp.dom.Node(
+        node_id=uc.cdp.dom.NodeId(0),
+        backend_node_id=uc.cdp.dom.BackendNodeId(node['backendNodeId']),
+        node_type=node.get('nodeType', 1),
+        node_name=local_name.upper(),
+        local_name=local_name,
+        node_value='',
+        attributes=attributes
+    ), page)
 
 # def uc_runner(func):
 #     print('uc runner')
@@ -22,14 +255,16 @@ from nodriver.core.tab import Tab as NodriverPage
 
 # @add_sync_wrappers
 class NoDriverService(WebDriverInterface):
-    def __init__(self, sleep, implicit_wait=5, *args, **kwargs):
+    def __init__(self, sleep, implicit_wait=5, pool=None, browser=None, isolated=False, *args, **kwargs):
         """
         Initializing nodriver driver class
         :param sleep: async sleep func, func
+        :param pool: optional pool to lease a warm browser from instead of launching one, BrowserPool
+        :param browser: optional running browser to share, the driver then works in its own tab, nodriver.Browser
+        :param isolated: open the shared browser tab in its own incognito browser context, boolean
         """
         logger.info(f"Initialized NoDriverClass")
-        user_agent = UserAgent().random
-        # self.browser_endpoint = "http://localhost:9222"
+        user_agent = user_agents().random
         self.__temp_dir = tempfile.mkdtemp()
 
         self.browser_args = [
@@ -41,12 +276,69 @@ class NoDriverService(WebDriverInterface):
             # f"--user-data-dir={temp_dir}"
             # f"--user-data-dir={PROJECT_ROOT}/my_browser_profile"
         ]
-        self.__driver = None
+        self.__driver = browser
+        self.__shared_browser = browser is not None
+        self.__isolated = isolated
+        self.__context_id = None
         self.__page = None
         self.__original_tab = None
         self.__initial_tab_count = 0
         self.__wait = implicit_wait
         self.__sleep = sleep
+        self.__pool = pool
+        self.__lookup_time = 0
+        self.__handle_caches = {}
+        self.__downloads = None
+        self.__mouse = MouseModel()
+
+    @staticmethod
+    async def start_browser(browser_args=None):
+        """
+        Launch a browser for the browser pool.
+        Each pooled browser gets its own temp profile since chrome locks a user data dir to one process
+        :param browser_args: chrome command line arguments, list
+        :return browser: the launched browser, nodriver.Browser
+        """
+        if browser_args is None:
+            browser_args = [f"user-agent={user_agents().random}", "--start-maximized"]
+        return await uc.start(
+            user_data_dir=tempfile.mkdtemp(),
+            headless=False,
+            browser_args=browser_args
+        )
+
+    @staticmethod
+    async def connect_browser(host, port):
+        """
+        Attach to an already running browser through its remote debugging endpoint
+        (chrome started with --remote-debugging-port), no local browser is launched
+        :param host: remote debugging host, str
+        :param port: remote debugging port, int
+        :return browser: the connected browser, nodriver.Browser
+        """
+        return await uc.start(host=host, port=port)
+
+    @staticmethod
+    def browser_alive(browser):
+        """whether the connection to a remote browser is still open, boolean"""
+        return not browser.connection.closed
+
+    @staticmethod
+    async def disconnect_browser(browser):
+        """Drop the connection to a remote browser without stopping the browser itself"""
+        await browser.connection.disconnect()
+
+    @staticmethod
+    async def reset_browser(browser):
+        """Close every tab except the first one and blank it so the browser can be leased again"""
+        for tab in browser.tabs[1:]:
+            await tab.close()
+        await browser.get('about:blank')
+
+    @staticmethod
+    def stop_browser(browser):
+        """Stop a pooled browser for good"""
+        browser.stop()
 
     async def get(self, url):
         """
@@ -54,13 +346,28 @@ class NoDriverService(WebDriverInterface):
         :param url: the url to connect to, str
         :return self.__page: the current web page the driver got
         """
-        self.__driver = await uc.start(
-            user_data_dir='~/Chrome_dev_session',
-            headless=False,
-            #user_data_dir=str(self.__temp_dir),
-            browser_args=self.browser_args
-        )
-        await self.__sleep(1)
+        if self.__shared_browser:
+            # tab scoped driver, open our own tab the first time and only navigate that tab afterwards
+            if self.__page is None and self.__isolated:
+                self.__page = await self.__open_context_tab(url)
+            elif self.__page is None:
+                self.__page = await self.__driver.get(url, new_tab=True)
+            else:
+                self.__page = await self.__page.get(url)
+            self.__original_tab = self.__page if not self.__original_tab else self.__original_tab
+            return self.__page
+
+        if self.__pool is not None:
+            if self.__driver is None:
+                self.__driver = await self.__pool.lease()
+        elif self.__driver is None:
+            self.__driver = await uc.start(
+                user_data_dir='~/Chrome_dev_session',
+                headless=False,
+                #user_data_dir=str(self.__temp_dir),
+                browser_args=self.browser_args
+            )
+            await self.__sleep(1)
         self.__page = await self.__driver.get(url)
 
         # initialize these variables for the first page connected
@@ -68,6 +375,47 @@ class NoDriverService(WebDriverInterface):
         self.__original_tab = self.__page if not self.__original_tab else self.__original_tab
         return self.__page
 
+    def open_tab(self, sleep=None):
+        """
+        Create a driver that runs in a new tab of this driver's browser, so several action
+        sequences can run at the same time in one browser process.
+        The tab is opened on the new driver's first get()
+        :param sleep: async sleep func of the tab, e.g. the job's pacer, func (defaults to this driver's sleep)
+        :return driver: tab scoped driver sharing this browser, NoDriverService
+        """
+        if self.__driver is None:
+            raise Exception("The browser has not been started, call get() before opening tabs")
+        return NoDriverService(sleep if sleep is not None else self.__sleep, self.__wait, browser=self.__driver)
+
+    def open_context(self, sleep=None):
+        """
+        Create a driver that runs in a new incognito browser context of this driver's browser.
+        Cookies and storage are isolated from every other context, so several accounts can be
+        logged in at the same time in one browser process.
+        The context is created on the new driver's first get() and disposed on close()
+        :param sleep: async sleep func of the context, e.g. the job's pacer, func (defaults to this driver's sleep)
+        :return driver: context scoped driver sharing this browser, NoDriverService
+        """
+        if self.__driver is None:
+            raise Exception("The browser has not been started, call get() before opening contexts")
+        return NoDriverService(sleep if sleep is not None else self.__sleep, self.__wait, browser=self.__driver,
+                               isolated=True)
+
+    async def __open_context_tab(self, url):
+        """create a browser context and open a tab for the url inside of it"""
+        self.__context_id = await self.__driver.connection.send(
+            uc.cdp.target.create_browser_context(dispose_on_detach=True)
+        )
+        target_id = await self.__driver.connection.send(
+            uc.cdp.target.create_target(url, browser_context_id=self.__context_id)
+        )
+        await self.__driver.update_targets()
+        page = next(target for target in self.__driver.targets
+                    if target.type_ == 'page' and target.target_id == target_id)
+        page._browser = self.__driver
+        logger.info(f"Opened tab in browser context {self.__context_id}")
+        return page
+
     def get_original_page(self):
         """return the private original tab value"""
         return self.__original_tab
@@ -76,46 +424,127 @@ class NoDriverService(WebDriverInterface):
         """return the current private page variable"""
         return self.__page
 
-    async def find_elements(self, value='', by=By.XPATH, action={}, required=True, *args, **kwargs):
+    @property
+    def lookup_time(self):
+        """
+        seconds the last find_element/ find_elements call spent waiting for the element,
+        None when the element came from the handle cache
+        """
+        return self.__lookup_time
+
+    async def __handle_cache(self):
+        """
+        the handle cache of the current page, the first use installs the kernel in the page
+        and subscribes the cache to the page events
+        """
+        target_id = self.__page.target_id
+        cache = self.__handle_caches.get(target_id)
+        if cache is None:
+            self.__prune_handle_caches()
+            cache = self.__handle_caches[target_id] = HandleCache(self.__page)
+            cache.listen()
+            await cache.kernel.install()
+        return cache
+
+    async def __kernel(self):
+        """the kernel of the current page, PageKernel"""
+        return (await self.__handle_cache()).kernel
+
+    def __prune_handle_caches(self):
+        """drop the handle caches of the pages that were closed since"""
+        live = {target.target_id for target in self.__driver.targets}
+        for target_id in list(self.__handle_caches):
+            if target_id not in live:
+                self.__handle_caches.pop(target_id).close()
+
+    async def send_batch(self, commands, return_exceptions=False):
+        """
+        Send independent cdp commands to the current page without waiting for each reply and gather the
+        replies, the commands share one round trip instead of paying one each
+        :param commands: cdp commands, e.g. [uc.cdp.dom.get_attributes(node_id), ...], list
+        :param return_exceptions: return the errors of failed commands in place of their reply instead of raising, boolean
+        :return replies: the replies in the order of the commands, list
+        """
+        return list(await asyncio.gather(*(self.__page.send(command) for command in commands),
+                                         return_exceptions=return_exceptions))
+
+    async def evaluate_batch(self, expressions, return_exceptions=False):
+        """
+        Evaluate independent js expressions in the current page in one round trip, e.g. to read
+        several values or check several selectors
+        :param expressions: js expressions, list of str
+        :param return_exceptions: return the errors of failed expressions in place of their value instead of raising, boolean
+        :return values: the values in the order of the expressions, list
+        """
+        replies = await self.send_batch([
+            uc.cdp.runtime.evaluate(expression, await_promise=True, return_by_value=True)
+            for expression in expressions
+        ], return_exceptions=return_exceptions)
+        values = []
+        for expression, reply in zip(expressions, replies):
+            if not isinstance(reply, Exception):
+                remote_object, errors = reply
+                reply = Exception(f"Evaluating {expression[:80]} failed: {errors.text}") if errors else remote_object.value
+            if isinstance(reply, Exception) and not return_exceptions:
+                raise reply
+            values.append(reply)
+        return values
+
+    async def find_elements(self, value='', by=By.XPATH, action={}, required=True, wait_timeout=None, *args, **kwargs):
         """
         Find elements matching the value selector
         :param value: html selector/ xpath, vtr
         :param by: type of selector, str
         :param required: whether the element is required to be in the document, boolean
+        :param wait_timeout: max seconds to wait for the elements, overrides the action's wait, float
         :return elements: array of found elements, list
         """
+        wait = wait_timeout if wait_timeout is not None else action.get('wait', 1)
+        started = time.monotonic()
         try:
-            elements = await self.__page.xpath(value, timeout=action.get('wait', 1))
-            await self.__scroll_into_view(value)
+            _, elements = await self.lookup(value, by=by, timeout=wait, multiple=True)
+            self.__lookup_time = time.monotonic() - started
             if not len(elements) and required:
                 raise Exception(f"Element for {action['type']} action was not found")
 
-            return [CustomWebElement(element, self.__page, xpath=value, selector='') for element in elements]
+            return elements
 
         except Exception as e:
+            self.__lookup_time = time.monotonic() - started
             logger.error(f"Error: The element was not visible & clickable within the given time. {e}")
             raise
 
-    async def find_element(self, by=By.XPATH, value='', action={}, required=True, timeout=3, *args, **kwargs):
+    async def find_element(self, by=By.XPATH, value='', action={}, required=True, timeout=3, wait_timeout=None,
+                           *args, **kwargs):
         """
         Find the first element matching the value selector
+        :param wait_timeout: max seconds to wait for the element, overrides the action's wait, float
         :return element: first found html element, nodriver.core.element.Element
         """
 
-        xpath = value if (by == By.XPATH) else ''
-        selector = value if (by != By.XPATH) else ''
-        wait = action.get('wait', timeout)
+        wait = wait_timeout if wait_timeout is not None else action.get('wait', timeout)
+        started = time.monotonic()
         try:
-            my_element = await self.__page.find(value, timeout=wait)
-            await self.__scroll_into_view(value)
-            if my_element is None and required:
+            cache = await self.__handle_cache()
+            key = handle_key(value, by)
+            cached = cache.get(key)
+            # a removed node is only reported once the page's observer ran, ask the page before reusing it
+            if cached is not None and await cache.kernel.value('connected', key):
+                self.__lookup_time = None
+                return cached
+            cache.drop(key)
+
+            _, elements = await self.lookup(value, by=by, timeout=wait, cache_key=key)
+            self.__lookup_time = time.monotonic() - started
+            if not elements and required:
                 raise Exception(f"Element was not found")
 
-            if my_element:
-                return CustomWebElement(my_element, self.__page, xpath=xpath, selector=selector)
-            return my_element
+            if elements:
+                cache.put(key, elements[0])
+            return elements[0] if elements else None
 
         except Exception as e:
+            self.__lookup_time = time.monotonic() - started
             # Handle the timeout error if the element is not found
             logger.error(f"Error: The element was not visible & clickable within the given time. {e}")
             if required:
@@ -123,11 +552,95 @@ class NoDriverService(WebDriverInterface):
             else:
                 return None
 
+    async def iter_elements(self, value='', by=By.XPATH, chunk_size=500, *args, **kwargs):
+        """
+        Iterate over the elements matching the value selector without materializing all of them.
+        The kernel evaluates the xpath/ selector once and hands out chunk_size matches at a time,
+        every match comes with its tag and attributes and builds its element on demand
+        :param value: html selector/ xpath, str
+        :param by: type of selector, By.XPATH or By.CSS_SELECTOR, str
+        :param chunk_size: matches fetched per round trip, int
+        :return handles: async iterator of the matches, NodeHandle
+        """
+        page = self.__page
+        kernel = await self.__kernel()
+        search_id = f"{id(self)}-{time.monotonic_ns()}"
+        count = await kernel.value('search', search_id, locator_target(value, by))
+        try:
+            for start in range(0, count, chunk_size):
+                remote_object, errors = await kernel.call(
+                    'searchResults', search_id, start, start + chunk_size,
+                    # nodes come back as their backend node id and attributes without their children
+                    serialization_options=uc.cdp.runtime.SerializationOptions(
+                        serialization='deep', max_depth=3, additional_parameters={'maxNodeDepth': 0}
+                    ),
+                )
+                if errors:
+                    raise Exception(f"Fetching the matches of {value} failed: {errors.text}")
+                for node in deserialize(remote_object.deep_serialized_value):
+                    yield NodeHandle(node, page)
+        finally:
+            # also when the caller stopped early, the page would keep the matches alive
+            await kernel.value('discardSearch', search_id)
+
     async def click_element(self, element=None, required=False, *args, **kwargs):
-        """selenium has additional actions that need to be performed for bot detection"""
-        await self.__sleep(.5)
+        """
+        selenium has additional actions that need to be performed for bot detection
+        :return clicked: False when the click was skipped because the element left the page (and not required)
+        """
+        if isinstance(element, CustomWebElement) and element.take_ready():
+            # the lookup that returned the element just saw it visible and stable
+            pass
+        elif isinstance(element, CustomWebElement) and (element._xpath or element._selector):
+            # click as soon as the element stopped moving instead of after a fixed delay
+            state, elements = await self.lookup(element._xpath or element._selector,
+                                                by=By.XPATH if element._xpath else By.CSS_SELECTOR,
+                                                timeout=min(self.__wait, CLICK_READY_TIMEOUT),
+                                                cache_key=element._key or None)
+            if state == 'missing':
+                if required:
+                    raise Exception("The element to click is no longer in the document")
+                logger.error("The element to click is no longer in the document, the click was skipped")
+                return False
+            element.rect = elements[0].rect
+        else:
+            await self.__sleep(.5)
+        if isinstance(element, CustomWebElement) and element.target() is not None and element._kernel is not None:
+            # the box of the lookup can be stale or off-screen by now, measured again right before the click
+            element.rect = await element._kernel.value('measure', element.target())
+        if isinstance(element, CustomWebElement) and element.rect and element.rect['width'] and element.rect['height']:
+            return await self.click_at(element.rect)
         return await element.click()
 
+    async def move_mouse(self, x, y, width=20):
+        """
+        Move the mouse along a human-like path, the moves of every MOUSE_BATCH_SECONDS are sent
+        in one pipelined batch
+        :param x: viewport x, float
+        :param y: viewport y, float
+        :param width: size of the target in pixels, float
+        """
+        path = self.__mouse.move_to((x, y), width)
+        per_batch = max(1, round(MOUSE_BATCH_SECONDS / path.interval)) if path.interval else len(path.points)
+        for start in range(0, len(path.points), per_batch):
+            batch = path.points[start:start + per_batch]
+            await self.send_batch([uc.cdp.input_.dispatch_mouse_event('mouseMoved', px, py) for px, py in batch])
+            if start + per_batch < len(path.points):
+                await self.__sleep(path.interval * len(batch))
+
+    async def click_at(self, rect):
+        """
+        Move the mouse into a box and click it with real mouse events
+        :param rect: viewport box, {"x", "y", "width", "height"}, dict
+        """
+        x, y = self.__mouse.target(rect)
+        await self.move_mouse(x, y, width=min(rect['width'], rect['height']))
+        await self.__page.send(uc.cdp.input_.dispatch_mouse_event('mousePressed', x, y, button=uc.cdp.input_.MouseButton.LEFT,
+                                                                   click_count=1))
+        await self.__sleep(self.__mouse.hold())
+        await self.__page.send(uc.cdp.input_.dispatch_mouse_event('mouseReleased', x, y, button=uc.cdp.input_.MouseButton.LEFT,
+                                                                   click_count=1))
+
     async def type_input(self, action={}, element=None, *args, **kwargs):
         """
         Clear and type input into and input html element
@@ -135,7 +648,6 @@ class NoDriverService(WebDriverInterface):
         # await element.click()
         value = element.attrs.get('value')
         wait = action.get('wait', .5)
-        await self.__sleep(wait)
         await self.click_element(element, *args, **kwargs)
         # print(f"Value before clearing: '{value} - {e_val}'") # Prints ''
         await self.__sleep(wait)
@@ -144,68 +656,80 @@ class NoDriverService(WebDriverInterface):
             # curr_value = await element.get_value()
             # print(curr_value)
 
-        # simulate human behavior by typing one char at a time
-        for char in str(action.get("value", "")):
-            await element.send_keys(char)
-            await self.__sleep(wait / 5)
+        # simulate human behavior with bursts of keystrokes, pauses and corrected typos
+        await self.type_keys(KeystrokeModel.from_action(action).schedule(action.get("value", "")))
 
         logger.info("Text was input successfully.")
 
+    @staticmethod
+    def key_events(key):
+        """
+        The key down/ up events of a key
+        :param key: a character or BACKSPACE, str
+        :return events: the Input.dispatchKeyEvent commands, list
+        """
+        if key == BACKSPACE:
+            named = {'key': 'Backspace', 'code': 'Backspace', 'windows_virtual_key_code': 8}
+            return [uc.cdp.input_.dispatch_key_event('rawKeyDown', **named), uc.cdp.input_.dispatch_key_event('keyUp', **named)]
+        if key == '\n':
+            named = {'key': 'Enter', 'code': 'Enter', 'windows_virtual_key_code': 13}
+            return [uc.cdp.input_.dispatch_key_event('keyDown', text='\r', **named),
+                    uc.cdp.input_.dispatch_key_event('keyUp', **named)]
+        return [uc.cdp.input_.dispatch_key_event('keyDown', text=key, unmodified_text=key, key=key),
+                uc.cdp.input_.dispatch_key_event('keyUp', key=key)]
+
+    async def type_keys(self, bursts):
+        """
+        Type precomputed bursts into the focused element, the keys are sent in order with the pause
+        before every burst and the interval before every key slept in between. The key events are not
+        awaited one by one, the replies of a burst are gathered at its end
+        :param bursts: the bursts of a KeystrokeModel schedule, list of Burst
+        """
+        for burst in bursts:
+            if burst.pause:
+                await self.__sleep(burst.pause)
+            sent = []
+            for key, interval in zip(burst.keys, burst.intervals):
+                if interval:
+                    await self.__sleep(interval)
+                # the tasks start in the order they were created, the events reach the browser in order
+                sent.extend(asyncio.ensure_future(self.__page.send(event)) for event in self.key_events(key))
+            await asyncio.gather(*sent)
+
     async def dropdown_select(self, by='xpath', action={}, element=None, *args, **kwargs):
         """Select an option from a select droption element"""
         wait = action.get('wait', .5)
 
-        dropdown_xpath = action["xpath"].replace('"', "'")
+        dropdown_xpath = action["xpath"]
         option_text = action.get("value", "")
         target_option_xpath = f"{dropdown_xpath}//option[text()='{option_text}']"
+        # the dropdown found for the action, the kernel uses its cached handle instead of evaluating the xpath again
+        target = element.target() if isinstance(element, CustomWebElement) else locator_target(dropdown_xpath)
         try:
             # await element.focus()
             # await self.__sleep(.5)
+            # no fixed delay after opening the dropdown, finding the option below waits for it to render
             await self.click_element(element)
-            await self.__sleep(wait)
 
-            selection_script = f"""
-                const dropdownEl = document.evaluate("{dropdown_xpath}", document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
-                // document.evaluate(".//option[text()='{option_text}']", dropdownEl, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
-                const optionEl = document.querySelector("{option_text} 
-
-                if (dropdownEl && optionEl) {{
-                    // Step A: Directly set the state
-                    optionEl.selected = true;
-                    dropdownEl.value = optionEl.value;
-
-                    // Step B: Dispatch all relevant events
-                    dropdownEl.dispatchEvent(new Event('input', {{ 'bubbles': true }}));
-                    dropdownEl.dispatchEvent(new Event('change', {{ 'bubbles': true }}));
-
-                    // Step C: Execute a native JavaScript click on the OPTION.
-                    // This is the final trigger that often works when nothing else does.
-                    optionEl.click();
-                }} else {{
-                    throw new Error("Could not find dropdown or option to execute script.");
-                }}
-            """
-            ##########
             logger.info(f"Waiting for option '{option_text}' to be ready...")
             option = await self.__page.find(target_option_xpath, timeout=5)
             target_value = option.attrs.get('value')
-            # print('target', option_text, target_value)
-            await self.__page.evaluate(selection_script)
+            # sets the option, dispatches input/ change and clicks the option
+            await (await self.__kernel()).value('select', target, option_text)
             # await self.click_element(element)
             await self.__sleep(wait)
             logger.info(f"Successfully selected '{option_text}'.")
 
-            async def check_value(expected, dropdown_xpath):
+            async def check_value(expected):
                 """confirm the option was selected"""
-                get_value_script = f'document.evaluate("{dropdown_xpath}", document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue.value;'
-                actual = await self.__page.evaluate(get_value_script)
+                actual = await (await self.__kernel()).value('extract', target, 'value')
                 return actual == expected
 
             # if click does not work
-            if not await check_value(option_text, dropdown_xpath):
+            if not await check_value(option_text):
                 """backup select action of it was not selected with page.evaluate"""
                 await element.send_keys(option_text)
-                if not await check_value(target_value, dropdown_xpath):
+                if not await check_value(target_value):
                     raise Exception('Dropdown option could not be selected')
 
             logger.info(f"Successfully selected '{option_text}'.")
@@ -214,6 +738,19 @@ class NoDriverService(WebDriverInterface):
         except Exception as e:
             logger.error(f"Dropdown selection error for {option_text} option. {e}")
 
+    async def fill_form(self, fields=(), *args, **kwargs):
+        """
+        Set the values of many form fields (text inputs, textareas, selects, checkboxes/ radios) in one
+        in-page operation, every field gets its input/ change events
+        :param fields: {"xpath": ..., "value": ...} per field, a select takes the text or value of the option
+                       and a checkbox/ radio a boolean, list of dicts
+        :return filled: whether each field was found and set, list of booleans
+        """
+        kernel = await self.__kernel()
+        return await kernel.value('fill', [
+            {'target': locator_target(field['xpath']), 'value': field.get('value', '')} for field in fields
+        ])
+
     async def file_upload(self, value='', element=None, wait=1,  *args, **kwargs):
         """
         Upload a document to the website
@@ -225,16 +762,86 @@ class NoDriverService(WebDriverInterface):
         except Exception as e:
             logger.error(f'Error uploading file: {e}')
 
-    async def __scroll_into_view(self, xpath):
-        """Scroll to an element on the web page"""
-        scroll_script = f"""
-            const element = document.evaluate("{xpath}", document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
-            if (element) {{
-                element.scrollIntoView(true);
-            }}
+    async def set_download_directory(self, directory):
         """
-        # Execute the script
-        return await self.__page.evaluate(scroll_script)
+        Route the downloads of the current page into a directory. The browser writes every download under
+        its guid into a staging directory of this driver and once the download progress events report it
+        complete, wait_for_download moves it to the directory routed when it started under the name the
+        site suggested, so jobs downloading into the same directory at the same time never mix their files.
+        Tabs sharing a browser context share its download behavior, concurrent jobs in tabs should be isolated
+        :param directory: the job's download directory, created when missing, str
+        """
+        staging = os.path.join(self.__temp_dir, 'downloads')
+        if self.__downloads is None:
+            self.__downloads = DownloadTracker(staging)
+            self.__downloads.listen(self.__driver.connection)
+        self.__downloads.directory = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.__downloads.frames.add(self.__page.target_id)
+        os.makedirs(staging, exist_ok=True)
+        await self.__driver.connection.send(uc.cdp.browser.set_download_behavior(
+            'allowAndName', browser_context_id=self.__context_id, download_path=staging, events_enabled=True
+        ))
+
+    async def wait_for_download(self, timeout=60):
+        """
+        Wait for the next download of the pages routed with set_download_directory to complete
+        :param timeout: seconds to wait, float
+        :return path: the path of the downloaded file, str
+        """
+        if self.__downloads is None:
+            raise Exception("Downloads are not routed, call set_download_directory first")
+        return await self.__downloads.wait(timeout)
+
+    async def lookup(self, value, by=By.XPATH, timeout=3, multiple=False, stable_frames=2, cache_key=None):
+        """
+        Wait until an element is present, visible and stable (same position/ size for stable_frames frames),
+        scroll it into view and describe the matches, all in a single evaluate. The wait happens inside
+        the page and returns as soon as the element is ready
+        :param value: xpath or css selector of the element, str
+        :param by: type of selector, str
+        :param timeout: max seconds to wait, float
+        :param multiple: describe every match instead of the first one, boolean
+        :param stable_frames: frames the element has to keep its position/ size, int
+        :param cache_key: key the first match is registered under in the page, the registered element
+                          is used instead of evaluating the locator again, str
+        :return state, elements: 'ready', 'present' (found but hidden or moving at the timeout) or 'missing'
+                                 and the matching elements with their visibility/ enabled state/ box cached, tuple
+        """
+        kernel = await self.__kernel()
+        remote_object, errors = await kernel.call('lookup', locator_target(value, by, cache_key), {
+            'multiple': multiple,
+            'stableFrames': stable_frames,
+            'timeoutMs': int(timeout * 1000),
+        },
+            await_promise=True,
+            user_gesture=True,
+            # nodes come back as their backend node id without their children
+            serialization_options=uc.cdp.runtime.SerializationOptions(
+                serialization='deep', max_depth=5, additional_parameters={'maxNodeDepth': 0}
+            ),
+        )
+        if errors:
+            raise Exception(f"Element lookup failed: {errors.text}")
+
+        result = deserialize(remote_object.deep_serialized_value)
+        xpath = value if by == By.XPATH else ''
+        selector = value if by != By.XPATH else ''
+        elements = [
+            CustomWebElement(node_element(match['element'], self.__page), self.__page, xpath=xpath, selector=selector,
+                             visible=match['visible'], enabled=match['enabled'], rect=match['rect'],
+                             ready=result['state'] == 'ready' and index == 0, key=cache_key or '', kernel=kernel)
+            for index, match in enumerate(result['elements'])
+        ]
+        return result['state'], elements
+
+    async def wait_until_ready(self, value, by=By.XPATH, timeout=3, stable_frames=2, cache_key=None):
+        """
+        Wait until an element is present, visible and stable and scroll it into view
+        :return state: 'ready', 'present' (found but hidden or moving at the timeout) or 'missing', str
+        """
+        state, _ = await self.lookup(value, by=by, timeout=timeout, stable_frames=stable_frames, cache_key=cache_key)
+        return state
 
     async def open_new_window(self, tab_url='', wait=2, *args, **kwargs):
         """Switch window for new pop up opening"""
@@ -258,14 +865,72 @@ class NoDriverService(WebDriverInterface):
 
     async def return_to_original_window(self, *args, **kwargs):
         """Return to original window when pop up window closes"""
+        cache = self.__handle_caches.pop(self.__page.target_id, None)
+        if cache is not None:
+            cache.close()
         await self.__page.close()
         await self.__original_tab.bring_to_front()
         self.__page = self.__original_tab
         logger.info(f"Returned to original web page: {self.__page.text}")
         return
 
+    async def get_cookies(self):
+        """
+        Get the cookies of the browser, or of this driver's browser context when it is isolated
+        :return cookies: the cookies as cdp json, list of dicts
+        """
+        cookies = await self.__driver.connection.send(uc.cdp.storage.get_cookies(browser_context_id=self.__context_id))
+        return [cookie.to_json() for cookie in cookies]
+
+    async def set_cookies(self, cookies):
+        """
+        Restore cookies returned by get_cookies()
+        :param cookies: the cookies as cdp json, list of dicts
+        """
+        params = []
+        for cookie in cookies:
+            cookie = dict(cookie)
+            if cookie.get('session'):
+                # session cookies report an expiry of -1, which would set them already expired
+                cookie.pop('expires', None)
+            params.append(uc.cdp.network.CookieParam.from_json(cookie))
+        await self.__driver.connection.send(uc.cdp.storage.set_cookies(params, browser_context_id=self.__context_id))
+
+    async def current_url(self):
+        """
+        :return url: url of the current page, str
+        """
+        return await self.__page.evaluate('window.location.href')
+
     async def close(self):
-        """Close the browser"""
+        """Close the browser, or hand it back to the pool it was leased from"""
+        # the pages outlive this driver in a shared or pooled browser, stop listening to them
+        for cache in self.__handle_caches.values():
+            cache.close()
+        self.__handle_caches.clear()
+        if self.__downloads is not None:
+            self.__downloads.close()
+            self.__downloads = None
+        if self.__shared_browser:
+            # only close the tabs this driver opened, the browser belongs to another driver
+            if self.__page is not None and self.__page is not self.__original_tab:
+                await self.__page.close()
+            if self.__original_tab is not None:
+                await self.__original_tab.close()
+            if self.__context_id is not None:
+                await self.__driver.connection.send(uc.cdp.target.dispose_browser_context(self.__context_id))
+                self.__context_id = None
+            self.__page = None
+            self.__original_tab = None
+            logger.info(f"Completed all actions. Closed tab.")
+            return
+
+        if self.__pool is not None:
+            self.__pool.release(self.__driver)
+            self.__driver = None
+            logger.info(f"Completed all actions. Returned browser to the pool.")
+            return
+
         self.__driver.stop()
         await self.__driver.close()
         logger.info(f"Completed all actions. Closing driver.")
@@ -276,12 +941,34 @@ class CustomWebElement:
     A custom wrapper class that holds a nodriver element.
     Adds attributes to mimic selenium attributes for re-usability
     """
-    def __init__(self, element: NodriverElement, page: NodriverPage, xpath='', selector=''):
+    __slots__ = ('_element', '_xpath', '_selector', '_key', '_page', '_kernel', '_visible', '_enabled', '_ready',
+                 'rect')
+
+    def __init__(self, element: NodriverElement, page: NodriverPage, xpath='', selector='', visible=None,
+                 enabled=None, rect=None, ready=False, key='', kernel=None):
+        """
+        :param visible: visibility seen by the lookup that found the element, boolean
+        :param enabled: enabled state seen by the lookup, boolean
+        :param rect: bounding box seen by the lookup, {"x", "y", "width", "height"}, dict
+        :param ready: the lookup saw the element visible and stable, boolean
+        :param key: key the element is registered under in the page's handle cache, str
+        :param kernel: the kernel of the page the element scripts run in, PageKernel
+        """
         self._element = element
-        self._xpath = xpath.replace('"', "'")
+        self._xpath = xpath
         self._selector = selector
+        self._key = key
         self._page = page
-        print(dir(self))
+        self._kernel = kernel
+        self._visible = visible
+        self._enabled = enabled
+        self._ready = ready
+        self.rect = rect
+
+    def take_ready(self):
+        """whether the lookup saw the element ready, only answered once since the page keeps changing"""
+        ready, self._ready = self._ready, False
+        return ready
 
     def __getattr__(self, name):
         """
@@ -295,58 +982,273 @@ class CustomWebElement:
         """Mimicking selenium get_attribute"""
         return self._element.attrs.get(name)
 
+    def target(self):
+        """
+        the target argument of the kernel functions, the kernel uses the handle registered in the page
+        while it is valid and only evaluates the xpath/ selector after it was dropped
+        :return target: the target or None without xpath and selector, dict
+        """
+        if self._xpath:
+            return locator_target(self._xpath, By.XPATH, self._key or None)
+        if self._selector:
+            return locator_target(self._selector, By.CSS_SELECTOR, self._key or None)
+        return None
+
     async def is_displayed(self):
         """custom is_displayed method to mimick selenium"""
-        visibility_script = None
-        if self._xpath:
-            visibility_script = f"""
-                {{const el =
-                    document.evaluate("{self._xpath}", document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
-                    if (!el) {{
-                        false; // Return false if element not found
-                    }} else {{
-                        const style = window.getComputedStyle(el);
-                        const isHidden = style.display === 'none' || style.visibility === 'hidden';
-                        const hasSize = el.offsetWidth > 0 && el.offsetHeight > 0;
-                        !isHidden && hasSize; // Return true only if not hidden AND has size
-                    }}
-                }}
-            """
-        elif self._selector:
-            visibility_script = f"""
-                {{const el =
-                    document.querySelector("{self._selector}");
-                    if (!el) {{
-                        false; // Return false if element not found
-                    }} else {{
-                        const style = window.getComputedStyle(el);
-                        const isHidden = style.display === 'none' || style.visibility === 'hidden';
-                        const hasSize = el.offsetWidth > 0 && el.offsetHeight > 0;
-                        !isHidden && hasSize; // Return true only if not hidden AND has size
-                    }}
-                }}
-            """
-        if visibility_script is None:
+        if self._visible is not None:
+            # answered from the lookup that found the element, later calls check the page again
+            visible, self._visible = self._visible, None
+            return visible
+
+        target = self.target()
+        if target is None or self._kernel is None:
             raise NoSuchAttributeException("No selector or xpath found")
 
-        return await self._page.evaluate(visibility_script)
+        return await self._kernel.value('visible', target)
 
     async def get_value(self):
         """Check the current value of an element"""
-        if self._xpath:
-            get_value_script = f'document.evaluate("{self.xpath}", document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue.value;'
-            return await self._page.evaluate(get_value_script)
-        if self._selector:
-            get_value_script = f"""document.querySelector('{self._selector}').value"""
-            return await self._page.evaluate(get_value_script)
-
-        return None
+        target = self.target()
+        if target is None or self._kernel is None:
+            return None
+        return await self._kernel.value('extract', target, 'value')
 
     def is_enabled(self):
         """mimicking selenium is_inabled attribute"""
+        if self._enabled is not None:
+            return self._enabled
         return 'disabled' not in self._element.attrs
 
     @staticmethod
     def get_cookies():
         """Have to look more into this for nodriver"""
         return
+
+
+class NodeHandle:
+    """
+    A match of iter_elements: the node as the search described it (backend node id, tag and attributes),
+    the element is only built when it is needed
+    """
+    __slots__ = ('node', '_page')
+
+    def __init__(self, node, page):
+        """
+        :param node: the deep serialized dom node, dict
+        :param page: the tab the node belongs to, nodriver.Tab
+        """
+        self.node = node
+        self._page = page
+
+    @property
+    def backend_node_id(self):
+        return self.node['backendNodeId']
+
+    async def get_attribute(self, name):
+        """Mimicking selenium get_attribute"""
+        return (self.node.get('attributes') or {}).get(name)
+
+    async def element(self):
+        """
+        Build the full element to interact with
+        :return element: the element, CustomWebElement
+        """
+        return CustomWebElement(node_element(self.node, self._page), self._page)
+
+
+class HandleCache:
+    """
+    Elements found on a page by cache key (see handle_key), so repeated actions on the same element
+    reuse its node instead of evaluating the xpath/ selector again. The kernel in the page keeps the
+    elements too for the functions called on them.
+    Entries are dropped when the page navigates or when the page reports through the binding that
+    the element was removed from the document or its attributes changed. The report comes after the
+    change, so find_element asks the page whether the node is still connected before reusing it
+    """
+    def __init__(self, page):
+        """
+        :param page: the tab the elements belong to, nodriver.Tab
+        """
+        self.__page = page
+        self.__elements = {}
+        self.kernel = PageKernel(page)
+
+    def listen(self):
+        """subscribe to the binding calls (see HANDLE_BINDING) and navigations of the page"""
+        self.__page.add_handler(uc.cdp.runtime.BindingCalled, self.__on_binding_called)
+        self.__page.add_handler(uc.cdp.page.FrameNavigated, self.__on_frame_navigated)
+        self.kernel.listen()
+
+    def close(self):
+        """unsubscribe from the page and forget every element"""
+        remove_handler(self.__page, uc.cdp.runtime.BindingCalled, self.__on_binding_called)
+        remove_handler(self.__page, uc.cdp.page.FrameNavigated, self.__on_frame_navigated)
+        self.kernel.close()
+        self.__elements.clear()
+
+    def __on_binding_called(self, event):
+        if event.name == HANDLE_BINDING:
+            self.__elements.pop(event.payload, None)
+
+    def __on_frame_navigated(self, event):
+        # a new document, none of the nodes exist anymore
+        if event.frame.parent_id is None:
+            self.__elements.clear()
+
+    def get(self, key):
+        """:return element: the cached element or None, CustomWebElement"""
+        return self.__elements.get(key)
+
+    def put(self, key, element):
+        self.__elements[key] = element
+
+    def drop(self, key):
+        self.__elements.pop(key, None)
+
+    def __len__(self):
+        return len(self.__elements)
+
+
+class PageKernel:
+    """
+    The kernel (KERNEL_SCRIPT) of a page. It runs in an isolated world, the page's own scripts share the
+    DOM with it but never see its window property, its binding or its MutationObserver.
+    Every new document gets the world with the kernel from the browser (addScriptToEvaluateOnNewDocument),
+    the context id of its world is picked up from the execution context events. The document that was
+    already loaded gets its world on the first call
+    """
+    def __init__(self, page):
+        """
+        :param page: the tab the kernel runs in, nodriver.Tab
+        """
+        self.__page = page
+        self.__context_id = None
+
+    def listen(self):
+        """follow the execution contexts of the kernel world in the page's main frame"""
+        self.__page.add_handler(uc.cdp.runtime.ExecutionContextCreated, self.__on_context_created)
+        self.__page.add_handler(uc.cdp.runtime.ExecutionContextDestroyed, self.__on_context_destroyed)
+        self.__page.add_handler(uc.cdp.runtime.ExecutionContextsCleared, self.__on_contexts_cleared)
+
+    def close(self):
+        remove_handler(self.__page, uc.cdp.runtime.ExecutionContextCreated, self.__on_context_created)
+        remove_handler(self.__page, uc.cdp.runtime.ExecutionContextDestroyed, self.__on_context_destroyed)
+        remove_handler(self.__page, uc.cdp.runtime.ExecutionContextsCleared, self.__on_contexts_cleared)
+
+    def __on_context_created(self, event):
+        context = event.context
+        if context.name == KERNEL_WORLD and (context.aux_data or {}).get('frameId') == self.__page.target_id:
+            self.__context_id = context.id_
+
+    def __on_context_destroyed(self, event):
+        if event.execution_context_id == self.__context_id:
+            self.__context_id = None
+
+    def __on_contexts_cleared(self, event):
+        self.__context_id = None
+
+    async def install(self):
+        """install the kernel for every document the page loads from now on, the binding only exists in its world"""
+        await asyncio.gather(
+            self.__page.send(uc.cdp.page.add_script_to_evaluate_on_new_document(KERNEL_SCRIPT, world_name=KERNEL_WORLD)),
+            self.__page.send(uc.cdp.runtime.add_binding(HANDLE_BINDING, execution_context_name=KERNEL_WORLD)),
+        )
+
+    async def __context(self):
+        """the context id of the kernel world of the current document, created for a document loaded before install"""
+        if self.__context_id is None:
+            # the main frame id is the target id of the page
+            context_id = await self.__page.send(uc.cdp.page.create_isolated_world(
+                uc.cdp.page.FrameId(self.__page.target_id), world_name=KERNEL_WORLD
+            ))
+            await self.__page.send(uc.cdp.runtime.evaluate(KERNEL_SCRIPT, context_id=context_id))
+            self.__context_id = context_id
+        return self.__context_id
+
+    async def call(self, function, *args, **options):
+        """
+        Evaluate a kernel function in the kernel world
+        :param function: name of the kernel function, str
+        :param args: json serializable arguments
+        :param options: more Runtime.evaluate arguments, e.g. await_promise
+        :return remote_object, errors: the reply of Runtime.evaluate, tuple
+        """
+        expression = kernel_call(function, *args)
+        try:
+            return await self.__page.send(uc.cdp.runtime.evaluate(expression, context_id=await self.__context(), **options))
+        except ProtocolException:
+            # the world went away with its document before the event arrived, the next world is created
+            self.__context_id = None
+            return await self.__page.send(uc.cdp.runtime.evaluate(expression, context_id=await self.__context(), **options))
+
+    async def value(self, function, *args):
+        """
+        Call a kernel function and return its (json) value
+        :return value: the value returned by the function
+        """
+        remote_object, errors = await self.call(function, *args, await_promise=True, return_by_value=True)
+        if errors:
+            raise Exception(f"Kernel call {function} failed: {errors.text}")
+        return remote_object.value
+
+
+class DownloadTracker:
+    """
+    The browser downloads of a driver's pages, followed through the browser's download events.
+    Downloads started by other pages of the browser are ignored
+    """
+    def __init__(self, staging):
+        """
+        :param staging: the directory the browser writes the downloads to, named by their guid, str
+        """
+        self.staging = staging
+        self.directory = staging
+        # the main frames (the target ids of the pages) whose downloads are tracked
+        self.frames = set()
+        self.__connection = None
+        self.__started = {}
+        self.__finished = asyncio.Queue()
+
+    def listen(self, connection):
+        """subscribe to the download events of the browser connection"""
+        self.__connection = connection
+        connection.add_handler(uc.cdp.browser.DownloadWillBegin, self.__on_will_begin)
+        connection.add_handler(uc.cdp.browser.DownloadProgress, self.__on_progress)
+
+    def close(self):
+        """unsubscribe from the download events, the connection is shared by the other drivers of the browser"""
+        if self.__connection is not None:
+            remove_handler(self.__connection, uc.cdp.browser.DownloadWillBegin, self.__on_will_begin)
+            remove_handler(self.__connection, uc.cdp.browser.DownloadProgress, self.__on_progress)
+            self.__connection = None
+
+    def __on_will_begin(self, event):
+        if event.frame_id in self.frames:
+            # the directory routed when the download started, a later set_download_directory does not move it
+            self.__started[event.guid] = (event.suggested_filename, self.directory)
+
+    def __on_progress(self, event):
+        started = self.__started.get(event.guid)
+        if started is None or event.state == 'inProgress':
+            return
+        del self.__started[event.guid]
+        name, directory = started
+        if event.state == 'completed':
+            self.__finished.put_nowait((event.file_path or os.path.join(self.staging, event.guid), directory, name))
+        else:
+            self.__finished.put_nowait(Exception(f"Download of {name} was {event.state}"))
+
+    async def wait(self, timeout=60):
+        """
+        :param timeout: seconds to wait, float
+        :return path: the path of the next completed download, moved to the directory it was routed to, str
+        """
+        try:
+            finished = await asyncio.wait_for(self.__finished.get(), timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"No download finished within {timeout}s")
+        if isinstance(finished, Exception):
+            raise finished
+        # a copy when the staging directory is on another file system, not in the event handler
+        return await asyncio.to_thread(move_download, *finished)
@@ -0,0 +1,164 @@
+import asyncio
+import random
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+# every distribution takes the scaled delay and a random generator and returns the seconds to sleep,
+# add an entry here (or pass a func as the distribution) to plug in another one
+DISTRIBUTIONS = {
+    'uniform': lambda delay, rng: rng.uniform(delay, delay * 1.1),
+    'gaussian': lambda delay, rng: rng.gauss(delay, delay * .15),
+    'lognormal': lambda delay, rng: delay * rng.lognormvariate(0, .3),
+    'exponential': lambda delay, rng: rng.expovariate(1 / delay) if delay > 0 else 0,
+    'fixed': lambda delay, rng: delay,
+}
+
+PROFILES = {
+    # slower and more irregular than the default, for sites with aggressive bot detection
+    'stealth': {'scale': 1.5, 'distribution': 'lognormal', 'min_delay': .25, 'max_delay': None},
+    # the original humanized sleep, timeout to 1.1 * timeout
+    'balanced': {'scale': 1, 'distribution': 'uniform', 'min_delay': 0, 'max_delay': None},
+    'fast': {'scale': .25, 'distribution': 'uniform', 'min_delay': 0, 'max_delay': .5},
+    # internal sites without bot detection
+    'none': {'scale': 0, 'distribution': 'fixed', 'min_delay': 0, 'max_delay': 0},
+}
+
+
+def resolve_pacing(override, base=None):
+    """
+    Merge pacing settings on top of the base settings
+    :param override: a profile name, or a dict with an optional "profile" and settings to override, str | dict
+    :param base: settings to start from, dict (defaults to the balanced profile)
+    :return settings: the merged settings, dict
+    """
+    if isinstance(override, str):
+        override = {'profile': override}
+    settings = dict(base or PROFILES['balanced'])
+    profile = override.get('profile')
+    if profile is not None:
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown pacing profile '{profile}', expected one of {list(PROFILES)}")
+        settings = dict(PROFILES[profile])
+    settings.update({key: value for key, value in override.items() if key != 'profile' and value is not None})
+    return settings
+
+
+def pace(sleep, timeout):
+    """
+    The seconds a sleep func would wait for a requested delay, for delays that are played back by the
+    browser instead of slept (e.g. the pauses of a W3C actions request)
+    :param sleep: the sleep func of a driver, a Pacer or a plain async sleep func
+    :param timeout: the requested delay in seconds, float
+    :return delay: the delay picked (and charged to the budget) by a pacer, the requested one otherwise, float
+    """
+    return sleep.delay(timeout) if isinstance(sleep, Pacer) else timeout
+
+
+class Pacer:
+    """
+    Humanized delays between driver operations. The pacer is awaited like the sleep func,
+    await pacer(2), and scales/ randomizes the requested delay according to its profile.
+    Sites and action types can use their own profile and the total delay of a job can be capped with a budget
+    """
+    def __init__(self, profile='balanced', sites=None, actions=None, budget=None, rng=None, **settings):
+        """
+        Initializing the pacer
+        :param profile: stealth, balanced, fast or none, str
+        :param sites: profile name or settings per hostname, e.g. {"intranet.local": "none"}, dict
+        :param actions: profile name or settings per action type, e.g. {"input": "fast"}, dict
+        :param budget: max total seconds the pacer sleeps, later delays are skipped, float (None is unlimited)
+        :param rng: random generator, random.Random
+        :param settings: scale, distribution (name or func), min_delay and max_delay overriding the profile
+        """
+        self.__settings = resolve_pacing({'profile': profile, **settings})
+        self.__sites = sites or {}
+        self.__actions = actions or {}
+        self.__budget = budget
+        self.__rng = rng or random.Random()
+        self.__site_settings = None
+        self.__action = None
+        self.spent = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the pacer of a job from the "pacing" section of its config, the site override is picked from its url
+        :param config: job config, dict
+        :return pacer: the pacer or None when the config has no pacing section, Pacer
+        """
+        pacing = config.get('pacing')
+        if not pacing:
+            return None
+        if isinstance(pacing, str):
+            pacing = {'profile': pacing}
+        pacer = cls(**pacing)
+        if config.get('url'):
+            pacer.site = config['url']
+        return pacer
+
+    @property
+    def site(self):
+        return self.__site_settings
+
+    @site.setter
+    def site(self, url):
+        """use the override of the site (or of a parent domain) the url belongs to"""
+        host = urlparse(url).hostname or url
+        self.__site_settings = None
+        for site, override in self.__sites.items():
+            if host == site or host.endswith(f".{site}"):
+                self.__site_settings = override
+                break
+
+    @property
+    def remaining(self):
+        """seconds left in the budget, None when there is no budget"""
+        return None if self.__budget is None else max(self.__budget - self.spent, 0)
+
+    @contextmanager
+    def action(self, action_type):
+        """use the override of the action type for the delays inside the block"""
+        previous = self.__action
+        self.__action = action_type
+        try:
+            yield self
+        finally:
+            self.__action = previous
+
+    def delay(self, timeout):
+        """
+        Pick the delay for a requested timeout and charge it to the budget
+        :param timeout: the requested delay in seconds, float
+        :return delay: seconds to sleep, float
+        """
+        settings = self.__settings
+        if self.__site_settings is not None:
+            settings = resolve_pacing(self.__site_settings, settings)
+        if self.__action in self.__actions:
+            settings = resolve_pacing(self.__actions[self.__action], settings)
+
+        scaled = timeout * settings['scale']
+        distribution = settings['distribution']
+        if not callable(distribution):
+            distribution = DISTRIBUTIONS[distribution]
+        delay = max(distribution(scaled, self.__rng), settings['min_delay'] if scaled > 0 else 0, 0)
+        if settings['max_delay'] is not None:
+            delay = min(delay, settings['max_delay'])
+
+        if self.__budget is not None:
+            if delay > self.remaining:
+                if self.remaining > 0:
+                    logger.info(f"Pacing budget of {self.__budget}s used up, skipping the remaining delays")
+                delay = self.remaining
+        self.spent += delay
+        return delay
+
+    async def __call__(self, timeout):
+        delay = self.delay(timeout)
+        if delay > 0:
+            await asyncio.sleep(delay)
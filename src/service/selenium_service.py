@@ -1,66 +1,174 @@
 from src.repository.web_driver_interface import WebDriverInterface
+from src.service.typing_service import KeystrokeModel, BACKSPACE
+from src.service.mouse_service import MouseModel
+from src.service.user_agent_service import user_agents
+from src.service.form_service import SET_FIELD_SCRIPT
+from src.service.pacing_service import pace
+from src.service.download_service import DownloadWatcher, move_download
 
 from selenium.webdriver.chrome.options import Options
 from undetected_chromedriver import Chrome, ChromeOptions
+import os
 import tempfile
-from fake_useragent import UserAgent
 
 from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver import ActionChains
 from selenium.webdriver.support.select import Select
 from selenium.webdriver.support.wait import WebDriverWait
 
+import asyncio
 import json
+import time
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
                     datefmt='%m/%d/%Y %H:%M:%S %Z')
 logger = logging.getLogger(__name__)
 
+# returns the chunk of matches starting at arguments[2], the matches are kept in the page under the
+# search id between the chunks so the locator is evaluated once per iteration
+CHUNK_SCRIPT = """
+const [searchId, locator, start, size, isXpath] = arguments;
+const searches = window.__scraperSearches = window.__scraperSearches || {};
+if (!(searchId in searches)) {
+    if (isXpath) {
+        const snapshot = document.evaluate(locator, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        searches[searchId] = Array.from({length: snapshot.snapshotLength}, (_, i) => snapshot.snapshotItem(i))
+            .filter((node) => node.nodeType === 1);
+    } else {
+        searches[searchId] = Array.from(document.querySelectorAll(locator));
+    }
+}
+return searches[searchId].slice(start, start + size);
+"""
+
+# evaluates every expression of arguments[0] on its own (a syntax error only fails its expression), waits for
+# the promises and calls back with a [succeeded, value or error] pair per expression
+EVALUATE_BATCH_SCRIPT = """
+const [expressions, done] = [arguments[0], arguments[arguments.length - 1]];
+// indirect eval runs in the global scope like a console/ Runtime.evaluate expression
+Promise.allSettled(expressions.map((expression) => new Promise((resolve) => resolve((0, eval)(expression)))))
+    .then((results) => done(results.map((result) => result.status === 'fulfilled'
+        ? [true, result.value] : [false, String(result.reason)])));
+"""
+
+# drops the matches of a search, arguments[0] is the search id
+DISCARD_SEARCH_SCRIPT = """
+if (window.__scraperSearches) delete window.__scraperSearches[arguments[0]];
+"""
+
+# scrolls arguments[0] to the center of the viewport and returns its box and the size of the viewport
+CLICK_RECT_SCRIPT = """
+arguments[0].scrollIntoView({block: 'center', inline: 'nearest'});
+return Object.assign(arguments[0].getBoundingClientRect().toJSON(),
+                     {viewportWidth: window.innerWidth, viewportHeight: window.innerHeight});
+"""
+
+# sets the value of every field of arguments[0] ({locator, value}, xpaths) and dispatches input/ change,
+# returns whether each field was found and set
+FILL_FORM_SCRIPT = SET_FIELD_SCRIPT + """
+return arguments[0].map((field) => {
+    const el = document.evaluate(field.locator, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    return !!el && setField(el, field.value);
+});
+"""
+
 class SeleniumUndetectableDriverService(WebDriverInterface):
-    def __init__(self, sleep, timeout=5, *args, **kwargs):
+    def __init__(self, sleep, timeout=5, pool=None, poll_frequency=.1, *args, **kwargs):
         """
         Initializing selenium undetectable chrome driver
-        :param sleep: async sleep func, func"""
+        :param sleep: async sleep func, func
+        :param timeout: unused, every lookup runs its own explicit wait (see wait_for), int
+        :param pool: optional pool to lease a warm browser from instead of launching one, BrowserPool
+        :param poll_frequency: seconds between checks while waiting for an element, float"""
+        if kwargs.get('browser') is not None:
+            raise Exception("Attaching to a running browser is only supported by the nodriver driver")
         logger.info(f"Initialized SeleniumUndetectableDriver")
-        try:
-            options = Options() # ChromeOptions() # webdriver.ChromeOptions()
-            options.add_argument("--kiosk-printing")
-            # options.add_argument("--kiosk")
-            settings = {
-                "recentDestinations": [{"id": "Save as PDF", "origin": "local"}],
-                "selectedDestinationId": "Save as PDF",
-                "version": 2,
-            }
-            prefs = {
-                "printing.print_preview_sticky_settings.appState": json.dumps(settings),
-                "plugins.always_open_pdf_externally": True,
-                "download.prompt_for_download": False,
-            }
-            options.add_experimental_option("prefs", prefs)
-            # Add more realistic, human-like arguments
-            options.add_argument("--disable-blink-features=AutomationControlled")
-            options.add_argument("--window-size=1920,1080")
-            # # options.add_argument("--window-size=1440,900")
-            options.add_argument("--no-sandbox")
-            options.add_argument("--disable-dev-shm-usage")
-            options.add_argument(f"user-agent={UserAgent().random}")
-            #
-            # temp_dir = '~/Chrome_dev_session' # tempfile.mkdtemp()
-            temp_dir = tempfile.mkdtemp()
-            options.add_argument(f"--user-data-dir={temp_dir}")
-            driver = Chrome(options=options, use_subprocess=True)
-            self.__sleep = sleep
-            driver.implicitly_wait(timeout)
-            driver.maximize_window()
-            logger.info(f'Initialized Chrome driver')
-            self.__driver = driver
-            self.__actions = ActionChains(driver)
-            self.__original_window = driver.current_window_handle
+        self.__sleep = sleep
+        self.__pool = pool
+        self.__poll_frequency = poll_frequency
+        self.__lookup_time = 0
+        self.__driver = None
+        self.__actions = None
+        self.__mouse = MouseModel()
+        self.__original_window = None
+        self.__download_directory = None
+        self.__download_watcher = None
+        if pool is not None:
+            # the browser is leased from the pool on the first get()
+            return
 
+        try:
+            self.__set_driver(self.launch_chrome())
         except Exception as e:
             logger.error(f'An error occurred loading chrome driver: {e}')
 
+    @staticmethod
+    def launch_chrome():
+        """
+        Launch an undetectable chrome browser
+        :return driver: the launched chrome driver, undetected_chromedriver.Chrome
+        """
+        options = Options() # ChromeOptions() # webdriver.ChromeOptions()
+        options.add_argument("--kiosk-printing")
+        # options.add_argument("--kiosk")
+        settings = {
+            "recentDestinations": [{"id": "Save as PDF", "origin": "local"}],
+            "selectedDestinationId": "Save as PDF",
+            "version": 2,
+        }
+        prefs = {
+            "printing.print_preview_sticky_settings.appState": json.dumps(settings),
+            "plugins.always_open_pdf_externally": True,
+            "download.prompt_for_download": False,
+        }
+        options.add_experimental_option("prefs", prefs)
+        # Add more realistic, human-like arguments
+        options.add_argument("--disable-blink-features=AutomationControlled")
+        options.add_argument("--window-size=1920,1080")
+        # # options.add_argument("--window-size=1440,900")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument(f"user-agent={user_agents().random}")
+        #
+        # temp_dir = '~/Chrome_dev_session' # tempfile.mkdtemp()
+        temp_dir = tempfile.mkdtemp()
+        options.add_argument(f"--user-data-dir={temp_dir}")
+        driver = Chrome(options=options, use_subprocess=True)
+        # every lookup goes through an explicit wait, an implicit wait would stack on top of each poll
+        driver.implicitly_wait(0)
+        driver.maximize_window()
+        logger.info(f'Initialized Chrome driver')
+        return driver
+
+    @staticmethod
+    async def start_browser():
+        """Launch a browser for the browser pool without blocking the event loop"""
+        return await asyncio.to_thread(SeleniumUndetectableDriverService.launch_chrome)
+
+    @staticmethod
+    async def reset_browser(driver):
+        """Close every window except the first one and blank it so the browser can be leased again"""
+        def reset():
+            for handle in driver.window_handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(driver.window_handles[0])
+            driver.get('about:blank')
+
+        # every webdriver call is a blocking http request
+        await asyncio.to_thread(reset)
+
+    @staticmethod
+    def stop_browser(driver):
+        """Stop a pooled browser for good"""
+        driver.quit()
+
+    def __set_driver(self, driver):
+        self.__driver = driver
+        self.__actions = ActionChains(driver)
+        self.__original_window = driver.current_window_handle
 
     async def get(self, url):
         """
@@ -68,52 +176,74 @@ class SeleniumUndetectableDriverService(WebDriverInterface):
         :param url: url to fetch, str
         :return self.__driver: the driver with the fetched web page
         """
+        if self.__driver is None and self.__pool is not None:
+            self.__set_driver(await self.__pool.lease())
         await self.__sleep(1)
         self.__driver.get(url)
         self.__original_window = self.__driver.current_window_handle
         return self.__driver
 
-    async def find_elements(self, by=By.XPATH, value='', action={}, timeout=15, required=True, *args, **kwargs):
+    async def wait_for(self, condition, timeout=5):
+        """
+        Wait for an expected condition and return its value, e.g. the element the condition located,
+        so the element does not have to be looked up again after the wait.
+        The wait runs in a thread so other jobs on the event loop keep running
+        :param condition: selenium expected condition, func
+        :param timeout: max seconds to wait, float
+        :return value: the truthy value returned by the condition
+        """
+        wait = WebDriverWait(self.__driver, timeout, poll_frequency=self.__poll_frequency)
+        return await asyncio.to_thread(wait.until, condition)
+
+    @property
+    def lookup_time(self):
+        """seconds the last find_element/ find_elements call spent waiting for the element"""
+        return self.__lookup_time
+
+    async def __timed_wait_for(self, condition, timeout):
+        started = time.monotonic()
+        try:
+            return await self.wait_for(condition, timeout)
+        finally:
+            self.__lookup_time = time.monotonic() - started
+
+    async def find_elements(self, by=By.XPATH, value='', action={}, timeout=15, required=True, wait_timeout=None,
+                            *args, **kwargs):
         """
         Find elements matching the value selector
         :param value: html selector/ xpath, vtr
         :param by: type of selector, str
         :param required: whether the element is required to be in the document, boolean
+        :param wait_timeout: max seconds to wait for the elements, overrides the action's wait, float
         :return elements: array of found elements, list
         """
         wait = action.get('wait', .5)
         await self.__sleep(wait)
         try:
-            WebDriverWait(self.__driver, action.get('wait', timeout)).until(
-                EC.visibility_of_element_located((by, value))
-            )
-            await self.__sleep(wait)
-            elements = self.__driver.find_elements(by=by, value=value)
-
-            if not len(elements) and required:
+            elements = await self.__timed_wait_for(EC.visibility_of_any_elements_located((by, value)),
+                                                   wait_timeout if wait_timeout is not None else action.get('wait', timeout))
+            if not elements and required:
                 raise Exception(f"Element for {action['type']} action was not found")
 
-            self.__driver.execute_script("arguments[0].scrollIntoView(true);", elements)
+            self.__driver.execute_script("arguments[0].scrollIntoView(true);", elements[0])
             return elements
         except Exception as e:
             logger.error(f"Error: The element was not visible & clickable within the given time. {e}")
             raise
 
-    async def find_element(self, by=By.XPATH, value='', action={}, timeout=4, required=True, *args, **kwargs):
+    async def find_element(self, by=By.XPATH, value='', action={}, timeout=4, required=True, wait_timeout=None,
+                           *args, **kwargs):
         """
         Find the first element matching the value selector
+        :param wait_timeout: max seconds to wait for the element, overrides the action's wait, float
         :return element: first found html element, nodriver.core.element.Element
         """
         wait = action.get('wait', .5)
         await self.__sleep(wait)
         try:
-            WebDriverWait(self.__driver, action.get('wait', timeout)).until(
-                EC.visibility_of_element_located((by, value))
-            )
-            await self.__sleep(wait)
-            element = self.__driver.find_element(by=by, value=value)
-
-            if element is None and required:
+            element = await self.__timed_wait_for(EC.visibility_of_element_located((by, value)),
+                                                  wait_timeout if wait_timeout is not None else action.get('wait', timeout))
+            if not element and required:
                 raise Exception(f"Element was not found")
 
             self.__driver.execute_script("arguments[0].scrollIntoView(true);", element)
@@ -125,21 +255,67 @@ class SeleniumUndetectableDriverService(WebDriverInterface):
             else:
                 return None
 
+    async def iter_elements(self, value='', by=By.XPATH, chunk_size=500, *args, **kwargs):
+        """
+        Iterate over the elements matching the value selector without waiting for or materializing
+        all of them, the matches are fetched chunk_size at a time. Selenium elements are references
+        that fetch their attributes on demand
+        :param value: html selector/ xpath, str
+        :param by: type of selector, By.XPATH or By.CSS_SELECTOR, str
+        :param chunk_size: matches fetched per round trip, int
+        :return elements: async iterator of the matching elements, selenium WebElement
+        """
+        search_id = f"{id(self)}-{time.monotonic_ns()}"
+        start = 0
+        try:
+            while True:
+                chunk = await asyncio.to_thread(self.__driver.execute_script, CHUNK_SCRIPT, search_id, value, start,
+                                                chunk_size, by == By.XPATH)
+                for element in chunk:
+                    yield element
+                if len(chunk) < chunk_size:
+                    return
+                start += chunk_size
+        finally:
+            # also when the caller stopped early, the page would keep the matches alive
+            await asyncio.to_thread(self.__driver.execute_script, DISCARD_SEARCH_SCRIPT, search_id)
+
+    async def evaluate_batch(self, expressions, return_exceptions=False):
+        """
+        Evaluate independent js expressions in one execute_async_script instead of one request each,
+        promises are awaited like nodriver's evaluate_batch does
+        :param expressions: js expressions, list of str
+        :param return_exceptions: return the errors of failed expressions in place of their value instead of raising, boolean
+        :return values: the values in the order of the expressions, list
+        """
+        results = await asyncio.to_thread(self.__driver.execute_async_script, EVALUATE_BATCH_SCRIPT, list(expressions))
+        values = []
+        for expression, (succeeded, value) in zip(expressions, results):
+            if not succeeded:
+                value = Exception(f"Evaluating {expression[:80]} failed: {value}")
+                if not return_exceptions:
+                    raise value
+            values.append(value)
+        return values
+
     async def click_element(self, element=None, timeout=5, required=True, *args, **kwargs):
-        """Click element using actions"""
+        """
+        Click element using actions
+        :return clicked: False when the click failed and was not required
+        """
         try:
-            WebDriverWait(self.__driver, timeout).until(
-                EC.element_to_be_clickable(element)
-            )
+            element = await self.wait_for(EC.element_to_be_clickable(element), timeout)
             await self.__sleep(.5)
             # return element.click()
-            return self.__actions.move_to_element(element).click().perform()
+            # scrolled into the viewport first, the actions request can only move the pointer inside it
+            rect = await asyncio.to_thread(self.__driver.execute_script, CLICK_RECT_SCRIPT, element)
+            return await self.click_at(rect, viewport=(rect['viewportWidth'], rect['viewportHeight']))
         except Exception as e:
             logger.error(f'The button was not found', e)
             if required:
                 raise
             else:
-                return None
+                return False
 
     async def type_input(self, action={}, element=None, *args, **kwargs):
         """
@@ -151,12 +327,53 @@ class SeleniumUndetectableDriverService(WebDriverInterface):
         await self.__sleep(wait)
         element.clear()
         await self.__sleep(wait)
-        for char in str(action.get("value", "")):
-            # simulate human behavior by typing one char at a time
-            element.send_keys(char)
-            await self.__sleep(wait / 5)
+        # simulate human behavior with bursts of keystrokes, pauses and corrected typos
+        await self.type_keys(KeystrokeModel.from_action(action, default_wait=1).schedule(action.get("value", "")),
+                             element=element)
         logger.info("Text was input successfully.")
 
+    async def click_at(self, rect, viewport=None):
+        """
+        Move the mouse along a human-like path into a box and click it, the path, its timing and the
+        click are sent as one W3C actions request and played back by the browser
+        :param rect: viewport box, {"x", "y", "width", "height"}, dict
+        :param viewport: width and height of the viewport, the path is kept inside it, tuple
+        """
+        x, y = self.__mouse.target(rect)
+        path = self.__mouse.move_to((x, y), width=min(rect['width'], rect['height']))
+        actions = ActionChains(self.__driver)
+        pointer = actions.w3c_actions.pointer_action
+        for px, py in path.points:
+            if viewport is not None:
+                # the bow of the path can leave the viewport, chromedriver rejects moves outside of it
+                px, py = min(max(px, 0), viewport[0] - 1), min(max(py, 0), viewport[1] - 1)
+            pointer.source.create_pointer_move(duration=int(path.interval * 1000), x=int(px), y=int(py),
+                                               origin='viewport')
+        pointer.pointer_down()
+        pointer.pause(self.__mouse.hold())
+        pointer.pointer_up()
+        await asyncio.to_thread(actions.perform)
+
+    async def type_keys(self, bursts, element=None):
+        """
+        Type precomputed bursts into an element (or the focused element), the whole schedule including its
+        pauses is sent as one W3C actions request and played back by the browser, the pauses are scaled by
+        the pacer like the slept delays
+        :param bursts: the bursts of a KeystrokeModel schedule, list of Burst
+        :param element: element to focus first, clear() blurs the element it empties, WebElement
+        """
+        if element is not None:
+            await asyncio.to_thread(self.__driver.execute_script, "arguments[0].focus();", element)
+        actions = ActionChains(self.__driver)
+        for burst in bursts:
+            if burst.pause:
+                actions.pause(pace(self.__sleep, burst.pause))
+            for key, interval in zip(burst.keys, burst.intervals):
+                if interval:
+                    actions.pause(pace(self.__sleep, interval))
+                actions.send_keys(Keys.BACKSPACE if key == BACKSPACE else key)
+        await asyncio.to_thread(actions.perform)
+
     async def dropdown_select(self, action={}, element=None, *args, **kwargs):
         """Select an option from a select droption element"""
         wait = action.get('wait', .5)
@@ -173,6 +390,18 @@ class SeleniumUndetectableDriverService(WebDriverInterface):
         except Exception as e:
             logger.error(f"Dropdown selection error. {e}")
 
+    async def fill_form(self, fields=(), *args, **kwargs):
+        """
+        Set the values of many form fields (text inputs, textareas, selects, checkboxes/ radios) in one
+        execute_script, every field gets its input/ change events
+        :param fields: {"xpath": ..., "value": ...} per field, a select takes the text or value of the option
+                       and a checkbox/ radio a boolean, list of dicts
+        :return filled: whether each field was found and set, list of booleans
+        """
+        return await asyncio.to_thread(self.__driver.execute_script, FILL_FORM_SCRIPT, [
+            {'locator': field['xpath'], 'value': field.get('value', '')} for field in fields
+        ])
+
     async def file_upload(self, value='', element=None, wait=1, *args, **kwargs):
         """
         Upload a document to the website
@@ -184,6 +413,32 @@ class SeleniumUndetectableDriverService(WebDriverInterface):
         except Exception as e:
             logger.error(f'Error uploading file: {e}')
 
+    async def set_download_directory(self, directory):
+        """
+        Route the browser's downloads into a directory. Chrome writes them into a staging directory of this
+        driver and wait_for_download moves them once they are complete, so jobs downloading into the same
+        directory at the same time never mix their files
+        :param directory: the job's download directory, created when missing, str
+        """
+        self.__download_directory = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+        if self.__download_watcher is None:
+            staging = tempfile.mkdtemp()
+            self.__driver.execute_cdp_cmd('Browser.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': staging})
+            self.__download_watcher = DownloadWatcher(staging, self.__poll_frequency)
+
+    async def wait_for_download(self, timeout=60):
+        """
+        Wait for the next download to complete, polling the staging directory
+        :param timeout: seconds to wait, float
+        :return path: the path of the downloaded file, str
+        """
+        if self.__download_watcher is None:
+            raise Exception("Downloads are not routed, call set_download_directory first")
+        path = await self.__download_watcher.wait(timeout)
+        # a copy when the staging directory is on another file system, off the event loop
+        return await asyncio.to_thread(move_download, path, self.__download_directory, os.path.basename(path))
+
     async def open_new_window(self, wait=2, *args, **kwargs):
         """Switch window for pop up opening"""
         await self.__sleep(wait)
@@ -200,7 +455,37 @@ class SeleniumUndetectableDriverService(WebDriverInterface):
             self.__driver.switch_to.window(self.__original_window)
             logger.info(f"Returned to original web page: {self.__original_window}")
 
+    async def get_cookies(self):
+        """
+        Get the cookies of the current page
+        :return cookies: the cookies as selenium cookie dicts, list of dicts
+        """
+        return self.__driver.get_cookies()
+
+    async def set_cookies(self, cookies):
+        """
+        Restore cookies returned by get_cookies(), selenium can only add cookies for the domain of the current page
+        :param cookies: the cookies as selenium cookie dicts, list of dicts
+        """
+        for cookie in cookies:
+            try:
+                self.__driver.add_cookie(cookie)
+            except Exception as e:
+                logger.warning(f"Could not restore cookie {cookie.get('name')} for {cookie.get('domain')}: {e}")
+
+    async def current_url(self):
+        """
+        :return url: url of the current page, str
+        """
+        return self.__driver.current_url
+
     def close(self):
-        """Close the browser"""
+        """Close the browser, or hand it back to the pool it was leased from"""
+        if self.__pool is not None:
+            self.__pool.release(self.__driver)
+            self.__driver = None
+            logger.info(f"Completed all actions. Returned browser to the pool.")
+            return
+
         self.__driver.quit()
         logger.info(f"Completed all actions. Closing driver.")
\ No newline at end of file
@@ -0,0 +1,113 @@
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from src.service.job_runner_service import JobResult
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+
+def job_domain(job):
+    """shard key of a job, jobs for the same site go to the same worker so per-site sessions stay together"""
+    return urlparse(job.get('url', '')).hostname or ''
+
+
+class HashRing:
+    """
+    Consistent hash ring that maps keys to shards.
+    Every shard is placed on the ring many times (virtual nodes) so keys spread evenly,
+    and changing the number of shards only moves the keys of the shards that changed
+    """
+    def __init__(self, shards, replicas=100):
+        """
+        :param shards: number of shards, int
+        :param replicas: virtual nodes per shard, int
+        """
+        if shards < 1:
+            raise ValueError(f"The hash ring needs at least 1 shard, got {shards}")
+
+        ring = sorted((self.__hash(f"{shard}-{replica}"), shard)
+                      for shard in range(shards) for replica in range(replicas))
+        self.__hashes = [h for h, _ in ring]
+        self.__shards = [shard for _, shard in ring]
+
+    @staticmethod
+    def __hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def shard_for(self, key):
+        """
+        Find the shard that owns the key
+        :param key: the key to place on the ring, str
+        :return shard: index of the shard, int
+        """
+        index = bisect.bisect(self.__hashes, self.__hash(key)) % len(self.__hashes)
+        return self.__shards[index]
+
+
+def shard_jobs(jobs, shards, key=job_domain):
+    """
+    Split the jobs into shards with consistent hashing
+    :param jobs: the jobs to split, list
+    :param shards: number of shards, int
+    :param key: func that returns the shard key of a job, func
+    :return shards: a list per shard of (position in jobs, job) tuples, list
+    """
+    ring = HashRing(shards)
+    sharded = [[] for _ in range(shards)]
+    for index, job in enumerate(jobs):
+        sharded[ring.shard_for(key(job))].append((index, job))
+    return sharded
+
+
+class ShardedRunner:
+    """
+    Run a job list across several processes so python side work is not capped at one core.
+    Each process gets one shard of the jobs and runs it with its own event loop and drivers.
+    """
+    def __init__(self, run_shard, processes=None, key=job_domain):
+        """
+        Initializing the sharded runner
+        :param run_shard: top level (picklable) func that runs a list of jobs in a worker process
+                          and returns a result per job, func
+        :param processes: number of worker processes, int (defaults to the number of cores)
+        :param key: func that returns the shard key of a job, func
+        """
+        self.__run_shard = run_shard
+        self.__processes = processes or os.cpu_count() or 1
+        self.__key = key
+
+    async def run(self, jobs):
+        """
+        Shard the jobs across the worker processes and collect the results
+        :param jobs: the jobs to run, list
+        :return results: a result per job in the same order as the jobs, list
+        """
+        shards = [shard for shard in shard_jobs(jobs, self.__processes, self.__key) if shard]
+        logger.info(f"Running {len(jobs)} jobs in {len(shards)} processes")
+
+        loop = asyncio.get_running_loop()
+        # spawn so the workers do not inherit the parent's running event loop and browser connections
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(shards) or 1, mp_context=context) as executor:
+            # a crashed process only fails the jobs of its own shard
+            shard_results = await asyncio.gather(*(
+                loop.run_in_executor(executor, self.__run_shard, [job for _, job in shard])
+                for shard in shards
+            ), return_exceptions=True)
+
+        results = [None] * len(jobs)
+        for shard, shard_result in zip(shards, shard_results):
+            if isinstance(shard_result, BaseException):
+                logger.error(f"A shard of {len(shard)} jobs failed: {shard_result!r}")
+                shard_result = [JobResult(job, error=repr(shard_result)) for _, job in shard]
+            for (index, _), result in zip(shard, shard_result):
+                results[index] = result
+        return results
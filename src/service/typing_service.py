@@ -0,0 +1,103 @@
+import random
+from collections import namedtuple
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S %Z')
+logger = logging.getLogger(__name__)
+
+BACKSPACE = '\b'
+
+# neighbouring keys on a qwerty keyboard, typos hit one of them
+KEYBOARD_ROWS = ['1234567890', 'qwertyuiop', 'asdfghjkl', 'zxcvbnm']
+NEIGHBOURS = {
+    key: row[max(index - 1, 0):index] + row[index + 1:index + 2]
+    for row in KEYBOARD_ROWS for index, key in enumerate(row)
+}
+
+# keys typed together without a pause, the pause before the burst and the delay before every key of it
+Burst = namedtuple('Burst', ['pause', 'keys', 'intervals'])
+
+
+class KeystrokeModel:
+    """
+    Precomputed keystroke timing of a text: the keys are typed in bursts of a few characters with
+    short intervals, separated by longer thinking pauses (more likely after a space), with occasional
+    typos on a neighbouring key that are noticed after a pause and corrected with a backspace.
+    The drivers type the keys in order and wait the pause/ interval before each of them
+    """
+    def __init__(self, interval=.1, burst_min=3, burst_max=8, pause=.4, typo_rate=.02, rng=None):
+        """
+        :param interval: mean seconds between the keys of a burst, float
+        :param burst_min: fewest keys of a burst, int
+        :param burst_max: most keys of a burst, int
+        :param pause: mean seconds of the pause between bursts, float
+        :param typo_rate: chance of a typo per letter/ digit, float
+        :param rng: random generator, random.Random
+        """
+        self.interval = interval
+        self.burst_min = burst_min
+        self.burst_max = burst_max
+        self.pause = pause
+        self.typo_rate = typo_rate
+        self.__rng = rng or random.Random()
+
+    @classmethod
+    def from_action(cls, action, default_wait=.5):
+        """
+        Create the model of an input action, the "typing" section overrides the defaults and the mean
+        interval is a fifth of the action's wait like the character by character typing
+        :param action: the input action, dict
+        :param default_wait: wait of actions without one, float
+        :return model: the keystroke model, KeystrokeModel
+        """
+        settings = {'interval': action.get('wait', default_wait) / 5, **action.get('typing', {})}
+        return cls(**settings)
+
+    def __delay(self, mean):
+        return mean * self.__rng.lognormvariate(0, .35) if mean > 0 else 0
+
+    def __typo(self, char):
+        neighbours = NEIGHBOURS.get(char.lower())
+        if not neighbours:
+            return None
+        typo = self.__rng.choice(neighbours)
+        return typo.upper() if char.isupper() else typo
+
+    def schedule(self, text):
+        """
+        Precompute the bursts to type a text
+        :param text: the text to type, str
+        :return bursts: the bursts in typing order, list of Burst
+        """
+        bursts = []
+        keys, intervals, pause = [], [], 0
+        length = self.__rng.randint(self.burst_min, self.burst_max)
+
+        def end_burst(next_pause):
+            nonlocal keys, intervals, pause, length
+            if keys:
+                bursts.append(Burst(pause, keys, intervals))
+            keys, intervals, pause = [], [], next_pause
+            length = self.__rng.randint(self.burst_min, self.burst_max)
+
+        for char in str(text):
+            typo = self.__typo(char) if self.__rng.random() < self.typo_rate else None
+            if typo:
+                keys.append(typo)
+                intervals.append(self.__delay(self.interval))
+                # noticing the typo takes a moment, the next burst starts by correcting it
+                end_burst(self.__delay(self.pause * 1.5))
+                keys.append(BACKSPACE)
+                intervals.append(0)
+            keys.append(char)
+            intervals.append(self.__delay(self.interval) if len(keys) > 1 else 0)
+            if len(keys) >= length or (char == ' ' and self.__rng.random() < .5):
+                end_burst(self.__delay(self.pause))
+        end_burst(0)
+        return bursts
+
+    @staticmethod
+    def duration(bursts):
+        """seconds it takes to type the bursts, float"""
+        return sum(burst.pause + sum(burst.intervals) for burst in bursts)
@@ -0,0 +1,9 @@
+import functools
+
+from fake_useragent import UserAgent
+
+
+@functools.lru_cache(maxsize=1)
+def user_agents():
+    """loading the user agent data takes ~60ms, so it is loaded once per process and reused by every driver"""
+    return UserAgent()
@@ -1,5 +1,4 @@
 # import getpass
-import glob
 import os.path
 import logging
 import datetime as dt
@@ -28,6 +27,9 @@ import os
 
 from src.service.nodriver_service import NoDriverService
 from src.service.selenium_service import SeleniumUndetectableDriverService
+from src.service.browser_pool_service import BrowserPool
+from src.service.pacing_service import Pacer
+from src.service.download_service import PARTIAL_SUFFIXES
 
 drivers = {
     'selenium': SeleniumUndetectableDriverService,
@@ -38,10 +40,30 @@ MyDriver = drivers[config.get('driver', 'nodriver')]
 
 class CustomDriver(MyDriver):
     """This class abstracts away the external driver initialization logic"""
-    def __init__(self, timeout=5):
-        super().__init__(sleep, implicit_wait=timeout)
+    def __init__(self, timeout=5, pool=None, pacer=None, **kwargs):
+        """
+        :param pacer: pacing engine used in place of the default humanized sleep, Pacer
+        """
+        super().__init__(pacer if pacer is not None else sleep, implicit_wait=timeout, pool=pool,
+                         poll_frequency=config.get('poll_frequency', .1), **kwargs)
         # print(dir(self))
 
+async def create_browser_pool(pool_config):
+    """
+    Create and warm up a pool of browsers for the configured driver
+    :param pool_config: "browser_pool" section of the config, dict
+    :return pool: the started browser pool, BrowserPool
+    """
+    pool = BrowserPool(
+        MyDriver.start_browser,
+        reset=MyDriver.reset_browser,
+        shutdown=MyDriver.stop_browser,
+        min_size=pool_config.get('min_size', 1),
+        max_size=pool_config.get('max_size', 4),
+        spares=pool_config.get('spares', 1)
+    )
+    return await pool.start()
+
 async def sleep(timeout):
     # max_range = timeout / 10
     max_range = timeout + (.1 * timeout)
@@ -61,9 +83,23 @@ def get_date_range_tuple(relative_to=dt.datetime.today()):
     return previous_monday, last_sunday
 
 def get_most_recent_downloaded_file(folder):
-    # /Users/{getpass.getuser()}/Downloads/*
-    list_of_files = glob.glob(folder)
-    return max(list_of_files, key=os.path.getctime)
+    """
+    The most recently created finished download of a folder in one os.scandir pass, files the
+    browser is still writing (.crdownload etc.) are skipped
+    :param folder: the download folder, e.g. /Users/{getpass.getuser()}/Downloads, a trailing /* is ignored, str
+    :return path: the path of the file or None when the folder has no finished download, str
+    """
+    if folder.endswith('*'):
+        folder = os.path.dirname(folder) or '.'
+    latest, latest_ctime = None, None
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(PARTIAL_SUFFIXES) or not entry.is_file():
+                continue
+            ctime = entry.stat().st_ctime
+            if latest_ctime is None or ctime > latest_ctime:
+                latest, latest_ctime = entry.path, ctime
+    return latest
 
 
 def check_path(path):
@@ -0,0 +1,18 @@
+from src.repository.action_checkpoint_repository import ActionCheckpoint
+
+
+class TestActionCheckpoint:
+    def test_save_and_load(self, tmp_path):
+        checkpoint = ActionCheckpoint(tmp_path / 'flow.json')
+        assert checkpoint.load() is None
+
+        checkpoint.save(3, 'https://example.com/step-2', [{'name': 'session', 'value': 'abc'}])
+        assert checkpoint.load() == {'index': 3, 'url': 'https://example.com/step-2',
+                                     'cookies': [{'name': 'session', 'value': 'abc'}]}
+
+        checkpoint.clear()
+        assert checkpoint.load() is None
+
+    def test_unreadable_checkpoint_is_ignored(self, tmp_path):
+        (tmp_path / 'flow.json').write_text('{"index": 3')
+        assert ActionCheckpoint(tmp_path / 'flow.json').load() is None
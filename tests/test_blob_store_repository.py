@@ -0,0 +1,109 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from src.repository.blob_store_repository import BlobStore
+
+
+class TestBlobStore:
+    def test_add_file_dedupes_into_links(self, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        for day in ('1', '2'):
+            (tmp_path / f'report_{day}.pdf').write_bytes(b'same report')
+
+        first = store.add_file(str(tmp_path / 'report_1.pdf'), url='https://example.com/report.pdf', etag='"a"')
+        second = store.add_file(str(tmp_path / 'report_2.pdf'))
+
+        assert first == second == hashlib.sha256(b'same report').hexdigest()
+        assert os.path.samefile(tmp_path / 'report_1.pdf', tmp_path / 'report_2.pdf')
+        assert os.stat(store.blob_path(first)).st_nlink == 3
+        assert (tmp_path / 'report_2.pdf').read_bytes() == b'same report'
+
+    def test_index(self, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        (tmp_path / 'a.pdf').write_bytes(b'v1')
+        digest = store.add_file(str(tmp_path / 'a.pdf'), url='https://example.com/a.pdf', etag='"v1"',
+                                content_type='application/pdf')
+
+        source = BlobStore(tmp_path / 'store').get('https://example.com/a.pdf')
+
+        assert source['hash'] == digest and source['size'] == 2
+        assert source['etag'] == '"v1"' and source['content_type'] == 'application/pdf'
+        assert store.get('https://example.com/other.pdf') is None
+        # a later download of the url replaces the entry
+        store.record('https://example.com/a.pdf', digest, 2, etag='"v2"')
+        assert store.get('https://example.com/a.pdf')['etag'] == '"v2"'
+
+    def test_link_replaces_other_files(self, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        (tmp_path / 'a.pdf').write_bytes(b'content')
+        digest = store.add_file(str(tmp_path / 'a.pdf'))
+        (tmp_path / 'out').mkdir()
+        (tmp_path / 'out' / 'b.pdf').write_bytes(b'stale')
+
+        path = store.link(digest, str(tmp_path / 'out' / 'b.pdf'))
+
+        assert os.path.samefile(path, tmp_path / 'a.pdf')
+
+    def test_verify(self, tmp_path):
+        store = BlobStore(tmp_path / 'store', mmap_threshold=1024)
+        (tmp_path / 'small.bin').write_bytes(b'x' * 10)
+        (tmp_path / 'large.bin').write_bytes(os.urandom(4096))
+        small = store.add_file(str(tmp_path / 'small.bin'))
+        large = store.add_file(str(tmp_path / 'large.bin'))
+
+        assert store.verify(small) and store.verify(large)
+        assert not store.verify('0' * 64)
+
+        # corrupted on disk
+        blob = store.blob_path(large)
+        os.chmod(blob, 0o644)
+        with open(blob, 'r+b') as f:
+            f.write(b'corrupt')
+        assert not store.verify(large)
+
+    def test_add_replaces_a_damaged_blob(self, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        (tmp_path / 'a.pdf').write_bytes(b'content')
+        digest = store.add_file(str(tmp_path / 'a.pdf'))
+        blob = store.blob_path(digest)
+        os.chmod(blob, 0o644)
+        with open(blob, 'r+b') as f:
+            f.write(b'corrupt')
+
+        (tmp_path / 'b.pdf').write_bytes(b'content')
+        store.add_file(str(tmp_path / 'b.pdf'))
+
+        # the new copy is stored instead of being dropped for the damaged blob
+        assert store.verify(digest)
+        assert (tmp_path / 'b.pdf').read_bytes() == b'content'
+
+    def test_concurrent_adds_of_the_same_content(self, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        digest = hashlib.sha256(b'content').hexdigest()
+        sources = []
+        for index in range(8):
+            (tmp_path / f'{index}.pdf').write_bytes(b'content')
+            sources.append(str(tmp_path / f'{index}.pdf'))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            blobs = list(pool.map(lambda source: store.add(source, digest, 7), sources))
+
+        assert set(blobs) == {store.blob_path(digest)}
+        assert store.verify(digest)
+        # every source was moved in or dropped, no staged copies are left behind
+        assert not any(os.path.exists(source) for source in sources)
+        assert os.listdir(os.path.dirname(store.blob_path(digest))) == [digest[2:]]
+
+    def test_add_without_hardlinks(self, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        (tmp_path / 'a.pdf').write_bytes(b'content')
+        digest = hashlib.sha256(b'content').hexdigest()
+
+        with patch('src.repository.blob_store_repository.os.link', side_effect=OSError('Operation not permitted')):
+            blob = store.add(str(tmp_path / 'a.pdf'), digest, 7)
+
+        # the file is moved into place instead of being lost
+        assert store.verify(digest)
+        assert os.listdir(os.path.dirname(blob)) == [digest[2:]]
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from src.service.browser_farm_service import BrowserFarm, BrowserEndpoint
+
+
+@pytest.fixture(scope="function")
+def mock_connect():
+    connect = AsyncMock()
+    connect.side_effect = lambda host, port: Mock(name=f'{host}:{port}')
+    yield connect
+
+
+class TestBrowserEndpoint:
+    def test_parse_address(self):
+        endpoint = BrowserEndpoint('10.0.0.5:9222')
+        assert endpoint.host == '10.0.0.5'
+        assert endpoint.port == 9222
+        assert endpoint.address == '10.0.0.5:9222'
+
+    @pytest.mark.parametrize('address', ['localhost', ':9222', 'localhost:port'])
+    def test_invalid_address(self, address):
+        with pytest.raises(ValueError):
+            BrowserEndpoint(address)
+
+
+class TestBrowserFarm:
+    @pytest.mark.asyncio
+    async def test_lease_balances_across_endpoints(self, mock_connect):
+        farm = BrowserFarm(mock_connect, endpoints=['host1:9222', 'host2:9222'])
+        first, _ = await farm.lease()
+        second, _ = await farm.lease()
+        third, _ = await farm.lease()
+
+        assert first is not second
+        assert first.active + second.active == 3
+        assert third in (first, second)
+        # one connection is reused per endpoint
+        assert mock_connect.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_release_frees_endpoint(self, mock_connect):
+        farm = BrowserFarm(mock_connect, endpoints=['host1:9222', 'host2:9222'])
+        first, _ = await farm.lease()
+        await farm.release(first)
+        second, _ = await farm.lease()
+
+        assert second is first
+        assert first.active == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_endpoint_is_skipped(self, mock_connect):
+        browser = Mock()
+        mock_connect.side_effect = [Exception('Connection refused'), browser]
+        farm = BrowserFarm(mock_connect, endpoints=['down:9222', 'up:9222'], cooldown=60)
+
+        endpoint, connected = await farm.lease()
+        assert endpoint.address == 'up:9222'
+        assert connected is browser
+        assert not farm.endpoints[0].healthy
+
+        await farm.release(endpoint)
+        endpoint, _ = await farm.lease()
+        assert endpoint.address == 'up:9222'
+
+    @pytest.mark.asyncio
+    async def test_no_endpoint_available(self, mock_connect):
+        farm = BrowserFarm(mock_connect, endpoints=['host1:9222'], capacity=1)
+        await farm.lease()
+
+        with pytest.raises(Exception) as e:
+            await farm.lease(timeout=.05)
+        assert str(e.value) == "No browser endpoint is available"
+
+    @pytest.mark.asyncio
+    async def test_lease_waits_for_release(self, mock_connect):
+        farm = BrowserFarm(mock_connect, endpoints=['host1:9222'], capacity=1)
+        endpoint, _ = await farm.lease()
+
+        waiting = asyncio.ensure_future(farm.lease())
+        await asyncio.sleep(.01)
+        assert not waiting.done()
+        await farm.release(endpoint)
+
+        leased, _ = await asyncio.wait_for(waiting, 1)
+        assert leased is endpoint and endpoint.active == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_endpoints_do_not_wait(self, mock_connect):
+        mock_connect.side_effect = Exception('Connection refused')
+        farm = BrowserFarm(mock_connect, endpoints=['down:9222'])
+
+        with pytest.raises(Exception):
+            await asyncio.wait_for(farm.lease(), 1)
+
+    @pytest.mark.asyncio
+    async def test_dead_browser_is_reconnected(self, mock_connect):
+        alive = Mock(side_effect=[False])
+        farm = BrowserFarm(mock_connect, endpoints=['host1:9222'], alive=alive)
+        endpoint, first = await farm.lease()
+        await farm.release(endpoint)
+
+        _, second = await farm.lease()
+
+        assert second is not first
+        assert mock_connect.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_close_disconnects(self, mock_connect):
+        disconnect = AsyncMock()
+        farm = BrowserFarm(mock_connect, disconnect=disconnect, endpoints=['host1:9222'])
+        _, browser = await farm.lease()
+        await farm.close()
+
+        disconnect.assert_called_once_with(browser)
+        assert farm.endpoints[0].browser is None
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from src.service.browser_pool_service import BrowserPool
+
+
+@pytest.fixture(scope="function")
+def mock_launch():
+    launch = AsyncMock()
+    launch.side_effect = lambda: Mock()
+    yield launch
+
+
+class TestBrowserPool:
+    @pytest.mark.asyncio
+    async def test_start_launches_min_size(self, mock_launch):
+        pool = BrowserPool(mock_launch, min_size=2, max_size=4, spares=0)
+        await pool.start()
+
+        assert mock_launch.call_count == 2
+        assert pool.idle_count == 2
+        assert pool.size == 2
+
+    @pytest.mark.asyncio
+    async def test_lease_reuses_warm_browser(self, mock_launch):
+        pool = BrowserPool(mock_launch, min_size=1, max_size=1, spares=0)
+        await pool.start()
+        browser = await pool.lease()
+
+        assert pool.leased_count == 1
+        assert pool.idle_count == 0
+        assert mock_launch.call_count == 1
+
+        await pool.release(browser)
+        assert await pool.lease() is browser
+        assert mock_launch.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_release_resets_browser(self, mock_launch):
+        reset = AsyncMock()
+        pool = BrowserPool(mock_launch, reset=reset, min_size=0, max_size=2, spares=0)
+        browser = await pool.lease()
+        await pool.release(browser)
+
+        reset.assert_called_once_with(browser)
+        assert pool.idle_count == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_reset_discards_browser(self, mock_launch):
+        reset = AsyncMock(side_effect=Exception('Tab crashed'))
+        shutdown = Mock()
+        pool = BrowserPool(mock_launch, reset=reset, shutdown=shutdown, min_size=0, max_size=2, spares=0)
+        browser = await pool.lease()
+        await pool.release(browser)
+
+        shutdown.assert_called_once_with(browser)
+        assert pool.size == 0
+
+    @pytest.mark.asyncio
+    async def test_lease_waits_when_pool_is_full(self, mock_launch):
+        pool = BrowserPool(mock_launch, min_size=0, max_size=1, spares=0)
+        browser = await pool.lease()
+
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.lease(timeout=.05)
+
+        waiter = asyncio.create_task(pool.lease(timeout=1))
+        await asyncio.sleep(0)
+        pool.release(browser)
+        assert await waiter is browser
+
+    @pytest.mark.asyncio
+    async def test_lease_tops_up_spares(self, mock_launch):
+        pool = BrowserPool(mock_launch, min_size=0, max_size=3, spares=1)
+        await pool.lease()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert mock_launch.call_count == 2
+        assert pool.idle_count == 1
+
+    @pytest.mark.asyncio
+    async def test_close_stops_idle_browsers(self, mock_launch):
+        shutdown = Mock()
+        pool = BrowserPool(mock_launch, shutdown=shutdown, min_size=2, max_size=2, spares=0)
+        await pool.start()
+        await pool.close()
+
+        assert shutdown.call_count == 2
+        with pytest.raises(Exception) as e:
+            await pool.lease()
+        assert str(e.value) == 'Browser pool is closed'
+
+    def test_invalid_size(self, mock_launch):
+        with pytest.raises(ValueError):
+            BrowserPool(mock_launch, min_size=3, max_size=1)
@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from src.service.daemon_service import ScrapingDaemon, JobRecord
+
+
+async def request(daemon, method, path, payload=None):
+    """send a raw http request to the daemon and return the status code and the body"""
+    host, port = daemon.address.split(':')
+    reader, writer = await asyncio.open_connection(host, int(port))
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split(b' ')[1]), body
+
+
+def read_chunks(body):
+    """decode a chunked transfer encoded body"""
+    data = b''
+    while True:
+        size, _, body = body.partition(b'\r\n')
+        size = int(size, 16)
+        if size == 0:
+            return data
+        data, body = data + body[:size], body[size + 2:]
+
+
+class TestScrapingDaemon:
+    @pytest.mark.asyncio
+    async def test_submit_and_query_job(self):
+        daemon = await ScrapingDaemon(AsyncMock(return_value=['book.csv']), port=0).start()
+        status, body = await request(daemon, 'POST', '/jobs', {'url': 'https://example.com', 'actions': []})
+        assert status == 202
+        job_id = json.loads(body)['id']
+
+        await asyncio.sleep(.01)
+        status, body = await request(daemon, 'GET', f'/jobs/{job_id}')
+        await daemon.shutdown()
+
+        assert status == 200
+        assert json.loads(body)['status'] == 'done'
+        assert json.loads(body)['result'] == ['book.csv']
+
+    @pytest.mark.asyncio
+    async def test_stream_job_until_finished(self):
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def run_job(job):
+            started.set()
+            await finish.wait()
+            raise Exception('Page failed to load')
+
+        daemon = await ScrapingDaemon(run_job, port=0).start()
+        record = daemon.submit({'url': 'https://example.com'})
+        await started.wait()
+        stream = asyncio.create_task(request(daemon, 'GET', f'/jobs/{record.id}/stream'))
+        await asyncio.sleep(.01)
+        finish.set()
+        status, body = await stream
+        await daemon.shutdown()
+
+        events = [json.loads(line) for line in read_chunks(body).splitlines()]
+        assert status == 200
+        assert [event['status'] for event in events] == ['running', 'failed']
+        assert events[-1]['error'] == 'Page failed to load'
+
+    @pytest.mark.asyncio
+    async def test_stalled_stream_does_not_block_updates(self):
+        daemon = ScrapingDaemon(AsyncMock(), port=0)
+        record = JobRecord({'url': 'https://example.com'})
+        writer = Mock()
+        # a client that stopped reading, the send buffer never drains
+        writer.drain = AsyncMock(side_effect=asyncio.Event().wait)
+        stream = asyncio.create_task(daemon._ScrapingDaemon__stream(record, writer))
+        await asyncio.sleep(.01)
+
+        await asyncio.wait_for(record.update('running'), 1)
+        stream.cancel()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('method, path, payload, expected', [
+        ('POST', '/jobs', {'actions': []}, 400),
+        ('POST', '/jobs', ['https://example.com'], 400),
+        ('GET', '/jobs/unknown', None, 404),
+        ('GET', '/unknown', None, 404),
+    ])
+    async def test_invalid_requests(self, method, path, payload, expected):
+        daemon = await ScrapingDaemon(AsyncMock(), port=0).start()
+        status, _ = await request(daemon, method, path, payload)
+        await daemon.shutdown()
+        assert status == expected
+
+    @pytest.mark.asyncio
+    async def test_shutdown_drains_jobs(self):
+        finished = []
+
+        async def run_job(job):
+            await asyncio.sleep(.01)
+            finished.append(job['url'])
+
+        on_shutdown = AsyncMock()
+        daemon = await ScrapingDaemon(run_job, workers=1, port=0, on_shutdown=on_shutdown).start()
+        for i in range(3):
+            daemon.submit({'url': f'example{i}.com'})
+        await daemon.shutdown()
+
+        assert finished == ['example0.com', 'example1.com', 'example2.com']
+        on_shutdown.assert_awaited_once()
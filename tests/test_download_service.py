@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.repository.blob_store_repository import BlobStore
+from src.service.download_service import DownloadManager, DownloadWatcher, cookie_jar, move_download, unique_path
+
+CONTENT = bytes(range(256)) * 1000
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT with Range support and records the requests"""
+    requests = []
+    ranges = True
+
+    def do_GET(self):
+        FileHandler.requests.append({'path': self.path, 'range': self.headers.get('Range'),
+                                     'cookie': self.headers.get('Cookie'), 'etag': self.headers.get('If-None-Match'),
+                                     'if_range': self.headers.get('If-Range')})
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        # a range of another version than "v1" is answered with the whole file
+        ranged = FileHandler.ranges and self.headers.get('Range') and self.headers.get('If-Range') in (None, '"v1"')
+        if ranged:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(CONTENT)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(CONTENT) - start))
+        self.send_header('ETag', '"v1"')
+        self.send_header('Set-Cookie', 'tracker=1; Path=/')
+        self.end_headers()
+        self.wfile.write(CONTENT[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FileHandler.requests = []
+    FileHandler.ranges = True
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestDownloadManager:
+    @pytest.mark.asyncio
+    async def test_download(self, server, tmp_path):
+        manager = DownloadManager(chunk_size=4096)
+        path = str(tmp_path / 'reports' / 'file.bin')
+
+        result = await manager.download(f"{server}/file.bin", path, cookies=[{'name': 'session', 'value': 'abc'}])
+
+        assert result == path
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+        assert not os.path.exists(f"{path}.part")
+        assert FileHandler.requests[0]['cookie'] == 'session=abc'
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_resume_partial_file(self, server, tmp_path):
+        manager = DownloadManager()
+        path = str(tmp_path / 'file.bin')
+        with open(f"{path}.part", 'wb') as f:
+            f.write(CONTENT[:1000])
+
+        await manager.download(f"{server}/file.bin", path)
+
+        assert FileHandler.requests[0]['range'] == 'bytes=1000-'
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_resume_only_continues_the_same_version(self, server, tmp_path):
+        manager = DownloadManager()
+        path = str(tmp_path / 'file.bin')
+        with open(f"{path}.part", 'wb') as f:
+            f.write(CONTENT[:1000])
+        with open(f"{path}.part.validator", 'w') as f:
+            f.write('"v0"')
+
+        await manager.download(f"{server}/file.bin", path)
+
+        # the partial file is of another version, the server sent the whole file
+        assert FileHandler.requests[0]['if_range'] == '"v0"'
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+        assert not os.path.exists(f"{path}.part.validator")
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_interrupted_download_keeps_its_validator(self, server, tmp_path):
+        manager = DownloadManager()
+        path = str(tmp_path / 'file.bin')
+        with open(f"{path}.part", 'wb') as f:
+            f.write(CONTENT)
+        with open(f"{path}.part.validator", 'w') as f:
+            f.write('"v1"')
+
+        await manager.download(f"{server}/file.bin", path)
+
+        # the partial file has every byte, it is the file
+        assert FileHandler.requests[0]['if_range'] == '"v1"'
+        assert len(FileHandler.requests) == 1
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_partial_file_larger_than_the_file_is_downloaded_again(self, server, tmp_path):
+        manager = DownloadManager()
+        path = str(tmp_path / 'file.bin')
+        with open(f"{path}.part", 'wb') as f:
+            f.write(CONTENT + b'stale')
+
+        await manager.download(f"{server}/file.bin", path)
+
+        assert [request['range'] for request in FileHandler.requests] == [f"bytes={len(CONTENT) + 5}-", None]
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_session_does_not_keep_cookies(self, server, tmp_path):
+        manager = DownloadManager()
+
+        await manager.download(f"{server}/file.bin", str(tmp_path / 'a.bin'), cookies=[{'name': 'session', 'value': 'abc'}])
+        await manager.download(f"{server}/file.bin", str(tmp_path / 'b.bin'))
+
+        # the tracker cookie set by the first response is not sent with the next download
+        assert [request['cookie'] for request in FileHandler.requests] == ['session=abc', None]
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_restart_when_range_is_ignored(self, server, tmp_path):
+        FileHandler.ranges = False
+        manager = DownloadManager()
+        path = str(tmp_path / 'file.bin')
+        with open(f"{path}.part", 'wb') as f:
+            f.write(b'stale')
+
+        await manager.download(f"{server}/file.bin", path)
+
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_downloads_of_a_url_are_coalesced(self, server, tmp_path):
+        manager = DownloadManager()
+        url = f"{server}/file.bin"
+
+        results = await asyncio.gather(*[manager.download(url, str(tmp_path / 'file.bin')) for _ in range(5)])
+
+        assert results == [str(tmp_path / 'file.bin')] * 5
+        assert len(FileHandler.requests) == 1
+        # a download to the same path with other cookies waits instead of writing the same partial file
+        results = await asyncio.gather(manager.download(url, str(tmp_path / 'file.bin')),
+                                       manager.download(url, str(tmp_path / 'file.bin'), cookies=[{'name': 'a', 'value': '1'}]))
+        assert results == [str(tmp_path / 'file.bin')] * 2
+        assert [request['cookie'] for request in FileHandler.requests[1:]] == [None, 'a=1']
+        with open(tmp_path / 'file.bin', 'rb') as f:
+            assert f.read() == CONTENT
+        # every caller gets the file at its own path
+        results = await asyncio.gather(manager.download(url, str(tmp_path / 'a.bin')),
+                                       manager.download(url, str(tmp_path / 'b.bin')))
+        assert results == [str(tmp_path / 'a.bin'), str(tmp_path / 'b.bin')]
+        assert len(FileHandler.requests) == 5
+        for path in (tmp_path / 'a.bin', tmp_path / 'b.bin'):
+            with open(path, 'rb') as f:
+                assert f.read() == CONTENT
+        # finished downloads are not joined
+        await manager.download(url, str(tmp_path / 'file.bin'))
+        assert len(FileHandler.requests) == 6
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_retries_then_raises(self, tmp_path):
+        manager = DownloadManager(retries=1)
+
+        with pytest.raises(Exception):
+            await manager.download('http://127.0.0.1:1/file.bin', str(tmp_path / 'file.bin'), timeout=1)
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_store_links_unchanged_files(self, server, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        manager = DownloadManager(store=store)
+        url = f"{server}/file.bin"
+
+        first = await manager.download(url, str(tmp_path / 'file.bin_day1'))
+        second = await manager.download(url, str(tmp_path / 'file.bin_day2'))
+
+        # the second download was conditional and only linked the stored blob
+        assert FileHandler.requests[1]['etag'] == '"v1"'
+        assert os.path.samefile(first, second)
+        assert os.path.samefile(first, store.blob_path(store.get(url)['hash']))
+        with open(second, 'rb') as f:
+            assert f.read() == CONTENT
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_store_downloads_a_damaged_blob_again(self, server, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        manager = DownloadManager(store=store)
+        url = f"{server}/file.bin"
+        await manager.download(url, str(tmp_path / 'file.bin_day1'))
+        blob = store.blob_path(store.get(url)['hash'])
+        os.chmod(blob, 0o644)
+        with open(blob, 'r+b') as f:
+            f.write(b'corrupt')
+
+        second = await manager.download(url, str(tmp_path / 'file.bin_day2'))
+
+        # the unchanged answer is not trusted, the file is requested again without the conditional headers
+        assert [request['etag'] for request in FileHandler.requests] == [None, '"v1"', None]
+        with open(second, 'rb') as f:
+            assert f.read() == CONTENT
+        assert store.verify(store.get(url)['hash'])
+        manager.close()
+
+    @pytest.mark.asyncio
+    async def test_store_hashes_resumed_downloads(self, server, tmp_path):
+        store = BlobStore(tmp_path / 'store')
+        manager = DownloadManager(store=store)
+        path = str(tmp_path / 'file.bin')
+        with open(f"{path}.part", 'wb') as f:
+            f.write(CONTENT[:1000])
+
+        await manager.download(f"{server}/file.bin", path)
+
+        digest = store.get(f"{server}/file.bin")['hash']
+        assert digest == hashlib.sha256(CONTENT).hexdigest()
+        assert store.verify(digest)
+        manager.close()
+
+    def test_cookie_jar(self):
+        jar = cookie_jar([{'name': 'a', 'value': '1', 'domain': '.example.com', 'path': '/'}, {'name': 'b', 'value': '2'}])
+
+        assert jar.get('a', domain='.example.com') == '1'
+        assert jar.get('b') == '2'
+
+
+class TestDownloadWatcher:
+    @pytest.mark.asyncio
+    async def test_wait_skips_existing_and_partial_files(self, tmp_path):
+        (tmp_path / 'old.pdf').write_bytes(b'old')
+        watcher = DownloadWatcher(str(tmp_path), poll_frequency=.01)
+        (tmp_path / 'new.pdf.crdownload').write_bytes(b'half')
+
+        with pytest.raises(Exception):
+            await watcher.wait(timeout=.05)
+
+        os.replace(tmp_path / 'new.pdf.crdownload', tmp_path / 'new.pdf')
+        assert await watcher.wait(timeout=1) == str(tmp_path / 'new.pdf')
+
+    @pytest.mark.asyncio
+    async def test_every_download_is_reported_once(self, tmp_path):
+        watcher = DownloadWatcher(str(tmp_path), poll_frequency=.01)
+        (tmp_path / 'a.pdf').write_bytes(b'a')
+        (tmp_path / 'b.pdf').write_bytes(b'b')
+
+        paths = {await watcher.wait(timeout=1), await watcher.wait(timeout=1)}
+
+        assert paths == {str(tmp_path / 'a.pdf'), str(tmp_path / 'b.pdf')}
+        assert watcher.poll() == []
+        # a moved download's name can be reused
+        (tmp_path / 'a.pdf').unlink()
+        watcher.poll()
+        (tmp_path / 'a.pdf').write_bytes(b'again')
+        assert watcher.poll() == [str(tmp_path / 'a.pdf')]
+
+    def test_move_download_keeps_existing_files(self, tmp_path):
+        (tmp_path / 'reports').mkdir()
+        (tmp_path / 'reports' / 'report.pdf').write_bytes(b'first')
+        (tmp_path / 'guid').write_bytes(b'second')
+
+        path = move_download(str(tmp_path / 'guid'), str(tmp_path / 'reports'), 'report.pdf')
+
+        assert path == str(tmp_path / 'reports' / 'report (1).pdf')
+        assert unique_path(str(tmp_path / 'reports'), 'report.pdf') == str(tmp_path / 'reports' / 'report (2).pdf')
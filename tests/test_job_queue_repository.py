@@ -0,0 +1,105 @@
+import sqlite3
+import time
+
+import pytest
+from unittest.mock import patch
+
+from src.repository.job_queue_repository import SqliteJobQueue, QUEUED, LEASED, DONE, DEAD
+
+
+def later(seconds):
+    return time.time() + seconds
+
+@pytest.fixture(scope="function")
+def queue(tmp_path):
+    yield SqliteJobQueue(tmp_path / 'jobs.db', visibility_timeout=60, max_attempts=2, retry_delay=0)
+
+
+class TestSqliteJobQueue:
+    def test_enqueue_and_lease(self, queue):
+        job_id = queue.enqueue({'url': 'example.com', 'actions': []})
+        leased = queue.lease('runner-1')
+
+        assert leased.id == job_id
+        assert leased.job == {'url': 'example.com', 'actions': []}
+        assert leased.attempts == 1
+        assert queue.lease('runner-2') is None
+        assert queue.counts()[LEASED] == 1
+
+    def test_lease_in_order(self, queue):
+        queue.enqueue_many([{'url': 'first.com'}, {'url': 'second.com'}])
+        assert queue.lease('runner-1').job['url'] == 'first.com'
+        assert queue.lease('runner-1').job['url'] == 'second.com'
+
+    def test_complete(self, queue):
+        queue.enqueue({'url': 'example.com'})
+        leased = queue.lease('runner-1')
+
+        assert queue.complete(leased, ['file.txt'])
+        assert queue.counts()[DONE] == 1
+        assert queue.pending() == 0
+        assert queue.lease('runner-1') is None
+
+    def test_fail_retries_then_dead_letters(self, queue):
+        queue.enqueue({'url': 'example.com'})
+        leased = queue.lease('runner-1')
+        assert queue.fail(leased, Exception('Page failed to load')) == QUEUED
+
+        leased = queue.lease('runner-1')
+        assert leased.attempts == 2
+        assert queue.fail(leased, Exception('Page failed to load')) == DEAD
+
+        dead = queue.dead_letters()
+        assert len(dead) == 1
+        assert dead[0]['error'] == 'Page failed to load'
+        assert queue.lease('runner-1') is None
+
+        queue.requeue(dead[0]['id'])
+        assert queue.lease('runner-1').attempts == 1
+
+    def test_expired_lease_is_picked_up_by_another_runner(self, queue):
+        queue.enqueue({'url': 'example.com'})
+        crashed = queue.lease('runner-1')
+
+        with patch('src.repository.job_queue_repository.time.time', return_value=later(61)):
+            leased = queue.lease('runner-2')
+
+        assert leased.id == crashed.id
+        assert leased.attempts == 2
+        # the crashed runner lost its lease and can not complete the job anymore
+        assert not queue.heartbeat(crashed)
+        assert not queue.complete(crashed)
+        assert queue.complete(leased)
+
+    def test_expired_lease_on_last_attempt_is_dead_lettered(self, queue):
+        queue.enqueue({'url': 'example.com'})
+        queue.lease('runner-1')
+        with patch('src.repository.job_queue_repository.time.time', return_value=later(61)):
+            queue.lease('runner-2')
+        with patch('src.repository.job_queue_repository.time.time', return_value=later(200)):
+            assert queue.lease('runner-3') is None
+
+        assert queue.counts()[DEAD] == 1
+
+    def test_heartbeat_extends_lease(self, queue):
+        queue.enqueue({'url': 'example.com'})
+        leased = queue.lease('runner-1')
+        with patch('src.repository.job_queue_repository.time.time', return_value=later(50)):
+            assert queue.heartbeat(leased)
+        with patch('src.repository.job_queue_repository.time.time', return_value=later(70)):
+            assert queue.lease('runner-2') is None
+
+    def test_locked_database_raises_the_lock_error(self, queue):
+        holder = sqlite3.connect(queue.path, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        connect = sqlite3.connect
+
+        with patch('src.repository.job_queue_repository.sqlite3.connect',
+                   side_effect=lambda path, timeout, isolation_level: connect(path, timeout=.05,
+                                                                               isolation_level=isolation_level)):
+            with pytest.raises(sqlite3.OperationalError) as e:
+                queue.enqueue({'url': 'example.com'})
+
+        assert 'locked' in str(e.value)
+        holder.execute("ROLLBACK")
+        holder.close()
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock
+
+from src.service.job_runner_service import JobRunner, JobResult
+
+
+class TestJobRunner:
+    @pytest.mark.asyncio
+    async def test_run_collects_results_in_order(self):
+        async def run_job(job):
+            await asyncio.sleep(job['delay'])
+            return job['url']
+
+        jobs = [{'url': f'example{i}.com', 'delay': .01 * (5 - i)} for i in range(5)]
+        runner = JobRunner(run_job, workers=2)
+        results = await runner.run(jobs)
+
+        assert [r.result for r in results] == [job['url'] for job in jobs]
+        assert all(r.ok for r in results)
+
+    @pytest.mark.asyncio
+    async def test_run_collects_exceptions(self):
+        async def run_job(job):
+            if job['url'] == 'bad.com':
+                raise Exception('Page failed to load')
+            return job['url']
+
+        runner = JobRunner(run_job, workers=2)
+        results = await runner.run([{'url': 'good.com'}, {'url': 'bad.com'}])
+
+        assert results[0].ok
+        assert not results[1].ok
+        assert str(results[1].error) == 'Page failed to load'
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self):
+        running = 0
+        max_running = 0
+
+        async def run_job(job):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(.01)
+            running -= 1
+
+        runner = JobRunner(run_job, workers=3)
+        await runner.run([{'url': str(i)} for i in range(10)])
+        assert max_running == 3
+
+    @pytest.mark.asyncio
+    async def test_idle_worker_steals_jobs(self):
+        """one slow job should not hold up the jobs queued behind it on the same worker"""
+        finished = []
+
+        async def run_job(job):
+            await asyncio.sleep(job['delay'])
+            finished.append(job['url'])
+
+        jobs = [{'url': 'slow', 'delay': .2}, {'url': 'fast1', 'delay': 0},
+                {'url': 'fast2', 'delay': 0}, {'url': 'fast3', 'delay': 0}]
+        runner = JobRunner(run_job, workers=2)
+        await runner.run(jobs)
+
+        assert finished[-1] == 'slow'
+
+    @pytest.mark.asyncio
+    async def test_submit_after_stop(self):
+        runner = JobRunner(AsyncMock(), workers=1).start()
+        await runner.stop()
+        runner.start()
+        result = await runner.submit({'url': 'example.com'})
+        await runner.stop()
+
+        assert isinstance(result, JobResult)
+        assert result.ok
+
+    def test_invalid_worker_count(self):
+        with pytest.raises(ValueError):
+            JobRunner(AsyncMock(), workers=0)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_job_is_resolved(self):
+        async def run_job(job):
+            if job['url'] == 'cancelled.com':
+                raise asyncio.CancelledError()
+            return job['url']
+
+        runner = JobRunner(run_job, workers=2)
+        results = await asyncio.wait_for(runner.run([{'url': 'cancelled.com'}, {'url': 'example.com'}]), 1)
+
+        assert isinstance(results[0].error, asyncio.CancelledError)
+        assert results[1].result == 'example.com'
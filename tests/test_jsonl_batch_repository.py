@@ -0,0 +1,64 @@
+import pytest
+
+from src.repository.jsonl_batch_repository import JsonlBatch
+
+LINES = ['{"url": "example1.com"}\n', '{"url": "example2.com"}\n', '{"url": "example3.com"}\n']
+
+
+@pytest.fixture
+def batch_file(tmp_path):
+    path = tmp_path / 'batch.jsonl'
+    path.write_text(''.join(LINES))
+    return path
+
+
+class TestJsonlBatch:
+    def test_reads_jobs_with_offsets(self, batch_file):
+        jobs = list(JsonlBatch(batch_file))
+        assert [job['url'] for _, job in jobs] == ['example1.com', 'example2.com', 'example3.com']
+        assert [offset for offset, _ in jobs] == [0, len(LINES[0]), len(LINES[0]) + len(LINES[1])]
+
+    def test_checkpoint_waits_for_earlier_lines(self, batch_file):
+        batch = JsonlBatch(batch_file)
+        jobs = iter(batch)
+        first, _ = next(jobs)
+        second, _ = next(jobs)
+
+        batch.finish(second)
+        assert JsonlBatch(batch_file).offset == 0
+
+        batch.finish(first)
+        assert JsonlBatch(batch_file).offset == len(LINES[0]) + len(LINES[1])
+
+    def test_resumes_at_checkpoint(self, batch_file):
+        batch = JsonlBatch(batch_file)
+        offset, _ = next(iter(batch))
+        batch.finish(offset)
+
+        resumed = JsonlBatch(batch_file)
+        assert [job['url'] for _, job in resumed] == ['example2.com', 'example3.com']
+
+    def test_skips_blank_and_invalid_lines(self, tmp_path):
+        path = tmp_path / 'batch.jsonl'
+        path.write_text('{"url": "example1.com"}\n\nnot json\n{"url": "example2.com"}\n\n')
+        batch = JsonlBatch(path, checkpoint_path=tmp_path / 'batch.offset')
+
+        for offset, job in batch:
+            batch.finish(offset)
+
+        assert batch.offset == path.stat().st_size
+        assert (tmp_path / 'batch.offset').read_text() == str(path.stat().st_size)
+
+    def test_checkpoint_writes_are_throttled(self, batch_file):
+        batch = JsonlBatch(batch_file, checkpoint_interval=60)
+        jobs = iter(batch)
+        first, _ = next(jobs)
+        second, _ = next(jobs)
+
+        batch.finish(first)
+        batch.finish(second)
+        # the first move is written, the next one waits for the interval
+        assert JsonlBatch(batch_file).offset == len(LINES[0])
+
+        batch.save_checkpoint()
+        assert JsonlBatch(batch_file).offset == len(LINES[0]) + len(LINES[1])
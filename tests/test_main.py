@@ -1,4 +1,5 @@
 import asyncio
+import time
 
 import pytest
 from unittest.mock import patch, Mock, mock_open, MagicMock, AsyncMock
@@ -56,25 +57,12 @@ def mock_sleep():
     with patch('src.main.sleep') as sleep_mock:
         yield sleep_mock
 
-@pytest.fixture(scope='session')
-def mock_requests():
-    with patch('src.main.requests') as requests_mock:
-        requests_mock.Session.return_value = Mock()
-        mock_response = MagicMock()
-        mock_response.raise_for_status.return_value = None
-
-        # Set the `__enter__` and `__exit__` methods to make it a context manager
-        # setattr(mock_response, '__enter__', )
-        mock_response.__enter__.return_value = mock_response
-        mock_response.__exit__.return_value = False
-        # Create an iterable for iter_content, as the `for` loop needs to run
-        # This simulates a file with content, a list of byte chunks
-        mock_response.iter_content.return_value = iter([b'chunk1', b'chunk2'])
-
-        # Set up the mock for requests.Session.get to return our context manager mock
-        requests_mock.Session.return_value.get.return_value = mock_response
-
-        yield requests_mock
+@pytest.fixture
+def mock_downloads():
+    downloads = Mock()
+    downloads.store = None
+    downloads.download = AsyncMock(side_effect=lambda url, path, **kwargs: path)
+    yield downloads
 
 class TestDynamicWebScraping:
     @pytest.mark.asyncio
@@ -172,6 +160,17 @@ class TestDynamicWebScraping:
         mock_scraper_class.find_element.assert_called_once_with(by=By.XPATH, value=action['xpath'], action=action)
         mock_scraper_class.click_element.assert_called_once_with(element=test_element, required=False)
 
+    @pytest.mark.asyncio
+    async def test_skipped_button_click_fails_the_action(self, mock_scraper_class, mock_sleep, mock_element):
+        action = {"type": "click", "xpath": '//button[@id="next"]'}
+        mock_scraper_class.find_element.return_value = mock_element
+        # the button left the page before it could be clicked
+        mock_scraper_class.click_element.return_value = False
+
+        my_class = DynamicWebScraping({"actions": [action]}, mock_scraper_class)
+
+        assert await my_class._run_click_visible_button(action) is False
+
     @pytest.mark.asyncio
     async def test_button_click_not_found_exception(self, mock_scraper_class, mock_uc_start, mock_sleep, mock_element):
         action = {
@@ -389,7 +388,7 @@ class TestDynamicWebScraping:
         indirect=True
     )
     @patch('src.main.dt')
-    async def test_run_download_document(self, mock_dt, create_named_test_file, mock_scraper_class, mock_element, mock_requests):
+    async def test_run_download_document(self, mock_dt, create_named_test_file, mock_scraper_class, mock_element, mock_downloads):
         action = {
             "type": "download",
             "xpath": '//*[@id="default"]/div/div/div/div/section/div[2]/ol/li[2]/article/div[2]/form',
@@ -406,23 +405,64 @@ class TestDynamicWebScraping:
         }
         my_dt = "2025-10-01-00-00-00"
         mock_dt.datetime.now.return_value.strftime.return_value = my_dt
-        filename = f"{directory}/temp_folder/file.txt_{my_dt}"
+        filename = f"{directory}/temp_folder/file.text_{my_dt}"
 
-        my_class = DynamicWebScraping(config, mock_scraper_class)
+        def download(url, path, **kwargs):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('content')
+            return path
+        mock_downloads.download.side_effect = download
+
+        my_class = DynamicWebScraping(config, mock_scraper_class, downloads=mock_downloads)
         mock_scraper_class.find_element.return_value = mock_element
+        mock_scraper_class.get_cookies.return_value = [{'name': 'session', 'value': '1'}]
         mock_element.get_attribute = Mock()
         mock_element.get_attribute.return_value = 'https://file.text'
-        m = mock_open()
 
-        # @pytest.mark.asyncio
-        with patch('builtins.open', m):
-            await my_class.run_actions([action])
+        await my_class.run_actions([action])
 
-            mock_requests.Session.return_value.get.assert_called_with('https://file.text', timeout=30, stream=True)
-            m.assert_called_once()
-            assert m.return_value.write.call_count == 2
-            mock_requests.Session.return_value.get.return_value.iter_content.assert_called_once()
-            mock_scraper_class.find_element.assert_called_once_with(by=By.XPATH, value=action['xpath'], action=action)
+        # downloaded under a stable name to be resumable, then renamed with the time of the run
+        mock_downloads.download.assert_awaited_once_with('https://file.text', f"{directory}/temp_folder/file.text",
+                                                         cookies=[{'name': 'session', 'value': '1'}], timeout=30)
+        assert my_class.results == [filename]
+        assert open(filename).read() == 'content'
+        mock_scraper_class.find_element.assert_called_once_with(by=By.XPATH, value=action['xpath'], action=action)
+
+    @pytest.mark.asyncio
+    @patch('src.main.dt')
+    async def test_concurrent_download_documents_share_the_download(self, mock_dt, mock_element, tmp_path):
+        action = {"type": "download", "xpath": '//a[@id="report"]', "value": "reports"}
+        config = {"actions": [action], "separator": "/", "download_directory": str(tmp_path)}
+        mock_dt.datetime.now.return_value.strftime.side_effect = ['run-1', 'run-2']
+        mock_element.get_attribute = Mock(return_value='https://example.com/report.pdf')
+        fetched = []
+
+        def fetch(url, path, *args):
+            fetched.append(path)
+            time.sleep(.05)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('report')
+            return path
+
+        downloads = DownloadManager()
+        scrapers = []
+        for _ in range(2):
+            driver = AsyncMock()
+            driver.find_element.return_value = mock_element
+            driver.get_cookies.return_value = []
+            scrapers.append(DynamicWebScraping(config, driver, downloads=downloads))
+        with patch.object(DownloadManager, 'fetch', side_effect=fetch):
+            results = await asyncio.gather(*(scraper._run_download_document(action, 30) for scraper in scrapers))
+
+        # the second job joined the first one's download and got its own copy
+        assert results == [True, True]
+        assert fetched == [f"{tmp_path}/reports/report.pdf"]
+        for run, scraper in zip(('run-1', 'run-2'), scrapers):
+            assert scraper.results == [f"{tmp_path}/reports/report.pdf_{run}"]
+            assert open(scraper.results[0]).read() == 'report'
+        downloads.close()
 
     @pytest.mark.asyncio
     @pytest.mark.parametrize(
@@ -431,7 +471,7 @@ class TestDynamicWebScraping:
         indirect=True
     )
     @patch('src.main.dt')
-    async def test_run_download_document_exception(self, mock_dt, create_named_test_file, mock_scraper_class, mock_element, mock_requests):
+    async def test_run_download_document_exception(self, mock_dt, create_named_test_file, mock_scraper_class, mock_element, mock_downloads):
         action = {
             "type": "download",
             "xpath": '//*[@id="default"]/div/div/div/div/section/div[2]/ol/li[2]/article/div[2]/form',
@@ -450,16 +490,326 @@ class TestDynamicWebScraping:
         mock_dt.datetime.now.return_value.strftime.return_value = my_dt
         filename = f"{directory}/temp_folder/file.txt_{my_dt}"
 
-        my_class = DynamicWebScraping(config, mock_scraper_class)
+        my_class = DynamicWebScraping(config, mock_scraper_class, downloads=mock_downloads)
         mock_scraper_class.find_element.return_value = mock_element
         mock_element.get_attribute = Mock()
         mock_element.get_attribute.return_value = 'https://file.text'
-        m = mock_open()
+        mock_downloads.download.side_effect = Exception('Get req error')
+
+        assert await my_class._run_download_document(action, 30) is False
+        assert my_class.results == []
+
+    @pytest.mark.asyncio
+    async def test_run_download_document_in_the_browser(self, mock_scraper_class, mock_element, mock_downloads):
+        action = {"type": "download", "xpath": "//button[@id='export']", "value": "reports", "browser": True,
+                  "download_timeout": 90}
+        config = {"actions": [action], "separator": "/", "download_directory": "downloads"}
+        mock_scraper_class.find_element.return_value = mock_element
+        mock_scraper_class.wait_for_download.return_value = 'downloads/reports/report.pdf'
+
+        my_class = DynamicWebScraping(config, mock_scraper_class, downloads=mock_downloads)
+        assert await my_class._run_download_document(action, 30) is True
+
+        mock_scraper_class.set_download_directory.assert_awaited_once_with('downloads/reports')
+        mock_scraper_class.click_element.assert_awaited_once_with(element=mock_element)
+        mock_scraper_class.wait_for_download.assert_awaited_once_with(timeout=90)
+        mock_downloads.download.assert_not_called()
+        assert my_class.results == ['downloads/reports/report.pdf']
+
+    @pytest.mark.asyncio
+    async def test_required_check_accepts_sync_is_displayed(self, mock_scraper_class, mock_sleep):
+        """selenium elements answer is_displayed synchronously"""
+        action = {'type': 'click', 'xpath': '//button', 'required': True}
+        element = Mock()
+        element.is_displayed.return_value = True
+        mock_scraper_class.find_element.return_value = element
+
+        my_class = DynamicWebScraping({}, mock_scraper_class)
+        await my_class.run_actions([action])
+
+        mock_scraper_class.click_element.assert_called_once_with(element=element, required=False)
+
+
+    @pytest.mark.asyncio
+    async def test_fill_form_types_monitored_fields(self, mock_scraper_class, mock_sleep, mock_element):
+        fields = [{'xpath': '//input[@id="email"]', 'value': 'a@b.com'},
+                  {'xpath': '//input[@id="password"]', 'value': 'secret', 'monitored': True},
+                  {'xpath': '//input[@id="terms"]', 'value': True}]
+        calls = []
+        mock_scraper_class.fill_form.side_effect = lambda fields: calls.append(fields) or [True] * len(fields)
+        mock_scraper_class.type_input.side_effect = lambda **kwargs: calls.append(kwargs['action']['value'])
+        mock_scraper_class.find_element.return_value = mock_element
+
+        my_class = DynamicWebScraping({}, mock_scraper_class)
+        res = await my_class._run_fill_form({'type': 'fill_form', 'fields': fields})
+
+        assert res
+        # the fields are set in the order given, the monitored one between the others
+        assert calls == [[fields[0]], 'secret', [fields[2]]]
+
+    @pytest.mark.asyncio
+    async def test_fill_form_required_missing_field(self, mock_scraper_class, mock_sleep):
+        mock_scraper_class.fill_form.return_value = [False]
+
+        my_class = DynamicWebScraping({}, mock_scraper_class)
+        res = await my_class._run_fill_form({'type': 'fill_form', 'required': True,
+                                             'fields': [{'xpath': '//input', 'value': 'x'}]})
+
+        assert not res
+
+
+class TestRunJobs:
+    @pytest.mark.asyncio
+    @patch('src.main.CustomDriver')
+    async def test_run_job_closes_driver(self, mock_custom_driver):
+        driver = mock_custom_driver.return_value
+        driver.get = AsyncMock()
+        driver.close = AsyncMock()
+        job = {'url': 'example.com', 'actions': []}
+
+        res = await run_job(job)
+
+        assert res == []
+        driver.get.assert_called_once_with('example.com')
+        driver.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch('src.main.CustomDriver')
+    async def test_run_jobs_collects_failures(self, mock_custom_driver):
+        driver = mock_custom_driver.return_value
+        driver.get = AsyncMock(side_effect=[None, Exception('Page failed to load')])
+        driver.close = Mock()
+        jobs = [{'url': 'example.com', 'actions': []}, {'url': 'bad.com', 'actions': []}]
+
+        results = await run_jobs(jobs, workers=1)
+
+        assert results[0].ok
+        assert str(results[1].error) == 'Page failed to load'
+        assert driver.close.call_count == 2
+
+    @pytest.mark.asyncio
+    @patch('src.main.CustomDriver')
+    async def test_run_jobs_in_tabs(self, mock_custom_driver):
+        browser_driver = mock_custom_driver.return_value
+        browser_driver.get = AsyncMock()
+        browser_driver.close = AsyncMock()
+        tab_driver = Mock()
+        tab_driver.get = AsyncMock()
+        tab_driver.close = AsyncMock()
+        browser_driver.open_tab.return_value = tab_driver
+        jobs = [{'url': 'example.com', 'actions': []}, {'url': 'example2.com', 'actions': []}]
+
+        results = await run_jobs_in_tabs(jobs, tabs=2)
+
+        assert all(r.ok for r in results)
+        mock_custom_driver.assert_called_once()
+        assert browser_driver.open_tab.call_count == 2
+        assert tab_driver.close.call_count == 2
+        browser_driver.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch('src.main.CustomDriver')
+    async def test_run_jobs_in_tabs_paces_the_tabs(self, mock_custom_driver):
+        browser_driver = mock_custom_driver.return_value
+        browser_driver.get = AsyncMock()
+        browser_driver.close = AsyncMock()
+        tab_driver = Mock()
+        tab_driver.get = AsyncMock()
+        tab_driver.close = AsyncMock()
+        browser_driver.open_context.return_value = tab_driver
+        jobs = [{'url': 'example.com', 'actions': [], 'pacing': 'stealth'}, {'url': 'example2.com', 'actions': []}]
+
+        await run_jobs_in_tabs(jobs, tabs=1, isolated=True)
+
+        paced, unpaced = [call.kwargs['sleep'] for call in browser_driver.open_context.call_args_list]
+        assert isinstance(paced, Pacer)
+        assert unpaced is None
 
-        # @pytest.mark.asyncio
-        with patch('builtins.open', m):
-            mock_requests.Session.return_value.get.side_effect = Exception('Get req error')
+    @pytest.mark.asyncio
+    @patch('src.main.BrowserFarm')
+    @patch('src.main.CustomDriver')
+    async def test_run_jobs_on_farm_paces_the_jobs(self, mock_custom_driver, mock_farm):
+        driver = mock_custom_driver.return_value
+        driver.get = AsyncMock()
+        driver.close = AsyncMock()
+        farm = mock_farm.return_value
+        farm.lease = AsyncMock(return_value=('localhost:9222', Mock()))
+        farm.release = AsyncMock()
+        farm.close = AsyncMock()
+
+        results = await run_jobs_on_farm([{'url': 'example.com', 'actions': [], 'pacing': 'fast'}], ['localhost:9222'])
+
+        assert results[0].ok
+        assert isinstance(mock_custom_driver.call_args.kwargs['pacer'], Pacer)
+        farm.release.assert_called_once_with('localhost:9222')
 
+    @pytest.mark.asyncio
+    async def test_run_jobs_in_tabs_needs_nodriver(self):
+        with patch('src.main.CustomDriver', SeleniumUndetectableDriverService):
             with pytest.raises(Exception) as e:
-                await my_class.run_actions([action])
-                assert e.value == 'Get req error'
\ No newline at end of file
+                await run_jobs_in_tabs([{'url': 'example.com', 'actions': []}], tabs=2)
+
+        assert 'only supported by the nodriver driver' in str(e.value)
+
+    @pytest.mark.asyncio
+    @patch('src.main.create_browser_pool')
+    @patch('src.main.CustomDriver')
+    async def test_main_releases_the_pooled_browser(self, mock_custom_driver, mock_create_pool):
+        driver = mock_custom_driver.return_value
+        driver.get = AsyncMock(side_effect=Exception('Page failed to load'))
+        driver.close = AsyncMock()
+        pool = mock_create_pool.return_value = AsyncMock()
+
+        with patch.dict('src.main.config', {'url': 'example.com', 'actions': [], 'browser_pool': {'max_size': 1}}, clear=True):
+            with pytest.raises(Exception):
+                await main()
+
+        driver.close.assert_called_once()
+        pool.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch('src.main.run_job')
+    async def test_consume_queue(self, mock_run_job, tmp_path):
+        queue = SqliteJobQueue(tmp_path / 'jobs.db', max_attempts=1)
+        queue.enqueue_many([{'url': 'example.com'}, {'url': 'bad.com'}])
+
+        async def run_job(job, pool=None):
+            if job['url'] == 'bad.com':
+                raise Exception('Page failed to load')
+            return ['file.txt']
+        mock_run_job.side_effect = run_job
+
+        await consume_queue(queue, workers=2)
+
+        assert queue.counts() == {'queued': 0, 'leased': 0, 'done': 1, 'dead': 1}
+        assert queue.dead_letters()[0]['error'] == 'Page failed to load'
+
+    @pytest.mark.asyncio
+    @patch('src.main.run_job')
+    async def test_consume_batch_checkpoints(self, mock_run_job, tmp_path):
+        batch_file = tmp_path / 'batch.jsonl'
+        batch_file.write_text('{"url": "example.com"}\n{"url": "bad.com"}\n{"url": "example2.com"}\n')
+
+        async def run_job(job, pool=None):
+            if job['url'] == 'bad.com':
+                raise Exception('Page failed to load')
+            return ['file.txt']
+        mock_run_job.side_effect = run_job
+
+        res = await consume_batch(JsonlBatch(batch_file), workers=2, max_in_flight=2)
+
+        assert res == (2, 1)
+        assert JsonlBatch(batch_file).offset == batch_file.stat().st_size
+
+
+class TestActionCheckpoints:
+    @pytest.mark.asyncio
+    async def test_failed_action_saves_progress(self, mock_scraper_class, mock_sleep, mock_element, tmp_path):
+        checkpoint = tmp_path / 'flow.json'
+        actions = [{'type': 'click', 'xpath': '//button'}, {'type': 'input', 'xpath': '//input', 'value': 'x'},
+                   {'type': 'click', 'xpath': '//submit'}]
+        mock_scraper_class.current_url.return_value = 'https://example.com/step-2'
+        mock_scraper_class.get_cookies.return_value = [{'name': 'session', 'value': 'abc'}]
+        mock_scraper_class.type_input.side_effect = Exception('Input not found')
+
+        my_class = DynamicWebScraping({'checkpoint': str(checkpoint)}, mock_scraper_class)
+        with pytest.raises(Exception) as e:
+            await my_class.run_actions(actions)
+
+        assert str(e.value) == f"Action 1 (input) failed, progress saved to {checkpoint}"
+        assert mock_scraper_class.click_element.call_count == 1
+        assert ActionCheckpoint(checkpoint).load()['index'] == 0
+
+    @pytest.mark.asyncio
+    async def test_resume_from_checkpoint(self, mock_scraper_class, mock_sleep, mock_element, tmp_path):
+        checkpoint = ActionCheckpoint(tmp_path / 'flow.json')
+        checkpoint.save(0, 'https://example.com/step-2', [{'name': 'session', 'value': 'abc'}])
+        actions = [{'type': 'click', 'xpath': '//button'}, {'type': 'input', 'xpath': '//input', 'value': 'x'}]
+
+        my_class = DynamicWebScraping({'checkpoint': checkpoint.path}, mock_scraper_class)
+        start = await my_class.restore_checkpoint()
+        await my_class.run_actions(actions, start=start)
+
+        assert start == 1
+        mock_scraper_class.set_cookies.assert_called_once_with([{'name': 'session', 'value': 'abc'}])
+        mock_scraper_class.get.assert_called_once_with('https://example.com/step-2')
+        mock_scraper_class.click_element.assert_not_called()
+        mock_scraper_class.type_input.assert_called_once()
+        assert checkpoint.load() is None
+
+    @pytest.mark.asyncio
+    @patch('src.main.CustomDriver')
+    async def test_jobs_do_not_share_the_top_level_checkpoint(self, mock_custom_driver, tmp_path):
+        driver = mock_custom_driver.return_value
+        driver.get = AsyncMock()
+        driver.close = AsyncMock()
+        checkpoint = tmp_path / 'flow.json'
+        ActionCheckpoint(checkpoint).save(0, 'https://example.com/step-2', [])
+
+        with patch.dict('src.main.config', {'checkpoint': str(checkpoint)}, clear=True):
+            await run_job({'url': 'example.com', 'actions': []})
+
+        # the job did not resume from, or clear, the top level checkpoint
+        driver.get.assert_called_once_with('example.com')
+        assert ActionCheckpoint(checkpoint).load()['index'] == 0
+
+        with patch.dict('src.main.config', {'checkpoint': str(checkpoint), 'jobs': [{'url': 'example.com'}]}, clear=True):
+            with pytest.raises(Exception) as e:
+                await main()
+        assert 'only works for a single run' in str(e.value)
+
+
+class TestPacing:
+    @pytest.mark.asyncio
+    async def test_pacer_replaces_sleep(self, mock_scraper_class, mock_sleep, mock_element):
+        pacer = Pacer('none')
+        action = {'type': 'select', 'xpath': '//select', 'value': 'x', 'wait': 2}
+
+        my_class = DynamicWebScraping({}, mock_scraper_class, pacer=pacer)
+        await my_class.run_actions([action])
+
+        mock_sleep.assert_not_called()
+        mock_scraper_class.dropdown_select.assert_called_once()
+
+
+class TestAdaptiveTimeouts:
+    @pytest.mark.asyncio
+    async def test_find_uses_learned_timeout(self, mock_scraper_class, mock_sleep, mock_element, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', min_samples=1, min_timeout=0, margin=1)
+        latencies.record('example.com', '//button', .05)
+        mock_scraper_class.lookup_time = .2
+        action = {'type': 'click', 'xpath': '//button', 'wait': 5}
+
+        my_class = DynamicWebScraping({'url': 'https://example.com'}, mock_scraper_class, latencies=latencies)
+        await my_class.run_actions([action])
+
+        mock_scraper_class.find_element.assert_called_once_with(by=By.XPATH, value='//button', action=action,
+                                                                wait_timeout=.05)
+        assert SelectorLatencies(tmp_path / 'latencies.db', min_samples=2, margin=1).timeout_for(
+            'example.com', '//button') > .05
+
+    @pytest.mark.asyncio
+    async def test_cached_elements_are_not_recorded(self, mock_scraper_class, mock_sleep, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', min_samples=1)
+        mock_scraper_class.lookup_time = None
+        action = {'type': 'click', 'xpath': '//button', 'wait': 5}
+
+        my_class = DynamicWebScraping({'url': 'https://example.com'}, mock_scraper_class, latencies=latencies)
+        await my_class.run_actions([action])
+
+        assert latencies.timeout_for('example.com', '//button') is None
+
+    @pytest.mark.asyncio
+    async def test_timed_out_lookup_is_censored(self, mock_scraper_class, mock_sleep, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', min_samples=1, min_timeout=0, margin=1)
+        latencies.record('example.com', '//button', .05)
+        mock_scraper_class.lookup_time = .05
+        mock_scraper_class.find_element.return_value = None
+        action = {'type': 'click', 'xpath': '//button', 'wait': 5}
+
+        my_class = DynamicWebScraping({'url': 'https://example.com'}, mock_scraper_class, latencies=latencies)
+        await my_class.run_actions([action, action])
+
+        # the misses count as lookups that took the whole timeout, so the timeout grows back
+        timeouts = [call.kwargs['wait_timeout'] for call in mock_scraper_class.find_element.call_args_list]
+        assert timeouts[1] > timeouts[0] == .05
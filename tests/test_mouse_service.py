@@ -0,0 +1,49 @@
+import math
+import random
+
+from src.service.mouse_service import MouseModel, minimum_jerk_basis
+
+
+class TestMouseModel:
+    def test_minimum_jerk_basis(self):
+        progress, weights = minimum_jerk_basis(10)
+
+        assert progress[0] == 0 and math.isclose(progress[-1], 1)
+        assert all(a <= b for a, b in zip(progress, progress[1:]))
+        # slow at both ends, fast in the middle
+        assert progress[1] - progress[0] < progress[6] - progress[5]
+        assert math.isclose(weights[0], 0) and math.isclose(weights[-1], 0, abs_tol=1e-9)
+        assert minimum_jerk_basis(10) is minimum_jerk_basis(10)
+
+    def test_path_ends_on_target(self):
+        model = MouseModel(rng=random.Random(1))
+
+        path = model.path((0, 0), (400, 300), width=40)
+
+        assert path.points[-1] == (400, 300)
+        assert model.min_steps <= len(path.points) <= model.max_steps
+        # the bow keeps the points near the straight line
+        assert all(abs(x * 3 - y * 4) / 5 < 500 * model.bow + 10 for x, y in path.points)
+        assert math.isclose(path.interval * len(path.points), model.duration(500, 40))
+
+    def test_fitts_law(self):
+        model = MouseModel()
+
+        assert model.duration(800, 10) > model.duration(800, 100) > model.duration(100, 100)
+
+    def test_paths_continue_from_the_cursor(self):
+        model = MouseModel(rng=random.Random(2))
+
+        paths = model.paths([(100, 100), (100, 100), (300, 50)])
+
+        assert [path.points[-1] for path in paths] == [(100, 100), (100, 100), (300, 50)]
+        assert paths[1].points == [(100, 100)]
+        assert model.position == (300, 50)
+
+    def test_target_inside_the_box(self):
+        model = MouseModel(rng=random.Random(3))
+        rect = {'x': 10, 'y': 20, 'width': 100, 'height': 30}
+
+        for _ in range(100):
+            x, y = model.target(rect)
+            assert 10 <= x <= 110 and 20 <= y <= 50
@@ -1,13 +1,110 @@
 import asyncio
+import json
+import weakref
+from collections import defaultdict
 
 import pytest
-from unittest.mock import patch, Mock, AsyncMock
+from selenium.webdriver.common.by import By
+from unittest.mock import patch, Mock, AsyncMock, call
+from nodriver.cdp.runtime import ExecutionContextId
+from nodriver.cdp.browser import DownloadWillBegin, DownloadProgress
 
 from custom_fixtures import mock_element
-from src.service.nodriver_service import NoDriverService
+from src.service.nodriver_service import NoDriverService, CustomWebElement, NodeHandle, DownloadTracker, deserialize, HANDLE_BINDING
+from src.service.typing_service import Burst, BACKSPACE
 from tests.custom_fixtures import xpaths, selectors
 
 
+def serialized(value):
+    """deep serialize a python value the way cdp does"""
+    if isinstance(value, dict) and 'backendNodeId' in value:
+        return {'type': 'node', 'value': value}
+    if isinstance(value, dict):
+        return {'type': 'object', 'value': [[key, serialized(item)] for key, item in value.items()]}
+    if isinstance(value, list):
+        return {'type': 'array', 'value': [serialized(item) for item in value]}
+    if value is None:
+        return {'type': 'null'}
+    return {'type': {bool: 'boolean', str: 'string'}.get(type(value), 'number'), 'value': value}
+
+
+commands = weakref.WeakKeyDictionary()
+
+
+def command(generator):
+    """the {"method": ..., "params": ...} dict a cdp command yields, read once from its generator"""
+    if generator not in commands:
+        commands[generator] = next(generator)
+    return commands[generator]
+
+
+def evaluations(page):
+    """the kernel lookups sent to the page"""
+    return [call for call in page.send.call_args_list if command(call.args[0])['method'] == 'Runtime.evaluate'
+            and '.lookup(' in command(call.args[0])['params']['expression']]
+
+
+def kernel_calls(page):
+    """the kernel functions (other than lookup) called in the page, e.g. 'window.__scraper.fill(...)'"""
+    return [command(call.args[0])['params']['expression'] for call in page.send.call_args_list
+            if command(call.args[0])['method'] == 'Runtime.evaluate'
+            and command(call.args[0])['params']['expression'].startswith('window.__scraper.')
+            and '.lookup(' not in command(call.args[0])['params']['expression']]
+
+
+# the box measured by the kernel right before a click
+BOX = {'x': 0, 'y': 0, 'width': 10, 'height': 10}
+
+
+def answer_kernel(page, values=(), lookup=None):
+    """answer the commands of the kernel: the world is created, lookups get the lookup result and the other
+    kernel calls the values in order (True once they ran out)"""
+    values = iter(values)
+
+    async def send(generator):
+        sent = command(generator)
+        if sent['method'] == 'Page.createIsolatedWorld':
+            return ExecutionContextId(7)
+        expression = sent['params'].get('expression', '')
+        if '.lookup(' in expression:
+            return lookup
+        if expression.startswith('window.__scraper.'):
+            return Mock(value=next(values, True)), None
+        return None
+    page.send.side_effect = send
+
+
+def answer_search(page, nodes):
+    """answer the kernel's iter_elements search with the nodes"""
+    async def send(generator):
+        sent = command(generator)
+        if sent['method'] == 'Page.createIsolatedWorld':
+            return ExecutionContextId(7)
+        expression = sent['params'].get('expression', '')
+        if '.search(' in expression:
+            return Mock(value=len(nodes)), None
+        if '.searchResults(' in expression:
+            start, end = json.loads(f"[{expression.split('(', 1)[1][:-1]}]")[1:]
+            return Mock(deep_serialized_value=serialized(nodes[start:end])), None
+        return Mock(value=True), None
+    page.send.side_effect = send
+
+
+def mouse_events(page):
+    """the types of the mouse events dispatched to the page"""
+    return [command(call.args[0])['params']['type'] for call in page.send.call_args_list
+            if command(call.args[0])['method'] == 'Input.dispatchMouseEvent']
+
+
+def lookup_result(state, count=1):
+    """the (remote object, exception details) of the lookup script"""
+    elements = [{
+        'element': {'backendNodeId': index + 1, 'localName': 'input', 'nodeType': 1, 'attributes': {'id': 'email'}},
+        'visible': True, 'enabled': True, 'rect': {'x': 0, 'y': 0, 'width': 10, 'height': 10},
+    } for index in range(count)]
+    return Mock(deep_serialized_value=serialized({'state': state, 'elements': elements})), None
+
+
 @pytest.fixture(scope="function")
 def mock_uc_start():
     with patch('src.service.nodriver_service.uc.start') as uc_mock:
@@ -21,6 +118,8 @@ def mock_uc_start():
         page.text = "Original Page"
         page.url = 'example.com'
         page.bring_to_front = AsyncMock()
+        page.add_handler = Mock()
+        page.target_id = 'target-1'
         uc_mock.return_value.get.return_value = page
         uc_mock.return_value.tabs = [page]
         uc_mock.return_value.get_targets.return_value = [page]
@@ -67,20 +166,20 @@ class TestNoDriverService:
     @pytest.mark.asyncio
     async def test_find_elements(self, mock_uc_start, mock_element):
         value = xpaths['email_input']
-        elements = [mock_element]
 
         mock_sleep = AsyncMock()
         url = 'https://www.google.com'
         driver = NoDriverService(mock_sleep)
         page = await driver.get(url)
-        page.xpath.return_value = elements
-        # page.evaluate = AsyncMock()
+        answer_kernel(page, lookup=lookup_result('ready', count=2))
 
         res = await driver.find_elements(value=value)
-        assert page.xpath.is_called_with(value, 1)
+        assert len(res) == 2
         assert hasattr(res[0], 'is_displayed')
-        assert mock_sleep.is_called()
-        assert page.evaluate.call_count == len(elements)
+        assert res[1]._element.backend_node_id == 2
+        # one round trip for the lookup, scroll and visibility of every match
+        assert len(evaluations(page)) == 1
+        page.xpath.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_find_elements_exception_caught(self, mock_uc_start):
@@ -106,14 +205,15 @@ class TestNoDriverService:
         url = 'https://www.google.com'
         driver = NoDriverService(mock_sleep)
         page = await driver.get(url)
-        page.find.return_value = mock_element
-        page.evaluate = AsyncMock()
+        answer_kernel(page, lookup=lookup_result('ready'))
 
         res = await driver.find_element(value=value)
-        assert page.find.is_called_with(value, 1)
         assert hasattr(res, 'get_value')
-        assert mock_sleep.is_called()
-        assert page.evaluate.is_called_with(value)
+        assert res._element.local_name == 'input'
+        assert res._element.attrs['id'] == 'email'
+        assert res.rect == {'x': 0, 'y': 0, 'width': 10, 'height': 10}
+        assert res.is_enabled()
+        page.find.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_find_element_exception_caught(self, mock_uc_start):
@@ -139,15 +239,47 @@ class TestNoDriverService:
         url = 'https://www.google.com'
         driver = NoDriverService(mock_sleep)
         page = await driver.get(url)
+        # the element was scrolled since the lookup, the click is aimed at the box measured right before it
+        answer_kernel(page, values=[{'x': 100, 'y': 200, 'width': 10, 'height': 10}], lookup=lookup_result('ready'))
 
-        test_element = mock_element
-        page.find.return_value = test_element
-
-        res = await driver.find_element(value=value)
+        with patch('src.service.nodriver_service.node_element', return_value=mock_element):
+            res = await driver.find_element(value=value)
         await driver.click_element(element=res)
-        assert test_element.click.is_called()
+
+        assert [call.split('(')[0] for call in kernel_calls(page)] == ['window.__scraper.measure']
+        # moved into the element along a path and clicked with real mouse events
+        events = mouse_events(page)
+        assert events[-2:] == ['mousePressed', 'mouseReleased']
+        assert set(events[:-2]) == {'mouseMoved'} and len(events) > 3
+        pressed = next(command(call.args[0])['params'] for call in page.send.call_args_list
+                       if command(call.args[0])['method'] == 'Input.dispatchMouseEvent'
+                       and command(call.args[0])['params']['type'] == 'mousePressed')
+        assert 100 <= pressed['x'] <= 110 and 200 <= pressed['y'] <= 210
+        mock_element.click.assert_not_called()
         assert mock_sleep.is_called()
 
+    @pytest.mark.asyncio
+    async def test_click_element_zero_size_box_falls_back(self, mock_uc_start, mock_element):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, values=[{'x': 0, 'y': 0, 'width': 0, 'height': 0}], lookup=lookup_result('ready'))
+
+        with patch('src.service.nodriver_service.node_element', return_value=mock_element):
+            res = await driver.find_element(value=xpaths['email_input'])
+        await driver.click_element(element=res)
+
+        assert mouse_events(page) == []
+        mock_element.click.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_click_element_without_box_falls_back(self, mock_uc_start, mock_element):
+        driver = NoDriverService(AsyncMock())
+        await driver.get('example.com')
+
+        await driver.click_element(element=mock_element)
+
+        mock_element.click.assert_called_once()
+
     @pytest.mark.asyncio
     async def test_type_input(self, mock_uc_start, mock_element):
         value = xpaths['email_input']
@@ -164,13 +296,50 @@ class TestNoDriverService:
         get.return_value = 'test input'
 
         # await driver.find_element(value=value)
-        await driver.type_input(action={'value': value}, element=test_element)
+        await driver.type_input(action={'value': value, 'typing': {'typo_rate': 0}}, element=test_element)
 
         assert get.is_called_with('value')
         assert test_element.clear_input.is_called()
-        assert test_element.send_keys.call_count == len(value)
+        # a key down and up per character in order instead of one send_keys per character
+        sent = [call.args[0] for call in page.send.call_args_list]
+        assert [sent_command.__name__ for sent_command in sent] == ['dispatch_key_event'] * 2 * len(value)
+        typed = [command(sent_command)['params'].get('text') for sent_command in sent]
+        typed = [text for text in typed if text]
+        assert ''.join(typed) == value
+        test_element.send_keys.assert_not_called()
         assert mock_sleep.is_called()
 
+    @pytest.mark.asyncio
+    async def test_type_keys_sleeps_intervals(self, mock_uc_start):
+        sleeps, sent, in_flight, peak = [], [], [], []
+        released = asyncio.Event()
+
+        async def sleep(delay):
+            sleeps.append(delay)
+            await asyncio.sleep(0)
+
+        driver = NoDriverService(sleep)
+        page = await driver.get('example.com')
+
+        async def send(event):
+            sent.append(command(event)['params']['type'])
+            in_flight.append(event)
+            peak.append(len(in_flight))
+            # the replies only come once the 4 events of the first burst are in flight
+            if len(in_flight) == 4:
+                released.set()
+            await released.wait()
+            in_flight.remove(event)
+        page.send.side_effect = send
+
+        await asyncio.wait_for(driver.type_keys([Burst(.4, ['a', 'b'], [0, .1]), Burst(.5, [BACKSPACE], [0])]), 1)
+
+        # the pause before every burst and the interval before every key are slept, the keys are sent in order
+        assert sleeps[-3:] == [.4, .1, .5]
+        assert sent[-6:] == ['keyDown', 'keyUp', 'keyDown', 'keyUp', 'rawKeyDown', 'keyUp']
+        # the key events of a burst are not awaited one by one
+        assert max(peak) == 4
+
     @pytest.mark.asyncio
     async def test_dropdown_select(self, mock_uc_start, mock_element):
         value = xpaths['email_input']
@@ -185,7 +354,7 @@ class TestNoDriverService:
         # test_element.return_value = TestElement(['enabled', get])
         # test_element.return_value.attrs.get.return_value = 'test input'
         page.find.return_value = test_element
-        page.evaluate.side_effect = [None, 'not test option', 'test option']
+        answer_kernel(page, [True, 'not test option', 'test option'])
         get.return_value = 'test option'
 
         # await driver.find_element(value=value)
@@ -193,7 +362,7 @@ class TestNoDriverService:
                                      element=test_element)
 
         assert test_element.send_keys.is_called_with(value)
-        assert page.evaluate.call_count == 3
+        assert len(kernel_calls(page)) == 3
         assert mock_sleep.is_called()
 
     @pytest.mark.asyncio
@@ -209,7 +378,7 @@ class TestNoDriverService:
         get = Mock()
         # test_element.return_value.attrs.get.return_value = 'test input'
         page.find.return_value = test_element
-        page.evaluate.side_effect = [None, 'not test option', 'test option']
+        answer_kernel(page, [True, 'not test option', 'test option'])
         get.return_value = 'test option'
 
         # await driver.find_element(value=value)
@@ -317,4 +486,473 @@ class TestNoDriverService:
 
         await driver.close()
         assert mock_uc_start.close.is_called_once()
-        assert mock_uc_start.stop.is_called_once()
\ No newline at end of file
+        assert mock_uc_start.stop.is_called_once()
+    @pytest.mark.asyncio
+    async def test_get_leases_from_pool(self, mock_uc_start):
+        mock_sleep = AsyncMock()
+        browser = AsyncMock()
+        browser.tabs = []
+        pool = Mock()
+        pool.lease = AsyncMock(return_value=browser)
+        driver = NoDriverService(mock_sleep, pool=pool)
+        await driver.get('example.com')
+        await driver.get('example2.com')
+
+        mock_uc_start.assert_not_called()
+        pool.lease.assert_called_once()
+        assert browser.get.call_count == 2
+
+        await driver.close()
+        pool.release.assert_called_once_with(browser)
+        browser.stop.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_open_tab(self, mock_uc_start):
+        mock_sleep = AsyncMock()
+        driver = NoDriverService(mock_sleep)
+        await driver.get('example.com')
+        browser = mock_uc_start.return_value
+        tab = AsyncMock()
+        browser.get.return_value = tab
+
+        tab_driver = driver.open_tab()
+        page = await tab_driver.get('example2.com')
+        await tab_driver.get('example3.com')
+
+        assert page is tab
+        browser.get.assert_called_with('example2.com', new_tab=True)
+        tab.get.assert_called_once_with('example3.com')
+        assert tab_driver.get_page() is not driver.get_page()
+
+        await tab_driver.close()
+        tab.close.assert_called_once()
+        browser.stop.assert_not_called()
+
+    def test_open_tab_before_get(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        with pytest.raises(Exception) as e:
+            driver.open_tab()
+        assert str(e.value) == "The browser has not been started, call get() before opening tabs"
+
+    @pytest.mark.asyncio
+    async def test_open_context(self, mock_uc_start):
+        mock_sleep = AsyncMock()
+        driver = NoDriverService(mock_sleep)
+        await driver.get('example.com')
+        browser = mock_uc_start.return_value
+        browser.connection.send = AsyncMock(side_effect=['context-1', 'target-1', None])
+        browser.update_targets = AsyncMock()
+        tab = AsyncMock()
+        tab.type_ = 'page'
+        tab.target_id = 'target-1'
+        other_tab = Mock()
+        other_tab.type_ = 'page'
+        other_tab.target_id = 'target-0'
+        browser.targets = [other_tab, tab]
+
+        context_driver = driver.open_context()
+        page = await context_driver.get('example2.com')
+
+        assert page is tab
+        browser.get.assert_called_once_with('example.com')
+        assert browser.connection.send.call_count == 2
+
+        await context_driver.close()
+        tab.close.assert_called_once()
+        assert browser.connection.send.call_count == 3
+        browser.stop.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_get_reuses_started_browser(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        await driver.get('example.com')
+        await driver.get('example2.com')
+
+        mock_uc_start.assert_called_once()
+        assert mock_uc_start.return_value.get.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_cookies_round_trip(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        await driver.get('example.com')
+        browser = mock_uc_start.return_value
+        cookie = Mock()
+        cookie.to_json.return_value = {'name': 'session', 'value': 'abc', 'domain': 'example.com', 'path': '/',
+                                       'expires': -1, 'session': True}
+        browser.connection.send = AsyncMock(side_effect=[[cookie], None])
+
+        cookies = await driver.get_cookies()
+        await driver.set_cookies(cookies)
+
+        assert cookies == [cookie.to_json.return_value]
+        assert browser.connection.send.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_wait_until_ready(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, lookup=lookup_result('ready'))
+
+        res = await driver.wait_until_ready(xpaths['email_input'], timeout=2)
+
+        assert res == 'ready'
+        lookup = command(page.send.call_args.args[0])
+        script = lookup['params']['expression']
+        assert lookup['params']['serializationOptions']['serialization'] == 'deep'
+        assert script == ('window.__scraper.lookup({"locator": "//input[@id=\'email\']", "xpath": true, "key": null}, '
+                          '{"multiple": false, "stableFrames": 2, "timeoutMs": 2000})')
+        # the kernel is installed in its own world for every new document, the binding only exists in that world,
+        # and the document that was already loaded gets its world on the first call
+        sent = [command(call.args[0]) for call in page.send.call_args_list]
+        assert [c['method'] for c in sent] == ['Page.addScriptToEvaluateOnNewDocument', 'Runtime.addBinding',
+                                              'Page.createIsolatedWorld', 'Runtime.evaluate', 'Runtime.evaluate']
+        assert sent[0]['params']['worldName'] == sent[1]['params']['executionContextName'] == '__scraper_world'
+        assert sent[2]['params'] == {'frameId': 'target-1', 'worldName': '__scraper_world'}
+        assert lookup['params']['contextId'] == sent[3]['params']['contextId']
+
+    @pytest.mark.asyncio
+    async def test_find_element_missing_skips_find(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, lookup=lookup_result('missing', count=0))
+
+        res = await driver.find_element(value=xpaths['email_input'], required=False)
+
+        assert res is None
+        page.find.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_click_waits_for_readiness_instead_of_sleeping(self, mock_uc_start, mock_element):
+        mock_sleep = AsyncMock()
+        driver = NoDriverService(mock_sleep)
+        page = await driver.get('example.com')
+        mock_sleep.reset_mock()
+        answer_kernel(page, values=[BOX], lookup=lookup_result('present'))
+
+        with patch('src.service.nodriver_service.node_element', return_value=mock_element):
+            element = await driver.find_element(value=xpaths['email_input'])
+        await driver.click_element(element=element)
+
+        # no fixed delay, only the mouse movement is paced
+        assert call(.5) not in mock_sleep.call_args_list
+        # the element was still moving at the lookup so the click waits for it again
+        assert len(evaluations(page)) == 2
+        assert mouse_events(page)[-1] == 'mouseReleased'
+
+    @pytest.mark.asyncio
+    async def test_click_waits_briefly_and_skips_missing_elements(self, mock_uc_start, mock_element):
+        driver = NoDriverService(AsyncMock(), implicit_wait=10)
+        page = await driver.get('example.com')
+        answer_kernel(page, lookup=lookup_result('present'))
+        with patch('src.service.nodriver_service.node_element', return_value=mock_element):
+            element = await driver.find_element(value=xpaths['email_input'])
+        answer_kernel(page, lookup=lookup_result('missing', count=0))
+
+        assert await driver.click_element(element=element) is False
+        with pytest.raises(Exception) as e:
+            await driver.click_element(element=element, required=True)
+
+        assert str(e.value) == "The element to click is no longer in the document"
+        assert '"timeoutMs": 1000' in command(evaluations(page)[-1].args[0])['params']['expression']
+        assert mouse_events(page) == []
+        mock_element.click.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_click_after_ready_lookup_skips_second_wait(self, mock_uc_start, mock_element):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, values=[BOX], lookup=lookup_result('ready'))
+
+        with patch('src.service.nodriver_service.node_element', return_value=mock_element):
+            element = await driver.find_element(value=xpaths['email_input'])
+        assert await element.is_displayed()
+        await driver.click_element(element=element)
+
+        assert len(evaluations(page)) == 1
+        page.evaluate.assert_not_called()
+        assert mouse_events(page)[-2:] == ['mousePressed', 'mouseReleased']
+
+    def test_deserialize(self):
+        node = {'backendNodeId': 7, 'localName': 'a'}
+        value = serialized({'state': 'ready', 'elements': [{'element': node, 'visible': False, 'rect': None}]})
+
+        assert deserialize(value) == {'state': 'ready', 'elements': [{'element': node, 'visible': False, 'rect': None}]}
+
+    @pytest.mark.asyncio
+    async def test_find_element_reuses_cached_handle(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, [True, False], lookup=lookup_result('ready'))
+
+        first = await driver.find_element(value=xpaths['email_input'])
+        second = await driver.find_element(value=xpaths['email_input'])
+
+        assert second is first
+        assert driver.lookup_time is None
+        assert len(evaluations(page)) == 1
+        assert kernel_calls(page) == [f'window.__scraper.connected("xpath:{xpaths["email_input"]}")']
+
+        # the node left the document before the page's observer reported it
+        third = await driver.find_element(value=xpaths['email_input'])
+        assert third is not first
+        assert len(evaluations(page)) == 2
+        script = command(evaluations(page)[0].args[0])['params']['expression']
+        assert f'"key": "xpath:{xpaths["email_input"]}"' in script
+
+    @pytest.mark.asyncio
+    async def test_handle_cache_invalidation(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, lookup=lookup_result('ready'))
+        await driver.find_element(value=xpaths['email_input'])
+        handlers = {call.args[0].__name__: call.args[1] for call in page.add_handler.call_args_list}
+
+        # the page reports the element was removed
+        event = Mock(payload=f"xpath:{xpaths['email_input']}")
+        event.name = HANDLE_BINDING
+        handlers['BindingCalled'](event)
+        await driver.find_element(value=xpaths['email_input'])
+        assert len(evaluations(page)) == 2
+
+        # navigating drops every element, child frames do not
+        handlers['FrameNavigated'](Mock(frame=Mock(parent_id='frame-1')))
+        await driver.find_element(value=xpaths['email_input'])
+        assert len(evaluations(page)) == 2
+        handlers['FrameNavigated'](Mock(frame=Mock(parent_id=None)))
+        await driver.find_element(value=xpaths['email_input'])
+        assert len(evaluations(page)) == 3
+
+    @pytest.mark.asyncio
+    async def test_kernel_world_follows_the_documents(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, lookup=lookup_result('ready'))
+        await driver.wait_until_ready(xpaths['email_input'])
+        handlers = {call.args[0].__name__: call.args[1] for call in page.add_handler.call_args_list}
+
+        def context_ids():
+            return [command(call.args[0])['params'].get('contextId') for call in evaluations(page)]
+
+        # a new document got the kernel world from the browser, iframes have their own
+        world = Mock(id_=ExecutionContextId(9), aux_data={'frameId': 'target-1'})
+        world.name = '__scraper_world'
+        frame_world = Mock(id_=ExecutionContextId(10), aux_data={'frameId': 'frame-1'})
+        frame_world.name = '__scraper_world'
+        handlers['ExecutionContextCreated'](Mock(context=world))
+        handlers['ExecutionContextCreated'](Mock(context=frame_world))
+        await driver.wait_until_ready(xpaths['email_input'])
+        assert context_ids() == [7, 9]
+
+        # the document went away, the next call creates a world for the current one
+        handlers['ExecutionContextDestroyed'](Mock(execution_context_id=ExecutionContextId(9)))
+        await driver.wait_until_ready(xpaths['email_input'])
+        assert context_ids() == [7, 9, 7]
+        sent = [command(call.args[0])['method'] for call in page.send.call_args_list]
+        assert sent.count('Page.createIsolatedWorld') == 2
+
+    @pytest.mark.asyncio
+    async def test_handle_caches_of_closed_pages_are_dropped(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        browser = mock_uc_start.return_value
+        browser.targets = [page]
+        answer_kernel(page, lookup=lookup_result('ready'))
+        page.handlers = {}
+        page.add_handler.side_effect = lambda event, handler: page.handlers.setdefault(event, []).append(handler)
+        await driver.find_element(value=xpaths['email_input'])
+        assert sum(map(len, page.handlers.values())) == 5
+
+        # the page was closed and another one is used
+        popup = AsyncMock()
+        popup.target_id = 'target-2'
+        popup.add_handler = Mock()
+        answer_kernel(popup, lookup=lookup_result('ready'))
+        browser.targets = [popup]
+        browser.get.return_value = popup
+        await driver.get('example2.com')
+        await driver.find_element(value=xpaths['email_input'])
+
+        assert sum(map(len, page.handlers.values())) == 0
+
+    @pytest.mark.asyncio
+    async def test_element_scripts_call_the_kernel(self):
+        kernel = AsyncMock()
+        element = CustomWebElement(Mock(), Mock(), xpath='//select[@id="x"]', key='xpath://select[@id="x"]',
+                                   kernel=kernel)
+
+        await element.is_displayed()
+        await element.get_value()
+
+        target = {'locator': '//select[@id="x"]', 'xpath': True, 'key': 'xpath://select[@id="x"]'}
+        assert kernel.value.call_args_list == [call('visible', target), call('extract', target, 'value')]
+        assert CustomWebElement(Mock(), Mock()).target() is None
+
+    @pytest.mark.asyncio
+    async def test_iter_elements_streams_search_results(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_search(page, [{'backendNodeId': index, 'localName': 'tr', 'nodeType': 1, 'attributes': {'class': 'row'}}
+                             for index in range(1, 6)])
+
+        handles = []
+        async for handle in driver.iter_elements('tr.row', by=By.CSS_SELECTOR, chunk_size=2):
+            handles.append(handle)
+
+        assert [handle.backend_node_id for handle in handles] == [1, 2, 3, 4, 5]
+        calls = kernel_calls(page)
+        # the search honours the selector type and runs once, the matches come in chunks
+        assert calls[0].startswith('window.__scraper.search(') and '"xpath": false' in calls[0]
+        assert sum('.searchResults(' in call for call in calls) == 3
+        assert calls[-1].startswith('window.__scraper.discardSearch(')
+        assert await handles[0].get_attribute('class') == 'row'
+        assert await handles[0].get_attribute('id') is None
+        sent = page.send.call_count
+        element = await handles[0].element()
+        assert element.backend_node_id == 1
+        assert page.send.call_count == sent
+
+    @pytest.mark.asyncio
+    async def test_iter_elements_discards_the_search_when_stopped_early(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_search(page, [{'backendNodeId': index, 'localName': 'tr', 'nodeType': 1, 'attributes': {}}
+                             for index in range(1, 11)])
+
+        handles = driver.iter_elements('//tr', chunk_size=2)
+        await handles.__anext__()
+        await handles.aclose()
+
+        assert kernel_calls(page)[-1].startswith('window.__scraper.discardSearch(')
+
+    def test_handles_are_compact(self):
+        element = CustomWebElement(Mock(), Mock(), xpath='//a')
+
+        # no per instance dict, attribute lookups that miss are forwarded to the nodriver element
+        with pytest.raises(AttributeError):
+            object.__getattribute__(element, '__dict__')
+        assert not hasattr(NodeHandle({'backendNodeId': 1}, Mock()), '__dict__')
+
+    @pytest.mark.asyncio
+    async def test_evaluate_batch_pipelines_commands(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        in_flight, most = 0, 0
+
+        async def send(command):
+            nonlocal in_flight, most
+            in_flight += 1
+            most = max(most, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+            expression = next(command)['params']['expression']
+            if expression == 'broken':
+                return Mock(), Mock(text='ReferenceError')
+            return Mock(value=expression.upper()), None
+        page.send.side_effect = send
+
+        res = await driver.evaluate_batch(['a', 'b', 'broken'], return_exceptions=True)
+
+        # every command was sent before the first reply came back
+        assert most == 3
+        assert res[:2] == ['A', 'B']
+        assert 'ReferenceError' in str(res[2])
+        with pytest.raises(Exception):
+            await driver.evaluate_batch(['a', 'broken'])
+
+    @pytest.mark.asyncio
+    async def test_fill_form_single_kernel_call(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        page = await driver.get('example.com')
+        answer_kernel(page, [[True, False]])
+
+        res = await driver.fill_form(fields=[{'xpath': '//input[@id="a"]', 'value': 'x'},
+                                             {'xpath': '//input[@id="b"]', 'value': True}])
+
+        assert res == [True, False]
+        assert len(kernel_calls(page)) == 1
+        script = kernel_calls(page)[0]
+        assert script.startswith('window.__scraper.fill([{"target": {"locator": "//input[@id=\\"a\\"]"')
+        assert '"value": true' in script
+
+    @pytest.mark.asyncio
+    async def test_browser_download_is_captured_from_progress_events(self, mock_uc_start, tmp_path):
+        driver = NoDriverService(AsyncMock())
+        await driver.get('example.com')
+        browser = mock_uc_start.return_value
+        browser.connection.send = AsyncMock()
+        browser.connection.add_handler = Mock()
+
+        await driver.set_download_directory(str(tmp_path / 'reports'))
+
+        behavior = command(browser.connection.send.call_args.args[0])
+        assert behavior['method'] == 'Browser.setDownloadBehavior'
+        assert behavior['params']['behavior'] == 'allowAndName'
+        assert behavior['params']['eventsEnabled'] is True
+        handlers = {call.args[0].__name__: call.args[1] for call in browser.connection.add_handler.call_args_list}
+
+        # the browser wrote the file under its guid, it is renamed to the name the site suggested
+        written = tmp_path / 'guid-1'
+        written.write_bytes(b'report')
+        handlers['DownloadWillBegin'](Mock(frame_id='target-1', guid='guid-1', suggested_filename='report.pdf'))
+        handlers['DownloadWillBegin'](Mock(frame_id='other-tab', guid='guid-2', suggested_filename='other.pdf'))
+        handlers['DownloadProgress'](Mock(guid='guid-1', state='inProgress'))
+        handlers['DownloadProgress'](Mock(guid='guid-2', state='completed', file_path=str(tmp_path / 'guid-2')))
+        handlers['DownloadProgress'](Mock(guid='guid-1', state='completed', file_path=str(written)))
+
+        path = await driver.wait_for_download(timeout=1)
+
+        assert path == str(tmp_path / 'reports' / 'report.pdf')
+        assert open(path, 'rb').read() == b'report'
+        # the other tab's download is not reported
+        with pytest.raises(Exception):
+            await driver.wait_for_download(timeout=.05)
+
+    @pytest.mark.asyncio
+    async def test_browser_download_goes_to_the_directory_routed_when_it_started(self, mock_uc_start, tmp_path):
+        driver = NoDriverService(AsyncMock())
+        await driver.get('example.com')
+        browser = mock_uc_start.return_value
+        browser.connection.send = AsyncMock()
+        browser.connection.add_handler = Mock()
+        await driver.set_download_directory(str(tmp_path / 'reports'))
+        handlers = {call.args[0].__name__: call.args[1] for call in browser.connection.add_handler.call_args_list}
+
+        written = tmp_path / 'guid-1'
+        written.write_bytes(b'report')
+        handlers['DownloadWillBegin'](Mock(frame_id='target-1', guid='guid-1', suggested_filename='report.pdf'))
+        await driver.set_download_directory(str(tmp_path / 'invoices'))
+        handlers['DownloadProgress'](Mock(guid='guid-1', state='completed', file_path=str(written)))
+        # the move failed, the error is reported by the wait instead of raised in the event handler
+        handlers['DownloadWillBegin'](Mock(frame_id='target-1', guid='guid-2', suggested_filename='gone.pdf'))
+        handlers['DownloadProgress'](Mock(guid='guid-2', state='completed', file_path=str(tmp_path / 'missing')))
+        handlers['DownloadWillBegin'](Mock(frame_id='target-1', guid='guid-3', suggested_filename='big.zip'))
+        handlers['DownloadProgress'](Mock(guid='guid-3', state='canceled'))
+
+        assert await driver.wait_for_download(timeout=1) == str(tmp_path / 'reports' / 'report.pdf')
+        with pytest.raises(Exception):
+            await driver.wait_for_download(timeout=1)
+        with pytest.raises(Exception) as e:
+            await driver.wait_for_download(timeout=1)
+        assert str(e.value) == 'Download of big.zip was canceled'
+
+    def test_download_tracker_close_removes_its_handlers(self, tmp_path):
+        connection = Mock(handlers=defaultdict(list))
+        connection.add_handler = lambda event_type, handler: connection.handlers[event_type].append(handler)
+        other = Mock()
+        connection.add_handler(DownloadProgress, other)
+        tracker = DownloadTracker(str(tmp_path))
+        tracker.listen(connection)
+
+        tracker.close()
+
+        # the handlers of the other drivers of the browser are kept
+        assert connection.handlers[DownloadProgress] == [other]
+        assert connection.handlers[DownloadWillBegin] == []
+
+    @pytest.mark.asyncio
+    async def test_wait_for_download_needs_a_directory(self, mock_uc_start):
+        driver = NoDriverService(AsyncMock())
+        await driver.get('example.com')
+
+        with pytest.raises(Exception):
+            await driver.wait_for_download(timeout=.05)
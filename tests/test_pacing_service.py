@@ -0,0 +1,56 @@
+import random
+
+import pytest
+from unittest.mock import patch
+
+from src.service.pacing_service import Pacer, resolve_pacing
+
+
+class TestPacer:
+    def test_balanced_matches_humanized_sleep(self):
+        pacer = Pacer(rng=random.Random(1))
+        delays = [pacer.delay(2) for _ in range(50)]
+        assert all(2 <= delay <= 2.2 for delay in delays)
+
+    def test_none_profile_skips_delays(self):
+        assert Pacer('none').delay(5) == 0
+
+    def test_fast_profile_caps_delays(self):
+        assert Pacer('fast', rng=random.Random(1)).delay(10) == .5
+
+    def test_site_and_action_overrides(self):
+        pacer = Pacer('stealth', sites={'intranet.local': 'none'}, actions={'input': {'scale': .1}},
+                      distribution='fixed', min_delay=0)
+        assert pacer.delay(2) == 3
+
+        with pacer.action('input'):
+            assert pacer.delay(2) == pytest.approx(.2)
+        assert pacer.delay(2) == 3
+
+        pacer.site = 'https://app.intranet.local/login'
+        assert pacer.delay(2) == 0
+
+    def test_budget(self):
+        pacer = Pacer(distribution='fixed', budget=5)
+        assert [pacer.delay(2) for _ in range(4)] == [2, 2, 1, 0]
+        assert pacer.remaining == 0
+
+    def test_pluggable_distribution(self):
+        pacer = Pacer(distribution=lambda delay, rng: delay / 2)
+        assert pacer.delay(3) == 1.5
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError):
+            resolve_pacing('sleepy')
+
+    def test_from_config(self):
+        assert Pacer.from_config({'url': 'https://example.com'}) is None
+        pacer = Pacer.from_config({'url': 'https://intranet.local', 'pacing': {'sites': {'intranet.local': 'none'}}})
+        assert pacer.delay(2) == 0
+
+    @pytest.mark.asyncio
+    @patch('src.service.pacing_service.asyncio.sleep')
+    async def test_call_sleeps(self, mock_sleep):
+        await Pacer(distribution='fixed')(1.5)
+        await Pacer('none')(1.5)
+        mock_sleep.assert_called_once_with(1.5)
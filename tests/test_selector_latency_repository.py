@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+
+from src.repository.selector_latency_repository import SelectorLatencies
+
+SITE = 'books.toscrape.com'
+XPATH = '//a[@title="Next"]'
+
+
+class TestSelectorLatencies:
+    def test_no_timeout_until_enough_samples(self, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', min_samples=5)
+        for _ in range(4):
+            latencies.record(SITE, XPATH, .2)
+        assert latencies.timeout_for(SITE, XPATH) is None
+
+    def test_timeout_from_percentile(self, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', percentile=.9, margin=2, min_samples=10, min_timeout=0)
+        for _ in range(9):
+            latencies.record(SITE, XPATH, .1)
+        latencies.record(SITE, XPATH, 5)
+
+        timeout = latencies.timeout_for(SITE, XPATH)
+        assert .2 <= timeout <= .3
+        assert latencies.timeout_for(SITE, XPATH, ceiling=.15) == .15
+
+    def test_missing_optional_element_fails_fast(self, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', min_samples=3, min_timeout=.5)
+        for _ in range(3):
+            latencies.record(SITE, XPATH, 10, found=False)
+        assert latencies.timeout_for(SITE, XPATH) == .5
+        # a required element gets the full wait until it was seen
+        assert latencies.timeout_for(SITE, XPATH, required=True) is None
+
+    def test_timed_out_lookups_widen_the_timeout(self, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', percentile=.5, margin=1.5, min_samples=4, min_timeout=0)
+        for _ in range(4):
+            latencies.record(SITE, XPATH, .1)
+        timeout = latencies.timeout_for(SITE, XPATH)
+
+        # the site got slower, every lookup is cut off at the learned timeout
+        for _ in range(6):
+            latencies.record(SITE, XPATH, timeout, found=False, timeout=timeout)
+
+        assert latencies.timeout_for(SITE, XPATH) > timeout
+        latencies.flush()
+        assert SelectorLatencies(tmp_path / 'latencies.db', percentile=.5, min_samples=4).timeout_for(SITE, XPATH) > timeout
+
+    def test_flush_persists_and_merges(self, tmp_path):
+        path = tmp_path / 'latencies.db'
+        first = SelectorLatencies(path, min_samples=4)
+        second = SelectorLatencies(path, min_samples=4)
+        for _ in range(2):
+            first.record(SITE, XPATH, .3)
+            second.record(SITE, XPATH, .3)
+        first.flush()
+        second.flush()
+
+        assert second.timeout_for(SITE, XPATH) is not None
+        assert SelectorLatencies(path, min_samples=4).timeout_for(SITE, XPATH) == second.timeout_for(SITE, XPATH)
+
+    def test_lookups_recorded_during_a_flush_are_kept(self, tmp_path):
+        latencies = SelectorLatencies(tmp_path / 'latencies.db', min_samples=2)
+        latencies.record(SITE, XPATH, .3)
+        connect = latencies._SelectorLatencies__connect
+
+        @contextmanager
+        def connect_while_recording():
+            # the loop records while the flush thread talks to the database
+            latencies.record(SITE, XPATH, .3)
+            with connect() as conn:
+                yield conn
+
+        latencies._SelectorLatencies__connect = connect_while_recording
+        latencies.flush()
+
+        assert latencies.timeout_for(SITE, XPATH) is not None
+        latencies._SelectorLatencies__connect = connect
+        latencies.flush()
+        assert SelectorLatencies(tmp_path / 'latencies.db', min_samples=2).timeout_for(SITE, XPATH) is not None
@@ -1,10 +1,13 @@
 import asyncio
+import threading
 
 import pytest
 from unittest.mock import patch, Mock, AsyncMock, MagicMock
 
 from custom_fixtures import mock_element
 from src.service.selenium_service import *
+from src.service.pacing_service import Pacer
+from src.service.typing_service import Burst
 from tests.custom_fixtures import xpaths, selectors
 
 @pytest.fixture(scope='module')
@@ -63,9 +66,8 @@ class TestSeleniumUdDriverService:
 
     @pytest.mark.asyncio
     async def test_find_elements_success(self, mock_driver, mock_element, mock_ec, mock_web_driver_wait):
-        mock_web_driver_wait.return_value.until.return_value = True
+        mock_web_driver_wait.return_value.until.return_value = [mock_element]
         action = {'wait': 1, 'xpath': xpaths['uname_input'], 'type': 'click'}
-        mock_driver.return_value.find_elements.return_value = [mock_element]
 
 
         mock_sleep = AsyncMock()
@@ -73,10 +75,11 @@ class TestSeleniumUdDriverService:
         res = await driver.find_elements(by=By.XPATH, value=action['xpath'])
 
         assert res == [mock_element]
-        assert mock_driver.return_value.find_elements.is_called_with(by=By.XPATH, value=action['xpath'])
+        mock_driver.return_value.find_elements.assert_not_called()
         mock_web_driver_wait.return_value.until.assert_called_once()
-        mock_ec.visibility_of_element_located.assert_called_once_with((By.XPATH, action['xpath']))
-        mock_driver.return_value.execute_script.assert_called_once()
+        mock_ec.visibility_of_any_elements_located.assert_called_once_with((By.XPATH, action['xpath']))
+        mock_driver.return_value.execute_script.assert_called_once_with("arguments[0].scrollIntoView(true);",
+                                                                        mock_element)
 
     @pytest.mark.asyncio
     async def test_find_elements_exception(self, mock_driver, mock_element, mock_ec, mock_web_driver_wait):
@@ -93,9 +96,8 @@ class TestSeleniumUdDriverService:
 
     @pytest.mark.asyncio
     async def test_find_element_success(self, mock_driver, mock_element, mock_ec, mock_web_driver_wait):
-        mock_web_driver_wait.return_value.until.return_value = True
+        mock_web_driver_wait.return_value.until.return_value = mock_element
         action = {'wait': 1, 'xpath': xpaths['uname_input'], 'type': 'click'}
-        mock_driver.return_value.find_element.return_value = mock_element
 
 
         mock_sleep = AsyncMock()
@@ -103,7 +105,10 @@ class TestSeleniumUdDriverService:
         res = await driver.find_element(by=By.XPATH, value=action['xpath'])
 
         assert res == mock_element
-        mock_driver.return_value.find_element.assert_called_once_with(by=By.XPATH, value=action['xpath'])
+        # the element comes from the wait, it is not looked up a second time
+        mock_driver.return_value.find_element.assert_not_called()
+        mock_sleep.assert_called_once()
+        mock_web_driver_wait.assert_called_once_with(mock_driver.return_value, 4, poll_frequency=.1)
         mock_web_driver_wait.return_value.until.assert_called_once()
         mock_ec.visibility_of_element_located.assert_called_once_with((By.XPATH, action['xpath']))
         assert mock_driver.return_value.execute_script.is_called_once()
@@ -124,8 +129,10 @@ class TestSeleniumUdDriverService:
     @pytest.mark.asyncio
     async def test_click_element_success(self, mock_driver, mock_element, mock_ec, mock_web_driver_wait,
                                          mock_actions):
-        mock_web_driver_wait.return_value.until.return_value = True
-
+        mock_web_driver_wait.return_value.until.return_value = mock_element
+        mock_driver.return_value.execute_script.return_value = {'x': 300, 'y': 200, 'width': 80, 'height': 30,
+                                                                'viewportWidth': 1280, 'viewportHeight': 720}
+        mock_actions.reset_mock()
 
         mock_sleep = AsyncMock()
         driver = SeleniumUndetectableDriverService(mock_sleep, 1)
@@ -134,24 +141,47 @@ class TestSeleniumUdDriverService:
         mock_sleep.assert_called_once()
         mock_web_driver_wait.return_value.until.assert_called_once()
         mock_ec.element_to_be_clickable.assert_called_once_with(mock_element)
-        mock_actions.return_value.move_to_element.assert_called_once_with(mock_element)
-        mock_actions.return_value.move_to_element.return_value.click.return_value.perform.assert_called_once()
+        # scrolled into the viewport by the script that measures the box
+        mock_driver.return_value.execute_script.assert_called_once_with(CLICK_RECT_SCRIPT, mock_element)
+        # a path of moves ending inside the element and a click, played back from one actions request
+        pointer = mock_actions.return_value.w3c_actions.pointer_action
+        moves = pointer.source.create_pointer_move.call_args_list
+        assert len(moves) > 1
+        assert 300 <= moves[-1].kwargs['x'] <= 380 and 200 <= moves[-1].kwargs['y'] <= 230
+        assert all(move.kwargs['origin'] == 'viewport' for move in moves)
+        pointer.pointer_down.assert_called_once()
+        pointer.pointer_up.assert_called_once()
+        mock_actions.return_value.perform.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_click_at_keeps_the_path_in_the_viewport(self, mock_driver):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        for _ in range(50):
+            with patch('src.service.selenium_service.ActionChains') as mock_chains:
+                # the first click of a session starts at the corner, the bow of the path can leave the viewport
+                await driver.click_at({'x': 2, 'y': 700, 'width': 20, 'height': 15}, viewport=(800, 720))
+
+            moves = mock_chains.return_value.w3c_actions.pointer_action.source.create_pointer_move.call_args_list
+            assert all(0 <= move.kwargs['x'] < 800 and 0 <= move.kwargs['y'] < 720 for move in moves)
 
     @pytest.mark.asyncio
     async def test_click_element_exception(self, mock_driver, mock_element, mock_ec, mock_web_driver_wait,
                                          mock_actions):
         mock_driver.return_value.until.return_value = True
+        mock_driver.return_value.execute_script.return_value = {'x': 0, 'y': 0, 'width': 10, 'height': 10,
+                                                                'viewportWidth': 1280, 'viewportHeight': 720}
 
         mock_sleep = AsyncMock()
         driver = SeleniumUndetectableDriverService(mock_sleep, 1)
         await driver.click_element(element=mock_element)
 
-        mock_actions.return_value.move_to_element.side_effect = Exception('Button not found or clickable')
+        mock_actions.return_value.perform.side_effect = Exception('Button not found or clickable')
         with pytest.raises(Exception) as e:
             driver = SeleniumUndetectableDriverService(mock_sleep, 1)
             await driver.click_element(element=mock_element)
 
             assert e.value == f"Button not found or clickable"
+        mock_actions.return_value.perform.side_effect = None
 
     @pytest.mark.asyncio
     @patch('src.service.selenium_service.SeleniumUndetectableDriverService.click_element')
@@ -162,11 +192,31 @@ class TestSeleniumUdDriverService:
 
         mock_sleep = AsyncMock()
         driver = SeleniumUndetectableDriverService(mock_sleep, 1)
-        await driver.type_input(element=mock_element, action=action)
+        with patch('src.service.selenium_service.ActionChains') as mock_chains:
+            await driver.type_input(element=mock_element, action={**action, 'typing': {'typo_rate': 0}})
 
-        assert mock_sleep.call_count == 3 + len(action['value'])
-        assert mock_element.send_keys.call_count == len(action['value'])
+        # the keystrokes and their pauses are played back by the browser from one actions request
+        assert mock_sleep.call_count == 3
+        typed = [call.args[0] for call in mock_chains.return_value.send_keys.call_args_list]
+        assert ''.join(typed) == action['value']
+        mock_chains.return_value.perform.assert_called_once()
+        mock_element.send_keys.assert_not_called()
         mock_click.assert_called_once()
+        # clear() blurred the element, it is focused again before the keys are played back
+        mock_driver.return_value.execute_script.assert_called_with("arguments[0].focus();", mock_element)
+
+    @pytest.mark.asyncio
+    async def test_type_keys_paced(self, mock_driver):
+        pacer = Pacer(scale=2, distribution='fixed')
+        driver = SeleniumUndetectableDriverService(pacer, 1)
+        bursts = [Burst(.4, ['a', 'b'], [0, .1])]
+        with patch('src.service.selenium_service.ActionChains') as mock_chains:
+            await driver.type_keys(bursts)
+
+        # the pauses played back by the browser are scaled by the pacer and charged to its budget
+        pauses = [call.args[0] for call in mock_chains.return_value.pause.call_args_list]
+        assert pauses == [pytest.approx(.8), pytest.approx(.2)]
+        assert pacer.spent == pytest.approx(1)
 
     @pytest.mark.asyncio
     @patch('src.service.selenium_service.SeleniumUndetectableDriverService.click_element')
@@ -259,4 +309,132 @@ class TestSeleniumUdDriverService:
         driver = SeleniumUndetectableDriverService(mock_sleep, 1)
         driver.close()
 
-        mock_driver.return_value.quit.assert_called_once()
\ No newline at end of file
+        mock_driver.return_value.quit.assert_called_once()
+    @pytest.mark.parametrize('method', ['open_tab', 'open_context'])
+    def test_tabs_and_contexts_not_supported(self, mock_driver, method):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        assert not hasattr(driver, method)
+
+    @pytest.mark.asyncio
+    async def test_set_cookies_skips_other_domains(self, mock_driver):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        mock_driver.return_value.add_cookie.side_effect = [None, Exception('invalid cookie domain')]
+        cookies = [{'name': 'session', 'value': 'abc'}, {'name': 'other', 'value': 'def', 'domain': 'other.com'}]
+
+        await driver.set_cookies(cookies)
+
+        assert mock_driver.return_value.add_cookie.call_count == 2
+
+    def test_implicit_wait_disabled(self, mock_driver):
+        SeleniumUndetectableDriverService(AsyncMock(), 1)
+        mock_driver.return_value.implicitly_wait.assert_called_once_with(0)
+
+    @pytest.mark.asyncio
+    async def test_iter_elements_fetches_chunks(self, mock_driver):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        mock_driver.return_value.execute_script.side_effect = [['a', 'b'], ['c'], None]
+
+        res = [element async for element in driver.iter_elements('//tr', chunk_size=2)]
+
+        assert res == ['a', 'b', 'c']
+        calls = mock_driver.return_value.execute_script.call_args_list
+        assert [call.args[3] for call in calls[:2]] == [0, 2]
+        # one search in the page for the whole iteration, discarded at the end
+        assert calls[0].args[1] == calls[1].args[1] == calls[2].args[1]
+        assert calls[2].args[0] == DISCARD_SEARCH_SCRIPT
+
+    @pytest.mark.asyncio
+    async def test_iter_elements_discards_the_search_when_stopped_early(self, mock_driver):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        mock_driver.return_value.execute_script.side_effect = [['a', 'b'], None]
+
+        elements = driver.iter_elements('//tr', chunk_size=2)
+        assert await elements.__anext__() == 'a'
+        await elements.aclose()
+
+        calls = mock_driver.return_value.execute_script.call_args_list
+        assert calls[-1].args == (DISCARD_SEARCH_SCRIPT, calls[0].args[1])
+
+    @pytest.mark.asyncio
+    async def test_evaluate_batch_single_script(self, mock_driver):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        mock_driver.return_value.execute_async_script.return_value = [[True, 'x'], [False, 'SyntaxError']]
+
+        res = await driver.evaluate_batch(['fetch("/a").then((r) => r.status)', 'null.'], return_exceptions=True)
+
+        assert res[0] == 'x'
+        assert 'SyntaxError' in str(res[1])
+        # the expressions are passed as arguments, a broken one can not break the script around them
+        mock_driver.return_value.execute_async_script.assert_called_once_with(
+            EVALUATE_BATCH_SCRIPT, ['fetch("/a").then((r) => r.status)', 'null.'])
+        with pytest.raises(Exception):
+            await driver.evaluate_batch(['document.title', 'null.'])
+
+    @pytest.mark.asyncio
+    async def test_fill_form_single_script(self, mock_driver):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        mock_driver.return_value.execute_script.side_effect = None
+        mock_driver.return_value.execute_script.return_value = [True]
+
+        res = await driver.fill_form(fields=[{'xpath': '//input', 'value': 'x'}])
+
+        assert res == [True]
+        assert mock_driver.return_value.execute_script.call_args.args[1:] == ([{'locator': '//input', 'value': 'x'}],)
+
+    @pytest.mark.asyncio
+    async def test_browser_download_is_moved_from_staging(self, mock_driver, tmp_path):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        staging = tmp_path / 'staging'
+        staging.mkdir()
+        with patch('src.service.selenium_service.tempfile.mkdtemp', return_value=str(staging)):
+            await driver.set_download_directory(str(tmp_path / 'reports'))
+            await driver.set_download_directory(str(tmp_path / 'reports'))
+
+        mock_driver.return_value.execute_cdp_cmd.assert_called_once_with(
+            'Browser.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': str(staging)})
+        (staging / 'report.pdf.crdownload').write_bytes(b'half')
+        (tmp_path / 'reports' / 'report.pdf').write_bytes(b'older')
+        (staging / 'report.pdf').write_bytes(b'report')
+
+        path = await driver.wait_for_download(timeout=1)
+
+        assert path == str(tmp_path / 'reports' / 'report (1).pdf')
+        assert open(path, 'rb').read() == b'report'
+
+    @pytest.mark.asyncio
+    async def test_browser_download_is_moved_off_the_loop(self, mock_driver, tmp_path):
+        driver = SeleniumUndetectableDriverService(AsyncMock(), 1)
+        with patch('src.service.selenium_service.tempfile.mkdtemp', return_value=str(tmp_path)):
+            await driver.set_download_directory(str(tmp_path / 'reports'))
+        (tmp_path / 'report.pdf').write_bytes(b'report')
+        threads = []
+
+        def move(source, directory, filename):
+            threads.append(threading.current_thread())
+            return os.path.join(directory, filename)
+
+        with patch('src.service.selenium_service.move_download', side_effect=move):
+            await driver.wait_for_download(timeout=1)
+
+        # a copy across file systems must not block the other jobs
+        assert threads and threads[0] is not threading.main_thread()
+
+    @pytest.mark.asyncio
+    async def test_reset_browser_off_the_loop(self):
+        browser = MagicMock()
+        browser.window_handles = ['first', 'popup']
+
+        with patch('src.service.selenium_service.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+            await SeleniumUndetectableDriverService.reset_browser(browser)
+
+        to_thread.assert_called_once()
+        browser.close.assert_called_once()
+        browser.switch_to.window.assert_called_with('first')
+        browser.get.assert_called_once_with('about:blank')
+
+    def test_attaching_to_a_browser_is_rejected(self, mock_driver):
+        with pytest.raises(Exception) as e:
+            SeleniumUndetectableDriverService(AsyncMock(), 1, browser=Mock())
+
+        assert 'only supported by the nodriver driver' in str(e.value)
+        mock_driver.assert_not_called()
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from src.service.shard_service import HashRing, ShardedRunner, shard_jobs, job_domain
+
+
+def run_shard(jobs):
+    """stand-in for the worker process entry point, has to be top level to be picklable"""
+    return [(job['url'], os.getpid()) for job in jobs]
+
+
+def crashing_shard(jobs):
+    """a worker process entry point that fails for one of the sites"""
+    if any('crash' in job['url'] for job in jobs):
+        raise RuntimeError('worker crashed')
+    return [job['url'] for job in jobs]
+
+
+class TestHashRing:
+    def test_shard_for_is_stable(self):
+        ring = HashRing(4)
+        assert ring.shard_for('books.toscrape.com') == HashRing(4).shard_for('books.toscrape.com')
+        assert 0 <= ring.shard_for('books.toscrape.com') < 4
+
+    def test_keys_spread_across_shards(self):
+        ring = HashRing(4)
+        shards = {ring.shard_for(f'site{i}.com') for i in range(200)}
+        assert shards == {0, 1, 2, 3}
+
+    def test_adding_a_shard_moves_few_keys(self):
+        keys = [f'site{i}.com' for i in range(1000)]
+        before = HashRing(4)
+        after = HashRing(5)
+        moved = sum(before.shard_for(key) != after.shard_for(key) for key in keys)
+        # roughly 1/5 of the keys should move, far from the ~4/5 a modulo hash would move
+        assert moved < len(keys) * .35
+
+    def test_invalid_shard_count(self):
+        with pytest.raises(ValueError):
+            HashRing(0)
+
+
+def test_job_domain():
+    assert job_domain({'url': 'https://books.toscrape.com/catalogue/page-2.html'}) == 'books.toscrape.com'
+    assert job_domain({}) == ''
+
+
+def test_shard_jobs_keeps_domains_together():
+    jobs = [{'url': f'https://site{i % 5}.com/page{i}'} for i in range(50)]
+    shards = shard_jobs(jobs, 3)
+
+    assert sorted(index for shard in shards for index, _ in shard) == list(range(50))
+    for shard in shards:
+        for index, job in shard:
+            assert jobs[index] is job
+    domains = [{job_domain(job) for _, job in shard} for shard in shards]
+    for i, shard_domains in enumerate(domains):
+        for other in domains[i + 1:]:
+            assert not shard_domains & other
+
+
+class TestShardedRunner:
+    @pytest.mark.asyncio
+    async def test_run_in_processes(self):
+        jobs = [{'url': f'https://site{i}.com/'} for i in range(6)]
+        results = await ShardedRunner(run_shard, processes=2).run(jobs)
+
+        assert [url for url, _ in results] == [job['url'] for job in jobs]
+        assert os.getpid() not in {pid for _, pid in results}
+
+    @pytest.mark.asyncio
+    async def test_crashed_shard_only_fails_its_jobs(self):
+        jobs = [{'url': 'https://crash.com/'}] + [{'url': f'https://site{i}.com/'} for i in range(6)]
+        ring = HashRing(3)
+        crashed = ring.shard_for('crash.com')
+
+        results = await ShardedRunner(crashing_shard, processes=3).run(jobs)
+
+        for job, result in zip(jobs, results):
+            if ring.shard_for(job_domain(job)) == crashed:
+                assert result.error == "RuntimeError('worker crashed')"
+            else:
+                assert result == job['url']
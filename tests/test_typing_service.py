@@ -0,0 +1,55 @@
+import random
+
+from src.service.typing_service import KeystrokeModel, BACKSPACE, NEIGHBOURS
+
+
+def typed_text(bursts):
+    """the text the bursts leave in an input"""
+    text = []
+    for burst in bursts:
+        for key in burst.keys:
+            if key == BACKSPACE:
+                text.pop()
+            else:
+                text.append(key)
+    return ''.join(text)
+
+
+class TestKeystrokeModel:
+    def test_schedule_types_the_text(self):
+        model = KeystrokeModel(rng=random.Random(1), typo_rate=.3)
+        text = 'Not a bot, honest 123'
+
+        bursts = model.schedule(text)
+
+        assert typed_text(bursts) == text
+        assert len(bursts) > 1
+        assert all(len(burst.keys) == len(burst.intervals) for burst in bursts)
+
+    def test_typos_are_corrected_on_a_neighbouring_key(self):
+        model = KeystrokeModel(rng=random.Random(3), typo_rate=1, burst_max=20)
+
+        bursts = model.schedule('ab')
+
+        assert bursts[0].keys[0] in NEIGHBOURS['a']
+        # noticing the typo ends the burst, the next one starts by correcting it
+        assert bursts[1].keys[:2] == [BACKSPACE, 'a']
+        assert bursts[1].pause > 0
+        assert typed_text(bursts) == 'ab'
+
+    def test_bursts_and_timing(self):
+        model = KeystrokeModel(interval=.1, burst_min=4, burst_max=4, pause=.5, typo_rate=0, rng=random.Random(2))
+
+        bursts = model.schedule('abcdefghij')
+
+        assert [len(burst.keys) for burst in bursts] == [4, 4, 2]
+        assert bursts[0].pause == 0 and bursts[1].pause > 0
+        assert bursts[0].intervals[0] == 0
+        assert 0 < KeystrokeModel.duration(bursts) < 5
+
+    def test_from_action(self):
+        model = KeystrokeModel.from_action({'wait': 1, 'typing': {'typo_rate': 0, 'pause': 0}})
+
+        assert model.interval == .2
+        assert model.typo_rate == 0
+        assert KeystrokeModel.from_action({}).interval == .1
@@ -6,6 +6,7 @@ from src.service.util_service import CustomDriver
 from src.service.nodriver_service import NoDriverService
 from src.service.selenium_service import SeleniumUndetectableDriverService
 import asyncio
+import time
 from unittest.mock import patch, Mock, mock_open, MagicMock
 
 from src.service.util_service import *
@@ -90,17 +91,26 @@ def test_get_date_range_tuple():
         [{"file_prefixes": ['file1', 'latest_file']}],
         indirect=True
     )
-@patch('src.service.util_service.glob.glob')
-def test_get_most_recent_download_file(mock_glob ,create_test_files):
+def test_get_most_recent_download_file(create_test_files):
     """
     Test getting most recent download file from Downloads folder
-    Ideally the folder path would be an input variable, but I did not write the code,
-    so I can just mock the glob.glob return value
     """
-    mock_glob.return_value = create_test_files
-    res = get_most_recent_downloaded_file('file/path')
+    folder = os.path.split(create_test_files[0])[0]
+    res = get_most_recent_downloaded_file(folder)
     filename = os.path.split(res)[1]
     assert filename.startswith('latest_file')
+    # the old glob pattern still works
+    assert get_most_recent_downloaded_file(f'{folder}/*') == res
+
+
+def test_get_most_recent_download_file_skips_partial_downloads(tmp_path):
+    (tmp_path / 'report.pdf').write_text('done')
+    time.sleep(.01)
+    (tmp_path / 'next.pdf.crdownload').write_text('half')
+
+    assert get_most_recent_downloaded_file(str(tmp_path)) == str(tmp_path / 'report.pdf')
+    (tmp_path / 'report.pdf').unlink()
+    assert get_most_recent_downloaded_file(str(tmp_path)) is None
 
 class TestCheckPath:
     @patch('src.service.util_service.os')